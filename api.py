@@ -1,28 +1,170 @@
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Depends
+from fastapi.responses import HTMLResponse, JSONResponse, Response, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from aiogram.types import Update
 import json
+import hashlib
 import random
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 from typing import Optional
 
-from database import get_session
-from models import User, Car, AvitoListing
+from database import get_session, get_read_session, init_db, mark_written, engine, read_engine
+from models import User, Car, RaceHistory, FightHistory, TURBO_TIERS, SUSPENSION_TIERS, SUBWOOFER_TIERS
 from sqlalchemy import select, update
-from bot import dp, bot
-from config import WEBAPP_URL
+from sqlalchemy.ext.asyncio import AsyncSession
+from bot import dp, bot, fsm_storage, outbox
+from config import (
+    WEBAPP_URL, LEADERBOARD_RECONCILE_SECONDS,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_DEDUP_WINDOW, WEBHOOK_REGISTER,
+    AUTH_TOKEN_TTL, SSE_HEARTBEAT_SECONDS,
+    LISTING_RESERVATION_SECONDS, LISTING_MAX_AGE_DAYS, LISTING_EXPIRE_INTERVAL, LISTING_EXPIRE_BATCH
+)
+from market import fetch_listings_page, InvalidCursor, DEFAULT_PAGE_SIZE
+import market
+from inventory import add_item, fetch_inventory_page
+from history import recorder, fetch_history_page
+from repository import load_user_with_car, load_user, user_changed
+from cache import user_cache
+import ledger
+import race_engine
+from leaderboard import leaderboard, METRICS
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from webhook_queue import UpdateQueue
+from process_lock import FileLock, exclusive
+from rate_limit import RateLimited, rate_limited, limiter
+from auth import AuthError, require_user, check_owner, verify_init_data, issue_token, sessions
+import events
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Фоновые задачи приложения (чтобы их не собрал GC и можно было остановить)
+background_tasks = set()
+
+# Входящие апдейты Telegram обрабатываются в фоне пулом обработчиков
+update_queue = UpdateQueue(
+    lambda update: dp.feed_update(bot, update),
+    workers=WEBHOOK_WORKERS,
+    maxsize=WEBHOOK_QUEUE_SIZE,
+    dedup_window=WEBHOOK_DEDUP_WINDOW
+)
+
+# Держит тот воркер, который зарегистрировал вебхук, до своей остановки
+webhook_owner = FileLock("webhook")
+
+# ---------- МЕТРИКИ ----------
+metrics.track_queries(engine)
+if read_engine is not engine:
+    metrics.track_queries(read_engine)
+
+metrics.gauge(
+    "cache_hit_ratio", "Hit ratio of in-process caches", labels=("cache",),
+    collect=lambda: {
+        ("user_state",): user_cache.stats()["hit_ratio"],
+        ("fsm",): fsm_storage.stats()["hit_ratio"],
+        ("auth_sessions",): sessions.stats()["hit_ratio"],
+    }
+)
+metrics.gauge("webhook_queue_depth", "Updates waiting in the webhook queue", collect=update_queue.depth)
+metrics.counter(
+    "webhook_updates_total", "Webhook updates by outcome", labels=("outcome",),
+    collect=lambda: {
+        (outcome,): value for outcome, value in update_queue.stats().items()
+        if outcome in ("enqueued", "processed", "failed", "duplicates", "rejected")
+    }
+)
+metrics.gauge("outbox_depth", "Bot messages waiting to be sent", collect=outbox.depth)
+metrics.counter(
+    "outbox_messages_total", "Outgoing bot messages by outcome", labels=("outcome",),
+    collect=lambda: {
+        (outcome,): value for outcome, value in outbox.stats().items()
+        if outcome in ("sent", "failed", "retried", "coalesced")
+    }
+)
+metrics.gauge("history_buffer_depth", "Race and fight records waiting to be written", collect=recorder.depth)
+metrics.gauge("sse_connections", "Open server-sent event streams", collect=events.bus.connections)
+metrics.counter(
+    "rate_limit_total", "Rate limiter decisions", labels=("action", "result"),
+    collect=lambda: {
+        (action, result): value
+        for action, counts in limiter.stats().items()
+        for result, value in counts.items()
+    }
+)
+
+# ---------- ЖИЗНЕННЫЙ ЦИКЛ ----------
+async def register_webhook():
+    """Регистрирует вебхук, если этот воркер первым захватил блокировку"""
+    if not WEBHOOK_REGISTER or not webhook_owner.acquire(blocking=False):
+        return
+    try:
+        await bot.set_webhook(
+            f"{WEBAPP_URL}/webhook",
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        logger.info("Webhook registered by worker %s", os.getpid())
+    except Exception:
+        logger.exception("Webhook registration failed")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Схема и миграции: воркеры проходят по очереди, первый применяет,
+    # остальные видят в schema_migrations, что все уже сделано
+    async with exclusive("init_db"):
+        await init_db()
+    
+    update_queue.start()
+    fsm_storage.start()
+    recorder.start()
+    # Первая сверка внутри задачи: рейтинг заполнится сразу после старта
+    background_tasks.add(asyncio.create_task(leaderboard.run_reconciler(LEADERBOARD_RECONCILE_SECONDS)))
+    background_tasks.add(asyncio.create_task(metrics.watch_loop_lag()))
+    background_tasks.add(asyncio.create_task(market.run_expirer(
+        LISTING_EXPIRE_INTERVAL, timedelta(days=LISTING_MAX_AGE_DAYS), LISTING_EXPIRE_BATCH
+    )))
+    await register_webhook()
+    
+    yield
+    
+    events.bus.close()
+    await update_queue.stop()
+    # После очереди: обработанные апдейты могли изменить состояния диалогов и поставить сообщения
+    await fsm_storage.close()
+    await recorder.close()
+    await outbox.stop()
+    for task in background_tasks:
+        task.cancel()
+    await bot.session.close()
+    await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
+    webhook_owner.release()
 
 # СОЗДАЕМ ОБЪЕКТ APP - ЭТО САМОЕ ВАЖНОЕ!
-app = FastAPI(title="Gunter Life API")
+app = FastAPI(title="Gunter Life API", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 # Подключаем статические файлы (HTML, CSS, JS)
 if os.path.exists("webapp"):
     app.mount("/static", StaticFiles(directory="webapp"), name="static")
     templates = Jinja2Templates(directory="webapp")
 
+@app.exception_handler(AuthError)
+async def auth_error_handler(request: Request, error: AuthError):
+    return JSONResponse({"error": error.message}, status_code=error.status_code)
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, error: RateLimited):
+    return JSONResponse(
+        {"error": f"Слишком часто! Подожди {error.retry_after_seconds} сек."},
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after_seconds)}
+    )
+
 # ---------- ГЛАВНАЯ СТРАНИЦА ----------
 @app.get("/")
 async def root():
@@ -35,7 +177,21 @@ async def root():
 # ---------- HEALTH CHECK ----------
 @app.get("/health")
 async def health():
-    return {"status": "ok"}
+    return {
+        "status": "ok",
+        "webhook_queue": update_queue.stats(),
+        "fsm_storage": fsm_storage.stats(),
+        "outbox": outbox.stats(),
+        "rate_limit": limiter.stats(),
+        "auth_sessions": sessions.stats(),
+        "events": events.bus.stats(),
+        "history": recorder.stats()
+    }
+
+# ---------- МЕТРИКИ PROMETHEUS ----------
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
 
 # ---------- ВЕБХУК ДЛЯ ТЕЛЕГРАМ БОТА ----------
 @app.post("/webhook")
@@ -43,18 +199,53 @@ async def webhook(request: Request):
     """Эндпоинт для вебхуков от Telegram"""
     try:
         update_data = await request.json()
-        print(f"Received update: {update_data.get('update_id')}")
-        
-        # Создаем объект Update и передаем его диспетчеру
         update = Update.model_validate(update_data, context={"bot": bot})
-        await dp.feed_update(bot, update)
-        
-        return {"ok": True}
     except Exception as e:
-        print(f"Webhook error: {e}")
-        import traceback
-        traceback.print_exc()
+        # Битый апдейт повторять бессмысленно - отвечаем 200, чтобы Telegram его не слал снова
+        logger.warning("Webhook error: %s", e)
         return {"ok": False, "error": str(e)}
+    
+    # Обработка идет в фоне, Telegram получает ответ сразу
+    if not update_queue.submit(update):
+        return JSONResponse({"ok": False, "error": "Queue is full"}, status_code=503)
+    
+    return {"ok": True}
+
+# ---------- АВТОРИЗАЦИЯ МИНИ-ПРИЛОЖЕНИЯ ----------
+@app.post("/api/auth")
+async def authorize(request: Request):
+    """Меняет подписанную Telegram initData на короткоживущий токен сессии"""
+    try:
+        data = await request.json()
+    except ValueError:
+        raise AuthError("Нужна initData")
+    user = verify_init_data(data.get("init_data", "") if isinstance(data, dict) else "")
+    return {
+        "token": issue_token(user["id"]),
+        "tg_id": user["id"],
+        "expires_in": int(AUTH_TOKEN_TTL)
+    }
+
+# ---------- PUSH-СОБЫТИЯ (SSE) ----------
+@app.get("/api/events/{tg_id}")
+async def event_stream(tg_id: int, token: Optional[str] = None, topics: str = ""):
+    """Поток событий для мини-приложения: личный топик игрока и выбранные общие.
+
+    EventSource не умеет слать заголовки, поэтому токен - в параметре token.
+    """
+    check_owner(tg_id, token)
+    names = {events.user_topic(tg_id)} | (set(topics.split(",")) & events.PUBLIC_TOPICS)
+    
+    subscription = events.bus.subscribe(tg_id, names)
+    if subscription is None:
+        return JSONResponse({"error": "Too many connections"}, status_code=503)
+    
+    return StreamingResponse(
+        events.stream(subscription, SSE_HEARTBEAT_SECONDS),
+        media_type="text/event-stream",
+        # Без буферизации в nginx и кэшей: события должны уходить сразу
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # ---------- ГЛАВНАЯ СТРАНИЦА ГАРАЖА ----------
 @app.get("/garage", response_class=HTMLResponse)
@@ -66,459 +257,618 @@ async def garage_page(request: Request):
 async def avito_page(request: Request):
     return templates.TemplateResponse("avito.html", {"request": request})
 
+# ---------- СОСТОЯНИЕ ИГРОКА ----------
+def build_user_state(user: User, car: Optional[Car]) -> dict:
+    """Документ состояния игрока и машины, который отдает /api/user/{tg_id}"""
+    car_data = None
+    if car:
+        try:
+            perf = car.performance
+            car_data = {
+                "id": car.id,
+                "name": car.name,
+                "engine_level": car.engine_level,
+                "engine_power": car.engine_power_multiplier,
+                "turbo_level": car.turbo_level,
+                "suspension_level": car.suspension_level,
+                "valves_tuned": car.valves_tuned,
+                "valves_quality": car.valves_tune_quality,
+                "engine_tuned": car.engine_tuned,
+                "engine_tune_power": car.engine_tune_power,
+                "wiring_quality": car.wiring_quality,
+                "subwoofer_level": car.subwoofer_level,
+                "subwoofer_brand": car.subwoofer_brand,
+                "music_genre": car.music_genre,
+                "body_kit": car.body_kit,
+                "tint_level": car.tint_level,
+                "condition": car.condition,
+                "performance": perf
+            }
+        except Exception:
+            logger.exception("Error calculating performance for car %s", car.id)
+            car_data = {"error": "Could not calculate performance"}
+    
+    state = {
+        "id": user.id,
+        "tg_id": user.tg_id,
+        "username": user.username,
+        "first_name": user.first_name,
+        "balance_cash": user.balance_cash,
+        "balance_token": user.balance_token,
+        "garage_level": user.garage_level,
+        "reputation": user.reputation,
+        "races_won": user.races_won,
+        "car": car_data
+    }
+    
+    # Версия - хэш содержимого: меняется ровно тогда, когда меняется документ
+    raw = json.dumps(state, sort_keys=True, ensure_ascii=False, default=str)
+    state["version"] = hashlib.sha1(raw.encode()).hexdigest()[:16]
+    return state
+
+def state_etag(state: dict) -> str:
+    return f'"{state["version"]}"'
+
+async def refresh_user_state(user: User, car: Optional[Car]) -> dict:
+    """Собирает свежее состояние после коммита и кладет его в кэш"""
+    state = build_user_state(user, car)
+    mark_written(user.tg_id)
+    await user_cache.set(user.tg_id, state)
+    # Другие открытые окна игрока получают новое состояние сразу
+    events.bus.publish(events.user_topic(user.tg_id), "user", {"state": state})
+    return state
+
+def mutation_response(payload: dict, state: dict) -> JSONResponse:
+    """Ответ на изменение: результат действия + полное новое состояние игрока"""
+    payload["state"] = state
+    return JSONResponse(payload, headers={"ETag": state_etag(state)})
+
 # ---------- API: ПОЛУЧИТЬ ДАННЫЕ ИГРОКА ----------
-@app.get("/api/user/{tg_id}")
-async def get_user(tg_id: int):
-    async for session in get_session():
-        # Ищем пользователя
-        result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = result.scalar_one_or_none()
+@app.get("/api/user/{tg_id}", dependencies=[Depends(require_user)])
+async def get_user(tg_id: int, request: Request, session: AsyncSession = Depends(get_read_session)):
+    state = await user_cache.get(tg_id)
+    
+    if state is None:
+        # Запись, закоммиченная пока идет чтение, не перетирается устаревшим состоянием
+        token = user_cache.begin_fill(tg_id)
+        user, car = await load_user_with_car(session, tg_id)
+        state = build_user_state(user, car) if user else None
+        await user_cache.fill(tg_id, state, token)
         
         if not user:
             return JSONResponse({"error": "User not found"}, status_code=404)
-        
-        # Ищем машину
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
-        car_data = None
-        if car:
-            try:
-                perf = car.calculate_performance()
-                car_data = {
-                    "id": car.id,
-                    "name": car.name,
-                    "engine_level": car.engine_level,
-                    "engine_power": car.engine_power_multiplier,
-                    "turbo_level": car.turbo_level,
-                    "suspension_level": car.suspension_level,
-                    "valves_tuned": car.valves_tuned,
-                    "valves_quality": car.valves_tune_quality,
-                    "engine_tuned": car.engine_tuned,
-                    "engine_tune_power": car.engine_tune_power,
-                    "wiring_quality": car.wiring_quality,
-                    "subwoofer_level": car.subwoofer_level,
-                    "subwoofer_brand": car.subwoofer_brand,
-                    "music_genre": car.music_genre,
-                    "body_kit": car.body_kit,
-                    "tint_level": car.tint_level,
-                    "condition": car.condition,
-                    "performance": perf
-                }
-            except Exception as e:
-                print(f"Error calculating performance: {e}")
-                car_data = {"error": "Could not calculate performance"}
-        
-        return {
-            "id": user.id,
-            "tg_id": user.tg_id,
-            "username": user.username,
-            "first_name": user.first_name,
-            "balance_cash": user.balance_cash,
-            "balance_token": user.balance_token,
-            "garage_level": user.garage_level,
-            "reputation": user.reputation,
-            "races_won": user.races_won,
-            "inventory": user.inventory,
-            "car": car_data
-        }
+    
+    # Условный GET: если у клиента та же версия, тело не шлем
+    etag = state_etag(state)
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    return JSONResponse(state, headers={"ETag": etag})
 
 # ---------- API: НАСТРОЙКА КЛАПАНОВ ----------
-@app.post("/api/tune/valves/{tg_id}")
-async def tune_valves(tg_id: int):
-    async for session in get_session():
-        user_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return JSONResponse({"error": "User not found"}, status_code=404)
-        
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
-        if not car:
-            return JSONResponse({"error": "No car found"}, status_code=404)
-        
-        if user.balance_cash < 500:
-            return JSONResponse({"error": "Недостаточно средств! Нужно 500$"}, status_code=400)
-        
-        user.balance_cash -= 500
-        
-        base_chance = 0.5 + (user.garage_level * 0.1)
-        success = random.random() < base_chance
-        
-        if success:
-            quality = 0.6 + (user.garage_level * 0.1) + random.random() * 0.2
-            car.valves_tuned = True
-            car.valves_tune_quality = min(quality, 1.0)
-            message = "✅ Клапана настроены идеально! Машина поёт!"
-        else:
-            car.valves_tuned = False
-            car.valves_tune_quality = 0.0
-            message = "❌ Неудачная настройка! Клапана стучат, нужно переделывать."
-        
-        await session.commit()
-        perf = car.calculate_performance()
-        
-        return {
-            "success": success,
-            "message": message,
-            "valves_tuned": car.valves_tuned,
-            "valves_quality": car.valves_tune_quality,
-            "new_power": perf['power'],
-            "balance": user.balance_cash
-        }
+@app.post("/api/tune/valves/{tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("tune"))])
+async def tune_valves(tg_id: int, session: AsyncSession = Depends(get_session)):
+    user, car = await load_user_with_car(session, tg_id, for_update=True)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    if not car:
+        return JSONResponse({"error": "No car found"}, status_code=404)
+    
+    try:
+        await ledger.apply(session, user.id, cash=-500, reason="tune_valves")
+    except ledger.InsufficientFunds:
+        return JSONResponse({"error": "Недостаточно средств! Нужно 500$"}, status_code=400)
+    
+    base_chance = 0.5 + (user.garage_level * 0.1)
+    success = random.random() < base_chance
+    
+    if success:
+        quality = 0.6 + (user.garage_level * 0.1) + random.random() * 0.2
+        car.valves_tuned = True
+        car.valves_tune_quality = min(quality, 1.0)
+        message = "✅ Клапана настроены идеально! Машина поёт!"
+    else:
+        car.valves_tuned = False
+        car.valves_tune_quality = 0.0
+        message = "❌ Неудачная настройка! Клапана стучат, нужно переделывать."
+    
+    await session.commit()
+    state = await refresh_user_state(user, car)
+    perf = car.performance
+    
+    return mutation_response({
+        "success": success,
+        "message": message,
+        "valves_tuned": car.valves_tuned,
+        "valves_quality": car.valves_tune_quality,
+        "new_power": perf['power'],
+        "balance": user.balance_cash
+    }, state)
 
 # ---------- API: НАСТРОЙКА ДВИГАТЕЛЯ ----------
-@app.post("/api/tune/engine/{tg_id}")
-async def tune_engine(tg_id: int):
-    async for session in get_session():
-        user_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return JSONResponse({"error": "User not found"}, status_code=404)
-            
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
-        if not car:
-            return JSONResponse({"error": "No car found"}, status_code=404)
-        
-        if user.balance_cash < 1000:
-            return JSONResponse({"error": "Недостаточно средств! Нужно 1000$"}, status_code=400)
-        
-        user.balance_cash -= 1000
-        tune_power = 0.05 + (user.garage_level * 0.03) + random.random() * 0.08
-        
-        car.engine_tuned = True
-        car.engine_tune_power = min(tune_power, 0.25)
-        
-        await session.commit()
-        perf = car.calculate_performance()
-        
-        return {
-            "success": True,
-            "message": f"🔧 Двигатель настроен! +{car.engine_tune_power*100:.0f}% к мощности",
-            "engine_tune_power": car.engine_tune_power,
-            "new_power": perf['power'],
-            "balance": user.balance_cash
-        }
+@app.post("/api/tune/engine/{tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("tune"))])
+async def tune_engine(tg_id: int, session: AsyncSession = Depends(get_session)):
+    user, car = await load_user_with_car(session, tg_id, for_update=True)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    if not car:
+        return JSONResponse({"error": "No car found"}, status_code=404)
+    
+    try:
+        await ledger.apply(session, user.id, cash=-1000, reason="tune_engine")
+    except ledger.InsufficientFunds:
+        return JSONResponse({"error": "Недостаточно средств! Нужно 1000$"}, status_code=400)
+    
+    tune_power = 0.05 + (user.garage_level * 0.03) + random.random() * 0.08
+    
+    car.engine_tuned = True
+    car.engine_tune_power = min(tune_power, 0.25)
+    
+    await session.commit()
+    state = await refresh_user_state(user, car)
+    perf = car.performance
+    
+    return mutation_response({
+        "success": True,
+        "message": f"🔧 Двигатель настроен! +{car.engine_tune_power*100:.0f}% к мощности",
+        "engine_tune_power": car.engine_tune_power,
+        "new_power": perf['power'],
+        "balance": user.balance_cash
+    }, state)
 
 # ---------- API: УСТАНОВКА ТУРБИНЫ ----------
-@app.post("/api/upgrade/turbo/{tg_id}")
-async def upgrade_turbo(tg_id: int, level: int):
-    async for session in get_session():
-        user_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return JSONResponse({"error": "User not found"}, status_code=404)
-            
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
-        if not car:
-            return JSONResponse({"error": "No car found"}, status_code=404)
-        
-        turbo_prices = {1: 2000, 2: 5000, 3: 10000}
-        
-        if level not in turbo_prices:
-            return JSONResponse({"error": "Invalid turbo level"}, status_code=400)
-        
-        price = turbo_prices[level]
-        
-        if user.balance_cash < price:
-            return JSONResponse({"error": "Недостаточно средств!"}, status_code=400)
-        
-        user.balance_cash -= price
-        car.turbo_level = level
-        
-        await session.commit()
-        perf = car.calculate_performance()
-        
-        boost_percent = {1: 15, 2: 30, 3: 50}
-        
-        return {
-            "success": True,
-            "message": f"💨 Установлена турбина {level} уровня! +{boost_percent[level]}% мощности",
-            "turbo_level": car.turbo_level,
-            "new_power": perf['power'],
-            "balance": user.balance_cash
-        }
+@app.post("/api/upgrade/turbo/{tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("tune"))])
+async def upgrade_turbo(tg_id: int, level: int, session: AsyncSession = Depends(get_session)):
+    user, car = await load_user_with_car(session, tg_id, for_update=True)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    if not car:
+        return JSONResponse({"error": "No car found"}, status_code=404)
+    
+    tier = TURBO_TIERS.get(level)
+    
+    if not tier or not tier["price"]:
+        return JSONResponse({"error": "Invalid turbo level"}, status_code=400)
+    
+    price = tier["price"]
+    
+    try:
+        await ledger.apply(session, user.id, cash=-price, reason="upgrade_turbo", ref=f"level:{level}")
+    except ledger.InsufficientFunds:
+        return JSONResponse({"error": "Недостаточно средств!"}, status_code=400)
+    
+    car.turbo_level = level
+    
+    await session.commit()
+    state = await refresh_user_state(user, car)
+    perf = car.performance
+    
+    return mutation_response({
+        "success": True,
+        "message": f"💨 Установлена турбина {level} уровня! +{tier['boost']*100:.0f}% мощности",
+        "turbo_level": car.turbo_level,
+        "new_power": perf['power'],
+        "balance": user.balance_cash
+    }, state)
 
 # ---------- API: УСТАНОВКА ПОДВЕСКИ ----------
-@app.post("/api/upgrade/suspension/{tg_id}")
-async def upgrade_suspension(tg_id: int, level: int):
-    async for session in get_session():
-        user_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return JSONResponse({"error": "User not found"}, status_code=404)
-            
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
-        if not car:
-            return JSONResponse({"error": "No car found"}, status_code=404)
-        
-        suspension_prices = {1: 1500, 2: 3500, 3: 7000}
-        
-        if level not in suspension_prices:
-            return JSONResponse({"error": "Invalid suspension level"}, status_code=400)
-        
-        price = suspension_prices[level]
-        
-        if user.balance_cash < price:
-            return JSONResponse({"error": "Недостаточно средств!"}, status_code=400)
-        
-        user.balance_cash -= price
-        car.suspension_level = level
-        
-        if level == 1:
-            car.handling_bonus = 1.2
-        elif level == 2:
-            car.handling_bonus = 1.4
-        elif level == 3:
-            car.handling_bonus = 1.7
-        
-        await session.commit()
-        perf = car.calculate_performance()
-        
-        return {
-            "success": True,
-            "message": f"🔩 Установлена подвеска {level} уровня! Управляемость улучшена",
-            "suspension_level": car.suspension_level,
-            "handling": perf['handling'],
-            "balance": user.balance_cash
-        }
+@app.post("/api/upgrade/suspension/{tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("tune"))])
+async def upgrade_suspension(tg_id: int, level: int, session: AsyncSession = Depends(get_session)):
+    user, car = await load_user_with_car(session, tg_id, for_update=True)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    if not car:
+        return JSONResponse({"error": "No car found"}, status_code=404)
+    
+    tier = SUSPENSION_TIERS.get(level)
+    
+    if not tier or not tier["price"]:
+        return JSONResponse({"error": "Invalid suspension level"}, status_code=400)
+    
+    price = tier["price"]
+    
+    try:
+        await ledger.apply(session, user.id, cash=-price, reason="upgrade_suspension", ref=f"level:{level}")
+    except ledger.InsufficientFunds:
+        return JSONResponse({"error": "Недостаточно средств!"}, status_code=400)
+    
+    car.suspension_level = level
+    car.handling_bonus = tier["handling_bonus"]
+    
+    await session.commit()
+    state = await refresh_user_state(user, car)
+    perf = car.performance
+    
+    return mutation_response({
+        "success": True,
+        "message": f"🔩 Установлена подвеска {level} уровня! Управляемость улучшена",
+        "suspension_level": car.suspension_level,
+        "handling": perf['handling'],
+        "balance": user.balance_cash
+    }, state)
 
 # ---------- API: УСТАНОВКА САБВУФЕРА ----------
-@app.post("/api/upgrade/subwoofer/{tg_id}")
-async def upgrade_subwoofer(tg_id: int, level: int, brand: str, genre: str):
-    async for session in get_session():
-        user_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return JSONResponse({"error": "User not found"}, status_code=404)
-            
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
-        if not car:
-            return JSONResponse({"error": "No car found"}, status_code=404)
-        
-        sub_prices = {1: 1000, 2: 3000, 3: 6000}
-        
-        if level not in sub_prices:
-            return JSONResponse({"error": "Invalid subwoofer level"}, status_code=400)
-        
-        price = sub_prices[level]
-        
-        if user.balance_cash < price:
-            return JSONResponse({"error": "Недостаточно средств!"}, status_code=400)
-        
-        user.balance_cash -= price
-        car.subwoofer_level = level
-        car.subwoofer_brand = brand
-        car.music_genre = genre
-        car.subwoofer_power = level * 500
-        
-        await session.commit()
-        
-        return {
-            "success": True,
-            "message": f"🔊 Установлен сабвуфер {brand}! {car.subwoofer_power}Вт, играет {genre}",
-            "subwoofer_level": car.subwoofer_level,
-            "subwoofer_power": car.subwoofer_power,
-            "music_genre": car.music_genre,
-            "balance": user.balance_cash
-        }
-
-# ---------- API: АВИТО - ПОЛУЧИТЬ ВСЕ ОБЪЯВЛЕНИЯ ----------
+@app.post("/api/upgrade/subwoofer/{tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("tune"))])
+async def upgrade_subwoofer(tg_id: int, level: int, brand: str, genre: str, session: AsyncSession = Depends(get_session)):
+    user, car = await load_user_with_car(session, tg_id, for_update=True)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    if not car:
+        return JSONResponse({"error": "No car found"}, status_code=404)
+    
+    tier = SUBWOOFER_TIERS.get(level)
+    
+    if not tier or not tier["price"]:
+        return JSONResponse({"error": "Invalid subwoofer level"}, status_code=400)
+    
+    price = tier["price"]
+    
+    try:
+        await ledger.apply(session, user.id, cash=-price, reason="upgrade_subwoofer", ref=f"level:{level}")
+    except ledger.InsufficientFunds:
+        return JSONResponse({"error": "Недостаточно средств!"}, status_code=400)
+    
+    car.subwoofer_level = level
+    car.subwoofer_brand = brand
+    car.music_genre = genre
+    car.subwoofer_power = tier["power"]
+    
+    await session.commit()
+    state = await refresh_user_state(user, car)
+    
+    return mutation_response({
+        "success": True,
+        "message": f"🔊 Установлен сабвуфер {brand}! {car.subwoofer_power}Вт, играет {genre}",
+        "subwoofer_level": car.subwoofer_level,
+        "subwoofer_power": car.subwoofer_power,
+        "music_genre": car.music_genre,
+        "balance": user.balance_cash
+    }, state)
+
+# ---------- API: АВИТО - ЛЕНТА ОБЪЯВЛЕНИЙ (ПОСТРАНИЧНО) ----------
 @app.get("/api/avito/listings")
-async def get_listings():
-    async for session in get_session():
-        result = await session.execute(
-            select(AvitoListing).where(AvitoListing.is_sold == False)
+async def get_listings(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    item_type: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    try:
+        return await fetch_listings_page(
+            session,
+            cursor=cursor,
+            limit=limit,
+            item_type=item_type,
+            min_price=min_price,
+            max_price=max_price
         )
-        listings = result.scalars().all()
-        
-        result_data = []
-        for listing in listings:
-            seller_result = await session.execute(
-                select(User).where(User.id == listing.seller_id)
-            )
-            seller = seller_result.scalar_one()
-            
-            result_data.append({
-                "id": listing.id,
-                "seller_username": seller.username,
-                "seller_tg_id": seller.tg_id,
-                "item_type": listing.item_type,
-                "item_data": listing.item_data,
-                "price": listing.price,
-                "description": listing.description,
-                "created_at": listing.created_at.isoformat() if listing.created_at else None
-            })
-        
-        return result_data
+    except InvalidCursor:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+
+# ---------- API: АВИТО - ПОИСК ----------
+@app.get("/api/avito/search")
+async def search_listings(
+    q: Optional[str] = None,
+    item_type: Optional[str] = None,
+    price: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    session: AsyncSession = Depends(get_read_session)
+):
+    try:
+        return await market.search_listings(
+            session,
+            query=q,
+            item_type=item_type,
+            price_bucket=price,
+            cursor=cursor,
+            limit=limit
+        )
+    except InvalidCursor:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    except ValueError:
+        return JSONResponse({"error": "Invalid price bucket"}, status_code=400)
+
+# ---------- API: ИНВЕНТАРЬ (ПОСТРАНИЧНО) ----------
+@app.get("/api/inventory/{tg_id}", dependencies=[Depends(require_user)])
+async def get_inventory(
+    tg_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    item_type: Optional[str] = None,
+    session: AsyncSession = Depends(get_read_session)
+):
+    try:
+        return await fetch_inventory_page(session, tg_id, cursor=cursor, limit=limit, item_type=item_type)
+    except InvalidCursor:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
 
 # ---------- API: АВИТО - ВЫСТАВИТЬ ТОВАР ----------
-@app.post("/api/avito/create/{tg_id}")
-async def create_listing(tg_id: int, request: Request):
+@app.post("/api/avito/create/{tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("market"))])
+async def create_listing(tg_id: int, request: Request, session: AsyncSession = Depends(get_session)):
     data = await request.json()
     
-    async for session in get_session():
-        user_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return JSONResponse({"error": "User not found"}, status_code=404)
-        
-        listing = AvitoListing(
-            seller_id=user.id,
-            item_type=data['item_type'],
-            item_data=data['item_data'],
-            price=data['price'],
-            description=data.get('description', '')
-        )
-        
-        session.add(listing)
-        await session.commit()
-        
-        return {"success": True, "listing_id": listing.id}
+    user = await load_user(session, tg_id)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    listing = await market.create_listing(
+        session,
+        seller_id=user.id,
+        item_type=data['item_type'],
+        item_data=data['item_data'],
+        price=data['price'],
+        description=data.get('description', '')
+    )
+    
+    await session.commit()
+    await user_changed(tg_id)
+    market.announce_listed(listing, user)
+    
+    return {"success": True, "listing_id": listing.id}
+
+# ---------- API: АВИТО - ЗАБРОНИРОВАТЬ ТОВАР ----------
+@app.post("/api/avito/reserve/{tg_id}/{listing_id}", dependencies=[Depends(require_user), Depends(rate_limited("market"))])
+async def reserve_listing(tg_id: int, listing_id: int, session: AsyncSession = Depends(get_session)):
+    user = await load_user(session, tg_id)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    try:
+        reserved_until = await market.reserve(session, listing_id, user.id, LISTING_RESERVATION_SECONDS)
+    except market.ListingUnavailable as error:
+        return JSONResponse({"error": str(error)}, status_code=400)
+    
+    await session.commit()
+    market.announce_reserved(listing_id, reserved_until)
+    
+    return {"success": True, "reserved_until": reserved_until.isoformat()}
+
+# ---------- API: АВИТО - СНЯТЬ БРОНЬ ----------
+@app.delete("/api/avito/reserve/{tg_id}/{listing_id}", dependencies=[Depends(require_user), Depends(rate_limited("market"))])
+async def release_listing(tg_id: int, listing_id: int, session: AsyncSession = Depends(get_session)):
+    user = await load_user(session, tg_id)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    released = await market.release(session, listing_id, user.id)
+    await session.commit()
+    if released:
+        market.announce_released(listing_id)
+    
+    return {"success": True, "released": released}
 
 # ---------- API: АВИТО - КУПИТЬ ТОВАР ----------
-@app.post("/api/avito/buy/{tg_id}/{listing_id}")
-async def buy_listing(tg_id: int, listing_id: int):
-    async for session in get_session():
-        buyer_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        buyer = buyer_result.scalar_one_or_none()
-        
-        if not buyer:
-            return JSONResponse({"error": "Buyer not found"}, status_code=404)
-        
-        listing_result = await session.execute(
-            select(AvitoListing).where(AvitoListing.id == listing_id)
-        )
-        listing = listing_result.scalar_one_or_none()
-        
-        if not listing or listing.is_sold:
-            return JSONResponse({"error": "Товар уже продан"}, status_code=400)
-        
-        seller_result = await session.execute(
-            select(User).where(User.id == listing.seller_id)
-        )
-        seller = seller_result.scalar_one()
-        
-        if buyer.id == seller.id:
-            return JSONResponse({"error": "Нельзя купить свой товар"}, status_code=400)
-        
-        if buyer.balance_cash < listing.price:
-            return JSONResponse({"error": "Недостаточно средств"}, status_code=400)
-        
-        buyer.balance_cash -= listing.price
-        seller.balance_cash += listing.price
-        
-        if listing.item_type not in buyer.inventory:
-            buyer.inventory[listing.item_type] = []
-        
-        buyer.inventory[listing.item_type].append(listing.item_data)
-        listing.is_sold = True
-        
-        await session.commit()
-        
-        return {
-            "success": True,
-            "message": f"✅ Товар куплен у @{seller.username}!",
-            "balance": buyer.balance_cash
-        }
+@app.post("/api/avito/buy/{tg_id}/{listing_id}", dependencies=[Depends(require_user), Depends(rate_limited("market"))])
+async def buy_listing(tg_id: int, listing_id: int, session: AsyncSession = Depends(get_session)):
+    buyer = await load_user(session, tg_id, for_update=True)
+    
+    if not buyer:
+        return JSONResponse({"error": "Buyer not found"}, status_code=404)
+    
+    try:
+        listing = await market.purchase(session, listing_id, buyer.id)
+    except market.ListingUnavailable as error:
+        return JSONResponse({"error": str(error)}, status_code=400)
+    except ledger.InsufficientFunds:
+        # Откат возвращает объявление на рынок
+        await session.rollback()
+        return JSONResponse({"error": "Недостаточно средств"}, status_code=400)
+    
+    add_item(session, buyer.id, listing.item_type, listing.item_data, source=f"listing:{listing.id}")
+    
+    seller = (await session.execute(
+        select(User.tg_id, User.username).where(User.id == listing.seller_id)
+    )).one()
+    
+    await session.commit()
+    await user_changed(buyer.tg_id, seller.tg_id)
+    market.announce_closed([listing.id], "sold")
+    
+    return {
+        "success": True,
+        "message": f"✅ Товар куплен у @{seller.username}!",
+        "balance": buyer.balance_cash
+    }
 
 # ---------- API: ГОНКА С БОТОМ ----------
-@app.post("/api/race/bot/{tg_id}")
-async def race_with_bot(tg_id: int):
-    async for session in get_session():
-        user_result = await session.execute(
-            select(User).where(User.tg_id == tg_id)
-        )
-        user = user_result.scalar_one_or_none()
-        
-        if not user:
-            return JSONResponse({"error": "User not found"}, status_code=404)
-            
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
-        if not car:
-            return JSONResponse({"error": "No car"}, status_code=400)
-        
-        player_perf = car.calculate_performance()
-        player_score = (
-            player_perf['power'] * 0.5 +
-            player_perf['handling'] * 0.3 +
-            player_perf['acceleration'] * 20
-        )
-        
-        bot_power = 120 + user.garage_level * 20
-        bot_score = bot_power * 0.5 + 5 * 0.3 + 12 * 20
-        
-        player_score *= random.uniform(0.9, 1.1)
-        bot_score *= random.uniform(0.9, 1.1)
-        
-        is_winner = player_score > bot_score
-        
-        if is_winner:
-            user.balance_cash += 500
-            user.balance_token += 5
-            user.total_earned_tokens += 5
-            user.races_won += 1
-            user.reputation += 1
-            result_text = "🏆 Ты выиграл гонку! +500$, +5 GTR"
-        else:
-            user.balance_cash -= 200
-            user.races_lost += 1
-            user.reputation -= 1
-            result_text = "💔 Ты проиграл... -200$"
-        
-        await session.commit()
-        
-        return {
-            "success": True,
-            "is_winner": is_winner,
-            "message": result_text,
-            "balance": user.balance_cash,
-            "tokens": user.balance_token
-        }
+@app.post("/api/race/bot/{tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("race"))])
+async def race_with_bot(tg_id: int, session: AsyncSession = Depends(get_session)):
+    user, car = await load_user_with_car(session, tg_id, for_update=True)
+    
+    if not user:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    if not car:
+        return JSONResponse({"error": "No car"}, status_code=400)
+    
+    stats = race_engine.stats_from_performance([car.performance])
+    is_winner = bool(race_engine.race_bots(stats, [user.garage_level])[0])
+    
+    if is_winner:
+        await ledger.apply(session, user.id, cash=500, tokens=5, reason="race_win")
+        user.races_won += 1
+        user.reputation += 1
+        result_text = "🏆 Ты выиграл гонку! +500$, +5 GTR"
+    else:
+        # Проигрыш списывается даже в минус, как и раньше
+        await ledger.apply(session, user.id, cash=-200, reason="race_loss", allow_negative=True)
+        user.races_lost += 1
+        user.reputation -= 1
+        result_text = "💔 Ты проиграл... -200$"
+    
+    await session.commit()
+    # История пишется пачками в фоне, не в транзакции гонки
+    recorder.record_race(user.id, None, user.id if is_winner else None)
+    state = await refresh_user_state(user, car)
+    leaderboard.observe(user)
+    
+    return mutation_response({
+        "success": True,
+        "is_winner": is_winner,
+        "message": result_text,
+        "balance": user.balance_cash,
+        "tokens": user.balance_token
+    }, state)
+
+# ---------- API: ГОНКА С ДРУГИМ ИГРОКОМ ----------
+@app.post("/api/race/pvp/{tg_id}/{opponent_tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("race"))])
+async def race_with_player(tg_id: int, opponent_tg_id: int, session: AsyncSession = Depends(get_session)):
+    if tg_id == opponent_tg_id:
+        return JSONResponse({"error": "Нельзя гоняться с самим собой"}, status_code=400)
+    
+    # Блокируем игроков всегда в одном порядке, чтобы встречные гонки не ловили дедлок
+    loaded = {}
+    for player_tg_id in sorted([tg_id, opponent_tg_id]):
+        loaded[player_tg_id] = await load_user_with_car(session, player_tg_id, for_update=True)
+    user, car = loaded[tg_id]
+    opponent, opponent_car = loaded[opponent_tg_id]
+    
+    if not user or not opponent:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    if not car or not opponent_car:
+        return JSONResponse({"error": "No car"}, status_code=400)
+    
+    stats = race_engine.stats_from_performance([car.performance])
+    opponent_stats = race_engine.stats_from_performance([opponent_car.performance])
+    is_winner = bool(race_engine.race(stats, opponent_stats)[0])
+    
+    winner, loser = (user, opponent) if is_winner else (opponent, user)
+    winner.reputation += 1
+    loser.reputation -= 1
+    
+    await race_engine.count_races(session, [(user.id, opponent.id, winner.id)])
+    await session.commit()
+    # История - через тот же буфер, что и гонки с ботом
+    recorder.record_race(user.id, opponent.id, winner.id)
+    # Счетчики побед обновлены в SQL, подтягиваем их в загруженные объекты
+    await session.refresh(user)
+    await session.refresh(opponent)
+    
+    state = await refresh_user_state(user, car)
+    await user_changed(opponent.tg_id)
+    leaderboard.observe(user)
+    leaderboard.observe(opponent)
+    
+    result_text = (
+        f"🏆 Ты обогнал @{opponent.username}!" if is_winner
+        else f"💔 @{opponent.username} оказался быстрее..."
+    )
+    
+    return mutation_response({
+        "success": True,
+        "is_winner": is_winner,
+        "message": result_text
+    }, state)
+
+# ---------- API: ДРАКА С ДРУГИМ ИГРОКОМ ----------
+@app.post("/api/fight/{tg_id}/{opponent_tg_id}", dependencies=[Depends(require_user), Depends(rate_limited("fight"))])
+async def fight_player(
+    tg_id: int,
+    opponent_tg_id: int,
+    location: Optional[str] = None,
+    session: AsyncSession = Depends(get_session)
+):
+    if tg_id == opponent_tg_id:
+        return JSONResponse({"error": "Нельзя драться с самим собой"}, status_code=400)
+    if location is None:
+        location = random.choice(race_engine.FIGHT_LOCATIONS)
+    elif location not in race_engine.FIGHT_LOCATIONS:
+        return JSONResponse({"error": "Unknown location"}, status_code=400)
+    
+    # Тот же порядок блокировок, что и в гонке
+    loaded = {}
+    for player_tg_id in sorted([tg_id, opponent_tg_id]):
+        loaded[player_tg_id] = await load_user_with_car(session, player_tg_id, for_update=True)
+    user, car = loaded[tg_id]
+    opponent, _ = loaded[opponent_tg_id]
+    
+    if not user or not opponent:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    
+    is_winner = race_engine.fight(user.reputation, opponent.reputation)
+    winner, loser = (user, opponent) if is_winner else (opponent, user)
+    winner.fights_won = (winner.fights_won or 0) + 1
+    winner.reputation += 1
+    loser.fights_lost = (loser.fights_lost or 0) + 1
+    loser.reputation -= 1
+    await ledger.apply(session, winner.id, tokens=3, reason="fight_win", ref=f"user:{loser.id}")
+    
+    await session.commit()
+    recorder.record_fight(user.id, opponent.id, winner.id, location)
+    
+    state = await refresh_user_state(user, car)
+    await user_changed(opponent.tg_id)
+    leaderboard.observe(user)
+    leaderboard.observe(opponent)
+    
+    result_text = (
+        f"🤜 Ты уложил @{opponent.username} ({location})! +3 GTR" if is_winner
+        else f"🤕 @{opponent.username} оказался сильнее ({location})..."
+    )
+    
+    return mutation_response({
+        "success": True,
+        "is_winner": is_winner,
+        "location": location,
+        "message": result_text
+    }, state)
+
+# ---------- API: ИСТОРИЯ ГОНОК И ДРАК (ПОСТРАНИЧНО) ----------
+@app.get("/api/history/races/{tg_id}", dependencies=[Depends(require_user)])
+async def get_race_history(
+    tg_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    session: AsyncSession = Depends(get_read_session)
+):
+    try:
+        page = await fetch_history_page(session, RaceHistory, tg_id, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    if page is None:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    return page
+
+@app.get("/api/history/fights/{tg_id}", dependencies=[Depends(require_user)])
+async def get_fight_history(
+    tg_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    session: AsyncSession = Depends(get_read_session)
+):
+    try:
+        page = await fetch_history_page(session, FightHistory, tg_id, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    if page is None:
+        return JSONResponse({"error": "User not found"}, status_code=404)
+    return page
+
+# ---------- API: ТАБЛИЦА ЛИДЕРОВ ----------
+@app.get("/api/leaderboard/{metric}")
+async def get_leaderboard(metric: str, limit: int = 10, tg_id: Optional[int] = None):
+    if metric not in METRICS:
+        return JSONResponse({"error": "Unknown metric"}, status_code=404)
+    
+    return {
+        "metric": metric,
+        "top": leaderboard.top(metric, max(1, min(limit, 100))),
+        "me": leaderboard.rank(metric, tg_id) if tg_id is not None else None
+    }
@@ -0,0 +1,147 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import parse_qsl
+
+from fastapi import Header
+
+from config import BOT_TOKEN, AUTH_REQUIRED, AUTH_INIT_DATA_MAX_AGE, AUTH_TOKEN_TTL, AUTH_SESSION_CACHE_SIZE
+
+
+class AuthError(Exception):
+    def __init__(self, message: str, status_code: int = 401):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+# ---------- ПРОВЕРКА initData ----------
+def verify_init_data(init_data: str, bot_token: str = BOT_TOKEN, max_age: float = AUTH_INIT_DATA_MAX_AGE) -> dict:
+    """Проверяет подпись Telegram.WebApp.initData и возвращает поле user.
+
+    Алгоритм из документации Telegram: секрет = HMAC_SHA256("WebAppData", токен бота),
+    подпись = HMAC_SHA256(секрет, отсортированные пары key=value через перевод строки).
+    Любые кривые данные от клиента - AuthError (401), а не исключение в обработчике.
+    """
+    if not isinstance(init_data, str):
+        raise AuthError("initData должна быть строкой")
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop("hash", None)
+    if not received_hash:
+        raise AuthError("initData без подписи")
+
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    # compare_digest со str падает на не-ASCII символах - сравниваем байты
+    if not hmac.compare_digest(expected_hash.encode(), received_hash.encode()):
+        raise AuthError("Неверная подпись initData")
+
+    try:
+        auth_date = int(fields.get("auth_date", 0))
+    except ValueError:
+        raise AuthError("Неверная дата в initData")
+    if max_age and time.time() - auth_date > max_age:
+        raise AuthError("initData устарела, перезапусти приложение")
+
+    try:
+        user = json.loads(fields["user"])
+        user["id"] = int(user["id"])
+    except (KeyError, TypeError, ValueError):
+        raise AuthError("В initData нет пользователя")
+    return user
+
+
+# ---------- ТОКЕН СЕССИИ ----------
+# Ключ подписи выводится из токена бота: у всех воркеров он одинаковый
+_SESSION_KEY = hashlib.sha256(b"gunter-session:" + BOT_TOKEN.encode()).digest()
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(_SESSION_KEY, payload.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+
+def issue_token(tg_id: int, ttl: float = AUTH_TOKEN_TTL) -> str:
+    """Токен вида '<tg_id>.<истекает>.<подпись>'"""
+    payload = f"{tg_id}.{int(time.time() + ttl)}"
+    return f"{payload}.{_sign(payload)}"
+
+
+class SessionCache:
+    """Проверенные токены -> (tg_id, истекает). Повторная проверка - поиск в словаре"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._sessions = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _verify(self, token: str):
+        try:
+            tg_id, expires_at, signature = token.split(".")
+            payload = f"{tg_id}.{expires_at}"
+            if not hmac.compare_digest(_sign(payload).encode(), signature.encode()):
+                return None
+            return int(tg_id), int(expires_at)
+        except ValueError:
+            return None
+
+    def resolve(self, token: str) -> Optional[int]:
+        """tg_id владельца токена или None, если токен неверный или истек"""
+        session = self._sessions.get(token)
+        if session is None:
+            self.misses += 1
+            session = self._verify(token)
+            if session is None:
+                return None
+            self._sessions[token] = session
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        else:
+            self.hits += 1
+            self._sessions.move_to_end(token)
+
+        tg_id, expires_at = session
+        if expires_at < time.time():
+            self._sessions.pop(token, None)
+            return None
+        return tg_id
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "sessions": len(self._sessions),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+sessions = SessionCache(maxsize=AUTH_SESSION_CACHE_SIZE)
+
+
+def token_owner(token: Optional[str]) -> int:
+    if not token:
+        raise AuthError("Нужна авторизация")
+    tg_id = sessions.resolve(token)
+    if tg_id is None:
+        raise AuthError("Сессия истекла, перезапусти приложение")
+    return tg_id
+
+
+def check_owner(tg_id: int, token: Optional[str]):
+    """Токен должен принадлежать игроку tg_id (если авторизация включена)"""
+    if AUTH_REQUIRED and token_owner(token) != tg_id:
+        raise AuthError("Чужой аккаунт", status_code=403)
+
+
+# ---------- FASTAPI ----------
+async def require_user(tg_id: int, authorization: Optional[str] = Header(None)):
+    """Зависимость для эндпоинтов с {tg_id} в пути: токен должен принадлежать этому игроку"""
+    token = authorization[7:] if authorization and authorization.startswith("Bearer ") else None
+    check_owner(tg_id, token)
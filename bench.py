@@ -0,0 +1,348 @@
+"""Нагрузочный бенчмарк API и хендлеров бота.
+
+Создает отдельную базу нужного размера, поднимает приложение в этом же
+процессе (httpx + ASGITransport, без сети) и гоняет сценарии с заданной
+конкурентностью. Апдейты Telegram проходят через dp.feed_update, а бот
+вместо Telegram отвечает заглушкой. Итог - пропускная способность и
+p50/p95/p99 по каждому сценарию, плюс JSON для сравнения прогонов.
+
+    python bench.py --users 5000 --listings 10000 --races 20000 --requests 2000 --concurrency 32
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Базовый tg_id синтетических игроков
+TG_ID_BASE = 10 ** 9
+
+
+def configure_env(args):
+    """Настройки приложения для бенчмарка. Вызывать до импорта модулей приложения"""
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{args.db}"
+    os.environ["WEBHOOK_REGISTER"] = "0"
+    os.environ["SLOW_QUERY_MS"] = "0"
+    # Меряем стоимость эндпоинтов, а не ограничители: лимиты и паузы отправки снимаем
+    for action in ("TUNE", "RACE", "MARKET", "DONATE"):
+        os.environ[f"RATE_LIMIT_{action}_SECONDS"] = "0"
+    os.environ["SEND_GLOBAL_RATE"] = "1000000"
+    os.environ["SEND_CHAT_INTERVAL"] = "0"
+    os.environ["WEBHOOK_QUEUE_SIZE"] = str(max(1000, args.requests * 2))
+
+
+# ---------- ЗАГЛУШКА BOT API ----------
+def make_fake_session():
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message
+
+    class FakeSession(BaseSession):
+        """Отвечает на любые методы Bot API без сети"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            if method.__returning__ is Message:
+                return Message(
+                    message_id=self.calls,
+                    date=datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=getattr(method, "text", None)
+                )
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+# ---------- НАПОЛНЕНИЕ БАЗЫ ----------
+async def seed(args, rng: random.Random):
+    from sqlalchemy import insert
+    from database import engine, init_db
+    import search
+    from models import User, Car, AvitoListing, RaceHistory, MINOR_UNITS
+
+    await init_db()
+    now = datetime.utcnow()
+    batch = 5000
+
+    async with engine.begin() as conn:
+        users = [
+            {
+                "id": i,
+                "tg_id": TG_ID_BASE + i,
+                "username": f"bench{i}",
+                "first_name": f"Bench {i}",
+                "balance_cash_minor": 10 ** 6 * MINOR_UNITS,
+                "balance_token_minor": rng.randint(0, 1000) * MINOR_UNITS,
+                "races_won": rng.randint(0, 200),
+                "reputation": rng.randint(0, 100),
+            }
+            for i in range(1, args.users + 1)
+        ]
+        cars = [
+            {
+                "owner_id": i,
+                "engine_power_multiplier": round(rng.uniform(1.0, 2.0), 2),
+                "turbo_level": rng.randint(0, 3),
+                "suspension_level": rng.randint(0, 3),
+            }
+            for i in range(1, args.users + 1)
+        ]
+        # Вставка через Core обходит before_flush: расчетные характеристики
+        # (power, handling, ...) считаем тут, иначе у всех машин будут значения по умолчанию
+        for car in cars:
+            car.update(Car(**car).calculate_performance())
+        listings = [
+            {
+                "seller_id": rng.randint(1, args.users),
+                "item_type": rng.choice(["engine", "turbo", "suspension", "subwoofer"]),
+                "item_data": {"level": rng.randint(1, 3)},
+                "price": rng.randint(100, 5000),
+                "description": f"Лот {i}",
+                "is_sold": False,
+                "created_at": now - timedelta(seconds=i),
+            }
+            for i in range(args.listings)
+        ]
+        races = [
+            {
+                "player1_id": rng.randint(1, args.users),
+                "player2_id": None,
+                "winner_id": None,
+                "bet_amount": 0,
+                "created_at": now - timedelta(seconds=i),
+            }
+            for i in range(args.races)
+        ]
+
+        for table, rows in ((User, users), (Car, cars), (AvitoListing, listings), (RaceHistory, races)):
+            for start in range(0, len(rows), batch):
+                await conn.execute(insert(table.__table__), rows[start:start + batch])
+        # Объявления вставлены в обход market.create_listing - счетчики фасетов пересчитываем
+        await conn.run_sync(search.rebuild_facets)
+
+
+# ---------- ИЗМЕРЕНИЯ ----------
+def summarize(latencies, errors: int, elapsed: float) -> dict:
+    ms = np.asarray(latencies) * 1000
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(float(np.percentile(ms, 50)), 3) if len(ms) else None,
+        "p95_ms": round(float(np.percentile(ms, 95)), 3) if len(ms) else None,
+        "p99_ms": round(float(np.percentile(ms, 99)), 3) if len(ms) else None,
+        "max_ms": round(float(ms.max()), 3) if len(ms) else None,
+    }
+
+
+async def run_scenario(call, total: int, concurrency: int) -> dict:
+    """Гоняет call(i) total раз в concurrency параллельных потоков. call возвращает True при успехе"""
+    latencies, errors = [], 0
+    counter = itertools.count()
+
+    async def worker():
+        nonlocal errors
+        while (i := next(counter)) < total:
+            started = time.perf_counter()
+            try:
+                ok = await call(i)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - started)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def synthetic_update(update_id: int, tg_id: int, data: str) -> dict:
+    user = {"id": tg_id, "is_bot": False, "first_name": "Bench", "username": f"bench{tg_id - TG_ID_BASE}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(tg_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": tg_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Gunter"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+async def run_benchmark(args) -> dict:
+    import httpx
+    from aiogram.types import Update
+    import api
+    from auth import issue_token
+    from bot import bot, dp
+
+    rng = random.Random(args.seed)
+    if not args.reuse:
+        await seed(args, rng)
+    bot.session = make_fake_session()
+
+    tg_ids = [TG_ID_BASE + i for i in range(1, args.users + 1)]
+    tokens = {tg_id: {"Authorization": f"Bearer {issue_token(tg_id)}"} for tg_id in tg_ids}
+    update_ids = itertools.count(1)
+    results = {}
+
+    async with api.lifespan(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+
+            async def get_user(i):
+                tg_id = rng.choice(tg_ids)
+                response = await client.get(f"/api/user/{tg_id}", headers=tokens[tg_id])
+                return response.status_code == 200
+
+            async def get_listings(i):
+                params = {"item_type": rng.choice(["engine", "turbo"])} if i % 2 else {}
+                response = await client.get("/api/avito/listings", params=params)
+                return response.status_code == 200
+
+            # Каждый запрос покупает свой лот: считаем успехом и "уже продан" - это тоже полный путь
+            listing_ids = list(range(1, args.listings + 1))
+            rng.shuffle(listing_ids)
+
+            search_queries = ["турбина", "лот 1", "engine", "level 3", "сабвуфер"]
+
+            async def search_listings(i):
+                params = {"q": rng.choice(search_queries)} if i % 2 else {"item_type": "turbo"}
+                response = await client.get("/api/avito/search", params=params)
+                return response.status_code == 200
+
+            async def buy_listing(i):
+                tg_id = rng.choice(tg_ids)
+                listing_id = listing_ids[i % len(listing_ids)]
+                response = await client.post(f"/api/avito/buy/{tg_id}/{listing_id}", headers=tokens[tg_id])
+                return response.status_code in (200, 400)
+
+            async def race_with_bot(i):
+                tg_id = rng.choice(tg_ids)
+                response = await client.post(f"/api/race/bot/{tg_id}", headers=tokens[tg_id])
+                return response.status_code == 200
+
+            async def webhook(i):
+                update = synthetic_update(next(update_ids), rng.choice(tg_ids), "profile")
+                response = await client.post("/webhook", json=update)
+                return response.status_code == 200
+
+            def feed_update(data):
+                async def call(i):
+                    update = synthetic_update(next(update_ids), rng.choice(tg_ids), data)
+                    await dp.feed_update(bot, Update.model_validate(update, context={"bot": bot}))
+                    return True
+                return call
+
+            scenarios = {
+                "get_user": get_user,
+                "get_listings": get_listings,
+                "search_listings": search_listings,
+                "buy_listing": buy_listing,
+                "race_with_bot": race_with_bot,
+                "webhook": webhook,
+                "bot:profile": feed_update("profile"),
+                "bot:tokens": feed_update("tokens"),
+            }
+            selected = args.only or list(scenarios)
+
+            for name in selected:
+                results[name] = await run_scenario(scenarios[name], args.requests, args.concurrency)
+                if name == "webhook":
+                    # Вебхук только ставит апдейт в очередь - отдельно меряем, за сколько очередь разберется
+                    started = time.perf_counter()
+                    while api.update_queue.depth() or api.update_queue.processed + api.update_queue.failed < api.update_queue.enqueued:
+                        await asyncio.sleep(0.01)
+                    results[name]["drain_seconds"] = round(time.perf_counter() - started, 3)
+                    results[name]["processing_failed"] = api.update_queue.failed
+                print_row(name, results[name])
+
+    return results
+
+
+def print_row(name: str, result: dict):
+    print(
+        f"{name:<16} {result['requests']:>7} req {result['errors']:>5} err "
+        f"{result['rps']:>9} rps  p50 {result['p50_ms']:>8} ms  p95 {result['p95_ms']:>8} ms  "
+        f"p99 {result['p99_ms']:>8} ms"
+    )
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк API и хендлеров бота")
+    parser.add_argument("--db", default="bench.db", help="Файл базы для бенчмарка (пересоздается)")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--listings", type=int, default=2000)
+    parser.add_argument("--races", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=1000, help="Запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", nargs="*", help="Запустить только эти сценарии")
+    parser.add_argument("--reuse", action="store_true", help="Не пересоздавать базу")
+    parser.add_argument("--out", default="bench_output.json", help="Куда записать результаты (JSON)")
+    args = parser.parse_args()
+
+    if not args.reuse:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.db + suffix):
+                os.remove(args.db + suffix)
+
+    configure_env(args)
+    results = asyncio.run(run_benchmark(args))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "git": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Saved to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
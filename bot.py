@@ -1,22 +1,60 @@
 import asyncio
 import logging
+from html import escape
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo
+from aiogram.types import Message, CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, WebAppInfo, FSInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from sqlalchemy import select
 
-from config import BOT_TOKEN
-from database import get_session
+from config import (
+    BOT_TOKEN, ADMIN_ID, TELEGRAM_API_URL,
+    FSM_CACHE_SIZE, FSM_CACHE_SECONDS, FSM_FLUSH_SECONDS, FSM_FLUSH_BATCH, FSM_STATE_TTL,
+    SEND_GLOBAL_RATE, SEND_CHAT_INTERVAL, SEND_MAX_IN_FLIGHT, SEND_MAX_RETRIES, BROADCAST_CHUNK_SIZE
+)
+from database import get_session, get_read_session
 from models import User, Car
+from repository import load_user_with_car, user_changed
+import ledger
+import race_engine
+from leaderboard import leaderboard, METRICS
+from tokens import export_airdrop_snapshot
+from fsm_storage import DatabaseStorage
+from rate_limit import RateLimitMiddleware
+from metrics import HandlerMetricsMiddleware
+from sender import SendScheduler
 
 logging.basicConfig(level=logging.INFO)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+# TELEGRAM_API_URL - свой Bot API сервер (или заглушка в тестах)
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=session)
+# Состояния диалогов живут в базе: переживают рестарт и общие для всех воркеров
+fsm_storage = DatabaseStorage(
+    cache_size=FSM_CACHE_SIZE,
+    cache_seconds=FSM_CACHE_SECONDS,
+    flush_seconds=FSM_FLUSH_SECONDS,
+    flush_batch=FSM_FLUSH_BATCH,
+    ttl=FSM_STATE_TTL
+)
+dp = Dispatcher(storage=fsm_storage)
+# Все сообщения и правки бота идут через очередь с учетом лимитов Telegram
+outbox = SendScheduler(
+    bot,
+    global_rate=SEND_GLOBAL_RATE,
+    chat_interval=SEND_CHAT_INTERVAL,
+    max_in_flight=SEND_MAX_IN_FLIGHT,
+    max_retries=SEND_MAX_RETRIES
+)
+# Задержка каждого хендлера (в метриках), затем ограничение частоты по флагу rate_limit
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+dp.message.middleware(RateLimitMiddleware())
+dp.callback_query.middleware(RateLimitMiddleware())
 
 # Жестко прописываем правильный URL (без использования config)
 BASE_URL = "https://gunter-bot-production.up.railway.app"
@@ -53,6 +91,8 @@ async def cmd_start(message: Message):
             )
             session.add(car)
             await session.commit()
+            await user_changed(user.tg_id)
+            leaderboard.observe(user)
     
     # Используем прямой URL
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -62,7 +102,8 @@ async def cmd_start(message: Message):
         [InlineKeyboardButton(text="🎁 Токены GUNTER", callback_data="tokens")]
     ])
     
-    await message.answer(
+    await outbox.answer(
+        message,
         "🔰 <b>Добро пожаловать в GUNTER LIFE!</b>\n\n"
         "Тут пацаны собирают тачки, гоняют и бухают.\n"
         "У тебя уже есть стартовая Веста. Качай её, ставь турбину, настраивай клапана.\n\n"
@@ -74,25 +115,17 @@ async def cmd_start(message: Message):
 # ---------- ПРОФИЛЬ ----------
 @dp.callback_query(lambda c: c.data == "profile")
 async def show_profile(callback: CallbackQuery):
-    async for session in get_session():
-        result = await session.execute(
-            select(User).where(User.tg_id == callback.from_user.id)
-        )
-        user = result.scalar_one_or_none()
+    async for session in get_read_session(callback.from_user.id):
+        user, car = await load_user_with_car(session, callback.from_user.id)
         
         if not user:
-            await callback.message.edit_text("❌ Пользователь не найден")
+            await outbox.edit(callback.message, "❌ Пользователь не найден")
             await callback.answer()
             return
         
-        car_result = await session.execute(
-            select(Car).where(Car.owner_id == user.id)
-        )
-        car = car_result.scalar_one_or_none()
-        
         car_info = "🚗 <b>Нет машины</b>"
         if car:
-            perf = car.calculate_performance()
+            perf = car.performance
             car_info = (
                 f"🚗 <b>{car.name}</b>\n"
                 f"⚡ Мощность: {perf['power']:.0f} л.с.\n"
@@ -115,20 +148,20 @@ async def show_profile(callback: CallbackQuery):
             f"🏢 Уровень гаража: {user.garage_level}"
         )
         
-        await callback.message.edit_text(text, parse_mode="HTML")
+        await outbox.edit(callback.message, text, parse_mode="HTML")
         await callback.answer()
 
 # ---------- ТОКЕНЫ ----------
 @dp.callback_query(lambda c: c.data == "tokens")
 async def show_tokens(callback: CallbackQuery):
-    async for session in get_session():
+    async for session in get_read_session(callback.from_user.id):
         result = await session.execute(
             select(User).where(User.tg_id == callback.from_user.id)
         )
         user = result.scalar_one_or_none()
         
         if not user:
-            await callback.message.edit_text("❌ Пользователь не найден")
+            await outbox.edit(callback.message, "❌ Пользователь не найден")
             await callback.answer()
             return
         
@@ -152,7 +185,7 @@ async def show_tokens(callback: CallbackQuery):
             [InlineKeyboardButton(text="💸 Купить токены (Донат)", callback_data="donate")]
         ])
         
-        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+        await outbox.edit(callback.message, text, parse_mode="HTML", reply_markup=keyboard)
         await callback.answer()
 
 # ---------- ДОНАТ ----------
@@ -165,7 +198,8 @@ async def donate_tokens(callback: CallbackQuery):
         [InlineKeyboardButton(text="🔙 Назад", callback_data="tokens")]
     ])
     
-    await callback.message.edit_text(
+    await outbox.edit(
+        callback.message,
         "💎 <b>Магазин токенов GUNTER</b>\n\n"
         "Купи токены сейчас и получи x2 бонус!\n"
         "Токены будут начислены автоматически после оплаты.\n\n"
@@ -175,7 +209,7 @@ async def donate_tokens(callback: CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(lambda c: c.data.startswith("donate_"))
+@dp.callback_query(lambda c: c.data.startswith("donate_"), flags={"rate_limit": "donate"})
 async def process_donate(callback: CallbackQuery):
     amount = int(callback.data.split("_")[1])
     
@@ -186,7 +220,7 @@ async def process_donate(callback: CallbackQuery):
         user = result.scalar_one_or_none()
         
         if not user:
-            await callback.message.edit_text("❌ Пользователь не найден")
+            await outbox.edit(callback.message, "❌ Пользователь не найден")
             await callback.answer()
             return
         
@@ -198,14 +232,127 @@ async def process_donate(callback: CallbackQuery):
         elif amount == 1000:
             token_amount = 1200
         
-        user.balance_token += token_amount
-        user.total_earned_tokens += token_amount
+        await ledger.apply(session, user.id, tokens=token_amount, reason="donate", ref=callback.data)
         await session.commit()
+        await user_changed(user.tg_id)
+        leaderboard.observe(user)
         
-        await callback.message.edit_text(
+        await outbox.edit(
+            callback.message,
             f"✅ <b>Оплата прошла успешно!</b>\n\n"
             f"Тебе начислено <b>{token_amount} GTR</b>!\n"
             f"Текущий баланс: {user.balance_token:.2f} GTR",
             parse_mode="HTML"
         )
         await callback.answer()
+
+# ---------- ТАБЛИЦА ЛИДЕРОВ ----------
+LEADERBOARD_TITLES = {
+    "races_won": "🏁 Победы в гонках",
+    "reputation": "⭐ Репутация",
+    "balance_token": "🎮 Баланс GTR",
+    "total_earned_tokens": "💰 Заработано GTR",
+}
+
+@dp.message(Command("top"))
+async def cmd_top(message: Message):
+    # /top reputation - рейтинг по другой метрике
+    args = message.text.split()
+    metric = args[1] if len(args) > 1 else "races_won"
+    
+    if metric not in METRICS:
+        await outbox.answer(message, "Доступные рейтинги: " + ", ".join(METRICS))
+        return
+    
+    lines = [f"<b>{LEADERBOARD_TITLES[metric]}</b>\n"]
+    for entry in leaderboard.top(metric, 10):
+        lines.append(f"{entry['rank']}. {escape(str(entry['name'] or entry['tg_id']))} — {entry['score']:g}")
+    
+    me = leaderboard.rank(metric, message.from_user.id)
+    if me:
+        lines.append(f"\nТвое место: <b>{me['rank']}</b> ({me['score']:g})")
+    
+    await outbox.answer(message, "\n".join(lines), parse_mode="HTML")
+
+# ---------- ТУРНИР (АДМИН) ----------
+@dp.message(Command("tournament"))
+async def cmd_tournament(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    # /tournament 42 - турнир с фиксированным сидом (воспроизводимый)
+    args = message.text.split()
+    seed = int(args[1]) if len(args) > 1 and args[1].isdigit() else None
+    
+    async for session in get_session():
+        winner_id, races_count, participants = await race_engine.run_scheduled_tournament(session, seed)
+        # Турнир меняет счетчики сразу у всех участников - проще перестроить рейтинг
+        await leaderboard.reconcile(session)
+        await user_changed(*participants)
+        
+        if winner_id is None:
+            await outbox.answer(message, "🏁 Нет участников для турнира")
+            return
+        
+        winner = await session.get(User, winner_id)
+        await outbox.answer(
+            message,
+            f"🏁 <b>Турнир завершен!</b>\n\n"
+            f"Заездов: {races_count}\n"
+            f"🏆 Победитель: @{winner.username or winner.first_name}",
+            parse_mode="HTML"
+        )
+
+# ---------- СНАПШОТ ДЛЯ AIRDROP (АДМИН) ----------
+@dp.message(Command("airdrop"))
+async def cmd_airdrop(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    async for session in get_session():
+        summary = await export_airdrop_snapshot(session)
+    
+    await outbox.answer(
+        message,
+        f"📸 <b>Снапшот для Airdrop готов</b>\n\n"
+        f"Холдеров: {summary['holders']}\n"
+        f"Всего: {summary['total_tokens']} GTR",
+        parse_mode="HTML"
+    )
+    for key in ("csv", "jsonl"):
+        await outbox.answer_document(
+            message,
+            FSInputFile(summary[key]),
+            caption=f"sha256: {summary[key + '_sha256']}"
+        )
+
+# ---------- РАССЫЛКА (АДМИН) ----------
+# Идущие рассылки (чтобы задачи не собрал GC)
+broadcasts = set()
+
+async def run_broadcast(admin_chat: Message, text: str):
+    summary = await outbox.broadcast(text, BROADCAST_CHUNK_SIZE, parse_mode="HTML")
+    await outbox.answer(
+        admin_chat,
+        f"📣 <b>Рассылка завершена</b>\n\n"
+        f"Получателей: {summary['recipients']}\n"
+        f"Доставлено: {summary['sent']}\n"
+        f"Ошибок: {summary['failed']}",
+        parse_mode="HTML"
+    )
+
+@dp.message(Command("broadcast"))
+async def cmd_broadcast(message: Message):
+    if message.from_user.id != ADMIN_ID:
+        return
+    
+    text = (message.text or "").partition(" ")[2].strip()
+    if not text:
+        await outbox.answer(message, "Использование: /broadcast текст сообщения")
+        return
+    
+    # Рассылка идет в фоне: обработчик апдейтов не занят на все время отправки
+    task = asyncio.create_task(run_broadcast(message, text))
+    broadcasts.add(task)
+    task.add_done_callback(broadcasts.discard)
+    await outbox.answer(message, "📣 Рассылка запущена")
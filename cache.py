@@ -0,0 +1,140 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from config import USER_CACHE_TTL, USER_CACHE_SIZE
+
+
+# ---------- ХРАНИЛИЩА ----------
+class CacheBackend(ABC):
+    """Интерфейс хранилища кэша.
+
+    Методы асинхронные, чтобы общий для всех воркеров бэкенд (Redis и т.п.)
+    можно было подключить без изменения вызывающего кода. Бэкенд без
+    какого-то из методов не создастся (TypeError при создании объекта).
+    """
+
+    @abstractmethod
+    async def get(self, key):
+        ...
+
+    @abstractmethod
+    async def set(self, key, value):
+        ...
+
+    @abstractmethod
+    async def delete(self, key):
+        ...
+
+    @abstractmethod
+    async def clear(self):
+        ...
+
+
+class MemoryBackend(CacheBackend):
+    """Кэш в памяти процесса: TTL на запись + вытеснение давно не читанных (LRU)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        if self.ttl <= 0:
+            # Кэш выключен
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+    async def clear(self):
+        self._data.clear()
+
+
+# ---------- READ-THROUGH КЭШ ----------
+class Cache:
+    """Кэш поверх любого бэкенда со счётчиками попаданий и промахов.
+
+    Чтение из базы после промаха кладется в кэш через begin_fill/fill:
+    если ключ успели записать или сбросить, пока шло чтение, прочитанное
+    значение устарело и в кэш не попадает.
+    """
+
+    def __init__(self, backend: CacheBackend, namespace: str):
+        self.backend = backend
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._filling = {}  # key -> отметка чтения, начатого после последней записи
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key):
+        value = await self.backend.get(self._key(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key, value):
+        self._filling.pop(key, None)
+        await self.backend.set(self._key(key), value)
+
+    async def invalidate(self, key):
+        self._filling.pop(key, None)
+        await self.backend.delete(self._key(key))
+
+    def begin_fill(self, key):
+        """Отметка перед чтением из базы; передается в fill"""
+        token = object()
+        self._filling[key] = token
+        return token
+
+    async def fill(self, key, value, token) -> bool:
+        """Кладет прочитанное значение, если с begin_fill ключ не меняли.
+        value=None только снимает отметку (например, игрока нет)"""
+        if self._filling.get(key) is not token:
+            return False
+        del self._filling[key]
+        if value is None:
+            return False
+        await self.backend.set(self._key(key), value)
+        return True
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0
+        }
+
+
+# Сериализованное состояние игрока (ответ /api/user/{tg_id}) по tg_id.
+# Инвалидируется явно после каждого изменения игрока или его машины.
+user_cache = Cache(MemoryBackend(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL), namespace="user")
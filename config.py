@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,3 +9,93 @@ DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite+aiosqlite:///gunter.db')
 ADMIN_ID = int(os.getenv('ADMIN_ID', 1776341320))
 # WEBAPP_URL больше не используется в bot.py, но оставим для совместимости
 WEBAPP_URL = os.getenv('WEBAPP_URL', 'https://gunter-bot-production.up.railway.app')
+# Порог (мс), после которого запрос к БД пишется в лог как медленный. 0 - выключено
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+# Число воркеров gunicorn (см. Procfile, по умолчанию 1). Кэш состояния игрока,
+# кэш FSM и read-your-writes живут в памяти процесса и между воркерами не
+# синхронизируются, поэтому при нескольких воркерах они выключаются
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+MULTI_WORKER = WEB_CONCURRENCY > 1
+# Кэш состояния игрока для /api/user/{tg_id}: время жизни записи (сек) и максимум записей
+USER_CACHE_TTL = 0.0 if MULTI_WORKER else float(os.getenv('USER_CACHE_TTL', 30))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+# Как часто (сек) рейтинги в памяти сверяются с базой
+LEADERBOARD_RECONCILE_SECONDS = float(os.getenv('LEADERBOARD_RECONCILE_SECONDS', 300))
+# Куда складываются снапшоты балансов для аирдропа
+AIRDROP_EXPORT_DIR = os.getenv('AIRDROP_EXPORT_DIR', 'airdrop')
+# Очередь вебхука: число обработчиков, общий размер очереди и окно дедупликации update_id
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_DEDUP_WINDOW = int(os.getenv('WEBHOOK_DEDUP_WINDOW', 10000))
+# ---------- БАЗА ДАННЫХ ----------
+# Логировать каждый SQL-запрос (только для отладки, тормозит)
+DB_ECHO = os.getenv('DB_ECHO', '0') == '1'
+# Пул соединений
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+# Postgres (asyncpg): размер кэша подготовленных выражений (0 - выключить, нужно для pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', 500))
+# SQLite: сколько мс ждать снятия блокировки записи, прежде чем вернуть ошибку
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# Реплика для чтения. Пусто: для SQLite - тот же файл в режиме только чтения, иначе основная база
+DATABASE_READ_URL = os.getenv('DATABASE_READ_URL', '')
+# Сколько секунд после записи чтения игрока идут в основную базу (read-your-writes)
+READ_STICKY_SECONDS = float(os.getenv('READ_STICKY_SECONDS', 5))
+# FSM бота в базе: размер кэша в памяти, сколько (сек) доверять кэшу, пауза между
+# пакетными записями, размер пакета и через сколько (сек) брошенный диалог удаляется
+FSM_CACHE_SIZE = int(os.getenv('FSM_CACHE_SIZE', 10000))
+FSM_CACHE_SECONDS = 0.0 if MULTI_WORKER else float(os.getenv('FSM_CACHE_SECONDS', 30))
+# При нескольких воркерах FSM пишется в базу сразу: другой воркер читает ее оттуда
+FSM_FLUSH_SECONDS = 0.0 if MULTI_WORKER else float(os.getenv('FSM_FLUSH_SECONDS', 1))
+FSM_FLUSH_BATCH = int(os.getenv('FSM_FLUSH_BATCH', 500))
+FSM_STATE_TTL = float(os.getenv('FSM_STATE_TTL', 7 * 24 * 3600))
+# Каталог для файлов межпроцессных блокировок (общий для всех воркеров на машине)
+LOCK_DIR = os.getenv('LOCK_DIR', tempfile.gettempdir())
+# Регистрировать вебхук WEBAPP_URL/webhook при старте (делает ровно один воркер)
+WEBHOOK_REGISTER = os.getenv('WEBHOOK_REGISTER', '1') == '1'
+# Ограничение частоты действий игрока: секунд на одно действие и сколько можно подряд
+RATE_LIMIT_TUNE_SECONDS = float(os.getenv('RATE_LIMIT_TUNE_SECONDS', 1))
+RATE_LIMIT_TUNE_BURST = int(os.getenv('RATE_LIMIT_TUNE_BURST', 5))
+RATE_LIMIT_RACE_SECONDS = float(os.getenv('RATE_LIMIT_RACE_SECONDS', 2))
+RATE_LIMIT_RACE_BURST = int(os.getenv('RATE_LIMIT_RACE_BURST', 3))
+RATE_LIMIT_MARKET_SECONDS = float(os.getenv('RATE_LIMIT_MARKET_SECONDS', 1))
+RATE_LIMIT_MARKET_BURST = int(os.getenv('RATE_LIMIT_MARKET_BURST', 5))
+RATE_LIMIT_DONATE_SECONDS = float(os.getenv('RATE_LIMIT_DONATE_SECONDS', 5))
+RATE_LIMIT_DONATE_BURST = int(os.getenv('RATE_LIMIT_DONATE_BURST', 2))
+RATE_LIMIT_FIGHT_SECONDS = float(os.getenv('RATE_LIMIT_FIGHT_SECONDS', 2))
+RATE_LIMIT_FIGHT_BURST = int(os.getenv('RATE_LIMIT_FIGHT_BURST', 3))
+# Сколько ведер держать в памяти
+RATE_LIMIT_STORE_SIZE = int(os.getenv('RATE_LIMIT_STORE_SIZE', 100000))
+# Авторизация мини-приложения: проверять ли токен (0 - только для локальной отладки),
+# сколько (сек) initData считается свежей, время жизни токена сессии и размер кэша сессий
+AUTH_REQUIRED = os.getenv('AUTH_REQUIRED', '1') == '1'
+AUTH_INIT_DATA_MAX_AGE = float(os.getenv('AUTH_INIT_DATA_MAX_AGE', 24 * 3600))
+AUTH_TOKEN_TTL = float(os.getenv('AUTH_TOKEN_TTL', 3600))
+AUTH_SESSION_CACHE_SIZE = int(os.getenv('AUTH_SESSION_CACHE_SIZE', 50000))
+# Исходящие сообщения: запросов в секунду на бота, пауза (сек) между сообщениями в один чат,
+# одновременных запросов, повторов после flood control и размер пачки получателей рассылки
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 25))
+SEND_CHAT_INTERVAL = float(os.getenv('SEND_CHAT_INTERVAL', 1))
+SEND_MAX_IN_FLIGHT = int(os.getenv('SEND_MAX_IN_FLIGHT', 10))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', 3))
+BROADCAST_CHUNK_SIZE = int(os.getenv('BROADCAST_CHUNK_SIZE', 500))
+# Свой адрес Bot API (локальный сервер или заглушка для тестов). Пусто - api.telegram.org
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+# Авито: бронь на время подтверждения покупки (сек), через сколько дней объявление
+# снимается, как часто (сек) искать просроченные и сколько снимать за один проход
+LISTING_RESERVATION_SECONDS = float(os.getenv('LISTING_RESERVATION_SECONDS', 120))
+LISTING_MAX_AGE_DAYS = float(os.getenv('LISTING_MAX_AGE_DAYS', 30))
+LISTING_EXPIRE_INTERVAL = float(os.getenv('LISTING_EXPIRE_INTERVAL', 600))
+LISTING_EXPIRE_BATCH = int(os.getenv('LISTING_EXPIRE_BATCH', 500))
+# Push-события (SSE): пауза между пингами (сек), буфер событий на соединение,
+# лимит соединений на процесс и на одного игрока
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', 15))
+SSE_BUFFER_SIZE = int(os.getenv('SSE_BUFFER_SIZE', 100))
+SSE_MAX_CONNECTIONS = int(os.getenv('SSE_MAX_CONNECTIONS', 5000))
+SSE_MAX_PER_USER = int(os.getenv('SSE_MAX_PER_USER', 3))
+# История гонок и драк пишется пачками: сколько записей копить, как часто (сек)
+# сбрасывать в базу и сколько держать в памяти, если база недоступна
+HISTORY_FLUSH_SIZE = int(os.getenv('HISTORY_FLUSH_SIZE', 500))
+HISTORY_FLUSH_SECONDS = float(os.getenv('HISTORY_FLUSH_SECONDS', 2))
+HISTORY_MAX_BUFFER = int(os.getenv('HISTORY_MAX_BUFFER', 50000))
@@ -1,15 +1,190 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
-from config import DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from config import (
+    DATABASE_URL, SLOW_QUERY_MS, DB_ECHO,
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE,
+    DB_STATEMENT_CACHE_SIZE, SQLITE_BUSY_TIMEOUT_MS,
+    DATABASE_READ_URL, READ_STICKY_SECONDS, MULTI_WORKER
+)
+
+logger = logging.getLogger(__name__)
+
+# ---------- ДВИЖОК ----------
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    """Настройки SQLite на каждое новое соединение.
+
+    WAL дает параллельное чтение во время записи, synchronous=NORMAL в
+    режиме WAL безопасен и убирает fsync на каждый коммит, busy_timeout
+    заставляет ждать блокировку вместо мгновенного 'database is locked'.
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def _apply_sqlite_read_pragmas(dbapi_connection, connection_record):
+    # Режим журнала на соединении только для чтения не меняется
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+def sqlite_read_only_url(url: str) -> Optional[str]:
+    """Тот же файл SQLite, открытый в режиме только чтения (URI mode=ro).
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+    Для базы в памяти возвращает None - второе соединение увидит пустую базу.
+    """
+    parsed = make_url(url)
+    database = parsed.database
+    if not database or database == ":memory:" or database.startswith("file:"):
+        return None
+    return parsed.set(
+        database=f"file:{database}",
+        query={**parsed.query, "mode": "ro", "uri": "true"}
+    ).render_as_string(hide_password=False)
+
+def _begin_sqlite_immediate(conn):
+    """Транзакция с блокировкой записи с самого начала (см. begin_write)"""
+    if conn.get_execution_options().get("sqlite_immediate"):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+def make_engine(url: str, read_only: bool = False, **overrides):
+    """Асинхронный движок с настройками под конкретную СУБД"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    kwargs = {
+        "echo": DB_ECHO,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+    }
+    
+    if backend == "sqlite":
+        # По умолчанию aiosqlite открывает новое соединение на каждую сессию
+        kwargs["poolclass"] = AsyncAdaptedQueuePool
+        kwargs["connect_args"] = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    elif backend == "postgresql":
+        kwargs["pool_pre_ping"] = True
+        kwargs["pool_recycle"] = DB_POOL_RECYCLE
+        # Кэши подготовленных запросов - параметры только asyncpg, psycopg их не примет
+        if parsed.get_driver_name() == "asyncpg":
+            kwargs["connect_args"] = {
+                "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+                "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            }
+    
+    kwargs.update(overrides)
+    async_engine = create_async_engine(url, **kwargs)
+    
+    if backend == "sqlite":
+        pragmas = _apply_sqlite_read_pragmas if read_only else _apply_sqlite_pragmas
+        event.listen(async_engine.sync_engine, "connect", pragmas)
+        if not read_only:
+            event.listen(async_engine.sync_engine, "begin", _begin_sqlite_immediate)
+    
+    return async_engine
+
+def make_read_engine(url: str, primary):
+    """Движок для чтения: DATABASE_READ_URL, для SQLite - read-only URI, иначе основной"""
+    if DATABASE_READ_URL:
+        return make_engine(DATABASE_READ_URL, read_only=True)
+    if make_url(url).get_backend_name() == "sqlite":
+        read_only_url = sqlite_read_only_url(url)
+        if read_only_url:
+            return make_engine(read_only_url, read_only=True)
+    return primary
+
+engine = make_engine(DATABASE_URL)
+read_engine = make_read_engine(DATABASE_URL, engine)
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+AsyncReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False)
 Base = declarative_base()
 
+# ---------- READ-YOUR-WRITES ----------
+# tg_id -> момент, до которого чтения игрока идут в основную базу.
+# Порядок вставки = порядок сроков, поэтому просроченные всегда в начале
+_recent_writes = OrderedDict()
+
+def mark_written(tg_id: int):
+    """Игрок только что изменился: читаем его с основной базы, пока реплика не догонит"""
+    now = time.monotonic()
+    _recent_writes.pop(tg_id, None)
+    _recent_writes[tg_id] = now + READ_STICKY_SECONDS
+    while _recent_writes:
+        oldest, deadline = next(iter(_recent_writes.items()))
+        if deadline > now:
+            break
+        del _recent_writes[oldest]
+
+def is_sticky(tg_id: Optional[int]) -> bool:
+    if tg_id is None:
+        return False
+    if MULTI_WORKER:
+        # Запись могла пройти в другом воркере - чтения игрока всегда с основной базы
+        return True
+    deadline = _recent_writes.get(tg_id)
+    return deadline is not None and deadline > time.monotonic()
+
+def read_session_for(tg_id: Optional[int] = None) -> AsyncSession:
+    """Сессия для чтения: реплика, либо основная база сразу после записи игрока"""
+    if read_engine is engine or is_sticky(tg_id):
+        return AsyncSessionLocal()
+    return AsyncReadSessionLocal()
+
+# ---------- БЛОКИРОВКА ЗАПИСИ ----------
+async def begin_write(session):
+    """Начинает транзакцию сессии, которая будет читать и потом менять строки.
+
+    В Postgres строки блокирует SELECT ... FOR UPDATE. SQLite его
+    игнорирует, а блокировку записи берет только на первом UPDATE: два
+    запроса успевают прочитать одно и то же и второй затирает изменения
+    первого. Поэтому здесь транзакция SQLite начинается с BEGIN IMMEDIATE -
+    конкурирующий запрос ждет (busy_timeout), пока первый не закоммитит.
+    Работает, только если это первое обращение сессии к базе.
+    """
+    if not session.in_transaction():
+        await session.connection(execution_options={"sqlite_immediate": True})
+
+# ---------- МЕДЛЕННЫЕ ЗАПРОСЫ ----------
+def watch_slow_queries(async_engine, threshold_ms: float):
+    """Пишет в лог каждый запрос, который выполнялся дольше порога"""
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _query_started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _query_finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+        if elapsed_ms >= threshold_ms:
+            logger.warning("Slow query (%.1f ms): %s", elapsed_ms, statement)
+
+if SLOW_QUERY_MS > 0:
+    watch_slow_queries(engine, SLOW_QUERY_MS)
+    if read_engine is not engine:
+        watch_slow_queries(read_engine, SLOW_QUERY_MS)
+
 async def init_db():
+    from migrations import run_migrations, check_query_plans
+
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
+        await conn.run_sync(check_query_plans)
 
 async def get_session() -> AsyncSession:
     async with AsyncSessionLocal() as session:
-        yield session
\ No newline at end of file
+        yield session
+
+async def get_read_session(tg_id: Optional[int] = None) -> AsyncSession:
+    """Сессия только для чтения. tg_id берется из пути запроса, если он там есть"""
+    async with read_session_for(tg_id) as session:
+        yield session
@@ -0,0 +1,151 @@
+import asyncio
+import json
+from collections import deque
+from typing import Optional
+
+from config import SSE_BUFFER_SIZE, SSE_MAX_CONNECTIONS, SSE_MAX_PER_USER
+
+# Общие топики, на которые можно подписаться из мини-приложения
+MARKET = "market"
+PUBLIC_TOPICS = {MARKET}
+
+# Клиент не успевал читать, часть событий выброшена - пусть перечитает состояние сам
+RESYNC = "event: resync\ndata: {}\n\n"
+HEARTBEAT = ": ping\n\n"
+
+
+def user_topic(tg_id: int) -> str:
+    """Личный топик игрока: баланс, гараж, инвентарь"""
+    return f"user:{tg_id}"
+
+
+def encode(event: str, data) -> str:
+    """Кадр Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class Subscription:
+    """Подписка одного соединения: ограниченный буфер готовых кадров.
+
+    При переполнении буфер очищается и в нем остается один resync - память
+    на медленного клиента не растет, а клиент не пропустит изменения молча.
+    """
+
+    def __init__(self, owner, topics, maxsize: int):
+        self.owner = owner
+        self.topics = frozenset(topics)
+        self.maxsize = maxsize
+        self.closed = False
+        self._frames = deque()
+        self._ready = asyncio.Event()
+
+    def put(self, frame: str):
+        if len(self._frames) >= self.maxsize:
+            self._frames.clear()
+            frame = RESYNC
+        self._frames.append(frame)
+        self._ready.set()
+
+    async def get(self, timeout: float) -> Optional[str]:
+        """Следующий кадр или None, если за timeout ничего не пришло (или подписка закрыта)"""
+        if not self._frames and not self.closed:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        return self._frames.popleft() if self._frames else None
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+
+class EventBus:
+    """Pub/sub внутри процесса.
+
+    Событие кодируется в кадр SSE один раз и раскладывается по буферам
+    подписчиков топика - публикация синхронная и не ждет клиентов.
+    Подписчики видят события только своего процесса: при нескольких
+    воркерах клиент, подключенный к другому воркеру, узнает об изменении
+    при следующем перечитывании (resync, переподключение).
+    """
+
+    def __init__(self, buffer_size: int, max_connections: int, max_per_user: int):
+        self.buffer_size = buffer_size
+        self.max_connections = max_connections
+        self.max_per_user = max_per_user
+        self._topics = {}  # топик -> set подписок
+        self._owners = {}  # владелец -> число подписок
+        self._count = 0
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, owner, topics) -> Optional[Subscription]:
+        """Новая подписка или None, если превышен лимит соединений"""
+        if self._count >= self.max_connections or self._owners.get(owner, 0) >= self.max_per_user:
+            return None
+        subscription = Subscription(owner, topics, self.buffer_size)
+        for topic in subscription.topics:
+            self._topics.setdefault(topic, set()).add(subscription)
+        self._owners[owner] = self._owners.get(owner, 0) + 1
+        self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription.closed:
+            return
+        subscription.close()
+        for topic in subscription.topics:
+            subscribers = self._topics[topic]
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._topics[topic]
+        self._count -= 1
+        self._owners[subscription.owner] -= 1
+        if not self._owners[subscription.owner]:
+            del self._owners[subscription.owner]
+
+    def publish(self, topic: str, event: str, data=None):
+        subscribers = self._topics.get(topic)
+        self.published += 1
+        if not subscribers:
+            return
+        frame = encode(event, data if data is not None else {})
+        for subscription in subscribers:
+            subscription.put(frame)
+        self.delivered += len(subscribers)
+
+    def close(self):
+        """Закрыть все подписки (остановка приложения)"""
+        for subscribers in list(self._topics.values()):
+            for subscription in list(subscribers):
+                self.unsubscribe(subscription)
+
+    def connections(self) -> int:
+        return self._count
+
+    def stats(self):
+        return {
+            "connections": self._count,
+            "topics": len(self._topics),
+            "published": self.published,
+            "delivered": self.delivered
+        }
+
+
+bus = EventBus(SSE_BUFFER_SIZE, SSE_MAX_CONNECTIONS, SSE_MAX_PER_USER)
+
+
+async def stream(subscription: Subscription, heartbeat: float):
+    """Тело ответа text/event-stream. Пустой комментарий раз в heartbeat секунд
+    держит соединение живым через прокси и быстро выявляет отвалившихся клиентов"""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            frame = await subscription.get(heartbeat)
+            if frame is None and subscription.closed:
+                return
+            yield frame if frame is not None else HEARTBEAT
+    finally:
+        bus.unsubscribe(subscription)
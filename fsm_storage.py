@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from sqlalchemy import select, insert, delete
+
+from database import AsyncSessionLocal
+from models import FsmRecord
+
+logger = logging.getLogger(__name__)
+
+# Как часто (сек) удалять брошенные диалоги из базы
+EXPIRE_EVERY_SECONDS = 600
+
+
+def _log_failed_flush(task: asyncio.Task):
+    """Ошибка досрочной записи: пачка уже вернулась в _pending (см. flush),
+    ее запишет следующий сброс - здесь только забираем и логируем исключение"""
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("FSM storage early flush failed", exc_info=task.exception())
+
+
+class DatabaseStorage(BaseStorage):
+    """FSM-хранилище aiogram в нашей базе (таблица fsm_states).
+
+    Перед базой стоит LRU-кэш ограниченного размера. Запись кэшу не
+    доверяется дольше cache_seconds: другой воркер мог изменить состояние.
+    Изменения копятся в памяти и пишутся пачкой раз в flush_seconds или
+    как только накопилось flush_batch ключей; flush_seconds=0 - каждое
+    изменение пишется сразу (несколько воркеров читают FSM из базы). Пустые записи (нет состояния
+    и данных) удаляются, а диалоги без изменений дольше ttl считаются
+    брошенными и удаляются фоновой чисткой.
+    """
+
+    def __init__(
+        self,
+        cache_size: int,
+        cache_seconds: float,
+        flush_seconds: float,
+        flush_batch: int,
+        ttl: float,
+        session_factory=AsyncSessionLocal
+    ):
+        self._session_factory = session_factory
+        self._key_builder = DefaultKeyBuilder(
+            with_bot_id=True,
+            with_business_connection_id=True,
+            with_destiny=True
+        )
+        self._cache = OrderedDict()  # ключ -> (загружено в, состояние, данные)
+        self._pending = {}  # ключ -> (состояние, данные), еще не записано в базу
+        self._cache_size = cache_size
+        self._cache_seconds = cache_seconds
+        self._flush_seconds = flush_seconds
+        self._flush_batch = flush_batch
+        self._ttl = ttl
+        self._flush_lock = asyncio.Lock()
+        self._stop = asyncio.Event()
+        self._flusher = None
+        self._early_flush = None
+
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    # ---------- ЧТЕНИЕ ----------
+    async def _load(self, key: str):
+        cutoff = datetime.utcnow() - timedelta(seconds=self._ttl)
+        async with self._session_factory() as session:
+            row = (await session.execute(
+                select(FsmRecord.state, FsmRecord.data, FsmRecord.updated_at)
+                .where(FsmRecord.key == key)
+            )).first()
+        if row is None or row.updated_at < cutoff:
+            return None, {}
+        return row.state, dict(row.data or {})
+
+    def _remember(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        self._cache.pop(key, None)
+        self._cache[key] = (time.monotonic(), state, data)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    async def _record(self, key: str):
+        if key in self._pending:
+            return self._pending[key]
+
+        cached = self._cache.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self._cache_seconds:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[1], cached[2]
+
+        self.misses += 1
+        state, data = await self._load(key)
+        self._remember(key, state, data)
+        return state, data
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._record(self._key_builder.build(key))
+        return state
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._record(self._key_builder.build(key))
+        return data.copy()
+
+    # ---------- ЗАПИСЬ ----------
+    async def _write(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        self._pending[key] = (state, data)
+        self._remember(key, state, data)
+        if self._flush_seconds <= 0:
+            await self.flush()
+        elif len(self._pending) >= self._flush_batch and (self._early_flush is None or self._early_flush.done()):
+            self._early_flush = asyncio.create_task(self.flush())
+            self._early_flush.add_done_callback(_log_failed_flush)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        built = self._key_builder.build(key)
+        _, data = await self._record(built)
+        await self._write(built, state.state if isinstance(state, State) else state, data)
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        built = self._key_builder.build(key)
+        state, _ = await self._record(built)
+        await self._write(built, state, data.copy())
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+
+            now = datetime.utcnow()
+            rows = [
+                {"key": key, "state": state, "data": data, "updated_at": now}
+                for key, (state, data) in batch.items()
+                if state is not None or data
+            ]
+            try:
+                async with self._session_factory() as session:
+                    await session.execute(delete(FsmRecord).where(FsmRecord.key.in_(list(batch))))
+                    if rows:
+                        await session.execute(insert(FsmRecord), rows)
+                    await session.commit()
+            except Exception:
+                # Возвращаем в очередь то, что не успели перезаписать новыми изменениями
+                for key, value in batch.items():
+                    self._pending.setdefault(key, value)
+                raise
+            self.flushes += 1
+
+    async def expire(self):
+        """Удалить диалоги, которые не менялись дольше ttl"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self._ttl)
+        async with self._session_factory() as session:
+            result = await session.execute(delete(FsmRecord).where(FsmRecord.updated_at < cutoff))
+            await session.commit()
+        if result.rowcount:
+            logger.info("Expired %s stale FSM states", result.rowcount)
+
+    # ---------- ФОНОВАЯ ЗАДАЧА ----------
+    async def _run_flusher(self):
+        last_expire = 0.0
+        # При записи сразу фоновой задаче остается только чистка
+        interval = self._flush_seconds if self._flush_seconds > 0 else EXPIRE_EVERY_SECONDS
+        while not self._stop.is_set():
+            try:
+                await asyncio.wait_for(self._stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+                if time.monotonic() - last_expire >= EXPIRE_EVERY_SECONDS:
+                    await self.expire()
+                    last_expire = time.monotonic()
+            except Exception:
+                logger.exception("FSM storage flush failed")
+
+    def start(self):
+        if self._flusher is None:
+            self._stop.clear()
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def close(self) -> None:
+        # Не отменяем фоновую запись, а ждем ее: отмена между удалением старых
+        # строк и вставкой новых потеряла бы пачку, уже вынутую из _pending
+        if self._flusher is not None:
+            self._stop.set()
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "cached": len(self._cache),
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "flushes": self.flushes
+        }
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select, insert, and_, or_
+
+from config import HISTORY_FLUSH_SIZE, HISTORY_FLUSH_SECONDS, HISTORY_MAX_BUFFER
+from database import AsyncSessionLocal
+from market import encode_cursor, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from models import User, RaceHistory, FightHistory
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryRecorder:
+    """Отложенная запись истории гонок и драк (write-behind).
+
+    Результаты копятся в памяти и уходят в базу одним многострочным
+    INSERT на таблицу: когда набралось flush_size записей, раз в
+    flush_seconds и при остановке. Запись в историю не добавляет запросов
+    к действию игрока. Если база недоступна, записи возвращаются в буфер;
+    буфер ограничен max_buffer - при переполнении выбрасываются самые старые.
+    При аварийном завершении процесса теряется не больше одного интервала.
+    """
+
+    def __init__(self, flush_size: int, flush_seconds: float, max_buffer: int):
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._buffers = {RaceHistory: [], FightHistory: []}
+        # Пачка, которая сейчас пишется: читатели видят ее, пока она не закоммичена
+        self._flushing = {RaceHistory: [], FightHistory: []}
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._runner = None
+
+        self.recorded = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failures = 0
+
+    # ---------- ЗАПИСЬ ----------
+    def _add(self, model, row: dict):
+        row["created_at"] = datetime.utcnow()
+        buffer = self._buffers[model]
+        buffer.append(row)
+        self.recorded += 1
+        if len(buffer) > self.max_buffer:
+            overflow = len(buffer) - self.max_buffer
+            del buffer[:overflow]
+            self.dropped += overflow
+        if self.depth() >= self.flush_size:
+            self._wakeup.set()
+
+    def record_race(self, player1_id: int, player2_id: Optional[int], winner_id: Optional[int], bet_amount: float = 0):
+        """player2_id = None - гонка с ботом, winner_id = None - победил бот"""
+        self._add(RaceHistory, {
+            "player1_id": player1_id,
+            "player2_id": player2_id,
+            "winner_id": winner_id,
+            "bet_amount": bet_amount
+        })
+
+    def record_fight(self, attacker_id: int, defender_id: int, winner_id: int, location: str):
+        self._add(FightHistory, {
+            "attacker_id": attacker_id,
+            "defender_id": defender_id,
+            "winner_id": winner_id,
+            "location": location
+        })
+
+    # ---------- СБРОС В БАЗУ ----------
+    async def flush(self):
+        async with self._lock:
+            for model in self._buffers:
+                self._flushing[model], self._buffers[model] = self._buffers[model], []
+            try:
+                async with AsyncSessionLocal() as session:
+                    for model, rows in self._flushing.items():
+                        if rows:
+                            await session.execute(insert(model), rows)
+                    await session.commit()
+            except Exception:
+                self.failures += 1
+                for model, rows in self._flushing.items():
+                    self._buffers[model][:0] = rows
+                    overflow = len(self._buffers[model]) - self.max_buffer
+                    if overflow > 0:
+                        del self._buffers[model][:overflow]
+                        self.dropped += overflow
+                logger.exception("History flush failed, %s records kept in buffer", self.depth())
+            else:
+                self.flushed += sum(len(rows) for rows in self._flushing.values())
+            finally:
+                self._flushing = {model: [] for model in self._buffers}
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self.depth():
+                await self.flush()
+
+    def start(self):
+        if self._runner is None:
+            self._stopping = False
+            self._runner = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить фоновую запись и сбросить остаток.
+
+        Фоновую задачу не отменяем, а просим выйти и ждем: отмена посреди
+        flush() потеряла бы пачку, которая уже вынута из буфера.
+        """
+        if self._runner is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._runner
+            self._runner = None
+        await self.flush()
+
+    # ---------- ЧТЕНИЕ ----------
+    def pending(self, model, user_id: int, columns):
+        """Еще не записанные в базу строки игрока (user_id в одной из колонок)"""
+        return [
+            row
+            for rows in (self._flushing[model], self._buffers[model])
+            for row in rows
+            if any(row[column] == user_id for column in columns)
+        ]
+
+    def depth(self) -> int:
+        return sum(len(rows) for rows in self._buffers.values())
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "recorded": self.recorded,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failures": self.failures
+        }
+
+
+recorder = HistoryRecorder(HISTORY_FLUSH_SIZE, HISTORY_FLUSH_SECONDS, HISTORY_MAX_BUFFER)
+
+
+# ---------- ПОСТРАНИЧНАЯ ИСТОРИЯ ----------
+# Колонки с участниками (игрок, соперник): по ним ищем строки игрока
+_PLAYER_COLUMNS = {
+    RaceHistory: ("player1_id", "player2_id"),
+    FightHistory: ("attacker_id", "defender_id"),
+}
+
+
+def _serialize(model, row: dict, user_id: int, usernames: dict) -> dict:
+    first, second = _PLAYER_COLUMNS[model]
+    opponent_id = row[second] if row[first] == user_id else row[first]
+    item = {
+        "id": row["id"],
+        "opponent": usernames.get(opponent_id),
+        "won": row["winner_id"] == user_id,
+        "created_at": row["created_at"].isoformat(),
+        # Еще в буфере, в базу попадет при следующей записи
+        "pending": row["id"] is None
+    }
+    if model is RaceHistory:
+        item["vs_bot"] = opponent_id is None
+        item["bet_amount"] = row["bet_amount"] or 0
+    else:
+        item["role"] = "attacker" if row[first] == user_id else "defender"
+        item["location"] = row["location"]
+    return item
+
+
+async def fetch_history_page(
+    session,
+    model,
+    tg_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    """Страница истории игрока от новых записей к старым, None - игрока нет.
+
+    Строки из базы сливаются с еще не записанными из буфера по ключу
+    (created_at, id); у строк из буфера id нет, для сортировки это 0.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    user_id = (await session.execute(select(User.id).where(User.tg_id == tg_id))).scalar_one_or_none()
+    if user_id is None:
+        return None
+
+    columns = _PLAYER_COLUMNS[model]
+    table = model.__table__
+    query = select(table).where(or_(*(table.c[column] == user_id for column in columns)))
+
+    after = None
+    if cursor:
+        after = decode_cursor(cursor)
+        created_at, row_id = after
+        query = query.where(or_(
+            table.c.created_at < created_at,
+            and_(table.c.created_at == created_at, table.c.id < row_id)
+        ))
+
+    query = query.order_by(table.c.created_at.desc(), table.c.id.desc()).limit(limit + 1)
+    rows = [dict(row) for row in (await session.execute(query)).mappings()]
+
+    # Пачка могла закоммититься, пока шел запрос: такие строки уже пришли из базы
+    stored = {(row["created_at"], *(row[column] for column in columns)) for row in rows}
+    rows += [
+        dict(row, id=None) for row in recorder.pending(model, user_id, columns)
+        if (after is None or (row["created_at"], 0) < after)
+        and (row["created_at"], *(row[column] for column in columns)) not in stored
+    ]
+    rows.sort(key=lambda row: (row["created_at"], row["id"] or 0), reverse=True)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(last["created_at"], last["id"] or 0)
+
+    # Имена соперников - одним запросом на страницу
+    opponent_ids = {row[column] for row in rows for column in columns} - {user_id, None}
+    usernames = {}
+    if opponent_ids:
+        usernames = dict((await session.execute(
+            select(User.id, User.username).where(User.id.in_(opponent_ids))
+        )).all())
+
+    return {
+        "items": [_serialize(model, row, user_id, usernames) for row in rows],
+        "next_cursor": next_cursor
+    }
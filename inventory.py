@@ -0,0 +1,77 @@
+from typing import Optional
+
+from sqlalchemy import select
+
+from market import InvalidCursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from models import User, InventoryItem
+
+
+def serialize_item(item: InventoryItem) -> dict:
+    return {
+        "id": item.id,
+        "item_type": item.item_type,
+        "level": item.level,
+        "data": item.data,
+        "source": item.source,
+        "created_at": item.created_at.isoformat() if item.created_at else None
+    }
+
+
+def add_item(session, user_id: int, item_type: str, item_data: Optional[dict], source: Optional[str] = None):
+    """Положить запчасть в инвентарь. Новая строка - никаких гонок с другими записями"""
+    if item_data is None:
+        data, level = {}, None
+    elif isinstance(item_data, dict):
+        data, level = item_data, item_data.get("level")
+    else:
+        # Не словарь - оборачиваем так же, как миграция 4 переносила старый инвентарь
+        data = {"value": item_data}
+        level = item_data[1] if isinstance(item_data, list) and len(item_data) > 1 and isinstance(item_data[1], int) else None
+    item = InventoryItem(
+        user_id=user_id,
+        item_type=item_type,
+        level=level,
+        data=data,
+        source=source
+    )
+    session.add(item)
+    return item
+
+
+async def fetch_inventory_page(
+    session,
+    tg_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    item_type: Optional[str] = None,
+):
+    """Одна страница инвентаря игрока, от новых запчастей к старым.
+
+    Курсор - id последней запчасти на предыдущей странице.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = (
+        select(InventoryItem)
+        .join(User, User.id == InventoryItem.user_id)
+        .where(User.tg_id == tg_id)
+    )
+    if item_type:
+        query = query.where(InventoryItem.item_type == item_type)
+    if cursor:
+        try:
+            query = query.where(InventoryItem.id < int(cursor))
+        except ValueError as e:
+            raise InvalidCursor(str(e)) from e
+
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    items = (await session.execute(
+        query.order_by(InventoryItem.id.desc()).limit(limit + 1)
+    )).scalars().all()
+    has_more = len(items) > limit
+    items = items[:limit]
+
+    return {
+        "items": [serialize_item(item) for item in items],
+        "next_cursor": str(items[-1].id) if has_more else None
+    }
@@ -0,0 +1,131 @@
+import asyncio
+import bisect
+import logging
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import User, MINOR_UNITS
+
+logger = logging.getLogger(__name__)
+
+# Метрика -> (атрибут User, делитель для отображения)
+METRICS = {
+    "races_won": ("races_won", 1),
+    "reputation": ("reputation", 1),
+    "balance_token": ("balance_token_minor", MINOR_UNITS),
+    "total_earned_tokens": ("total_earned_tokens_minor", MINOR_UNITS),
+}
+
+
+# ---------- ИНДЕКС РЕЙТИНГА ----------
+class RankingIndex:
+    """Отсортированный список (-очки, tg_id) + очки по tg_id.
+
+    Место игрока ищется бинарным поиском за O(log n). Обновление - тоже
+    бинарный поиск плюс сдвиг хвоста списка (memmove), без пересортировки.
+    При равных очках выше тот, у кого меньше tg_id.
+    """
+
+    def __init__(self):
+        self._scores = {}
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def update(self, tg_id: int, score):
+        old = self._scores.get(tg_id)
+        if old == score:
+            return
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, tg_id))]
+        self._scores[tg_id] = score
+        bisect.insort(self._keys, (-score, tg_id))
+
+    def remove(self, tg_id: int):
+        old = self._scores.pop(tg_id, None)
+        if old is not None:
+            del self._keys[bisect.bisect_left(self._keys, (-old, tg_id))]
+
+    def rebuild(self, scores: dict):
+        self._scores = dict(scores)
+        self._keys = sorted((-score, tg_id) for tg_id, score in self._scores.items())
+
+    def rank(self, tg_id: int):
+        """Место игрока (с 1) или None, если его нет в рейтинге"""
+        score = self._scores.get(tg_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self._keys, (-score, tg_id)) + 1
+
+    def score(self, tg_id: int):
+        return self._scores.get(tg_id)
+
+    def top(self, limit: int):
+        return [(tg_id, -neg_score) for neg_score, tg_id in self._keys[:limit]]
+
+
+# ---------- ТАБЛИЦЫ ЛИДЕРОВ ----------
+class Leaderboard:
+    """Рейтинги по всем метрикам в памяти процесса.
+
+    Пути записи (гонки, токены) сообщают об изменениях через observe(),
+    а фоновая сверка с SQL периодически перестраивает индексы целиком:
+    так рейтинг догоняет изменения из других воркеров и массовых операций.
+    """
+
+    def __init__(self):
+        self.indexes = {metric: RankingIndex() for metric in METRICS}
+        self.names = {}
+
+    def observe(self, user: User):
+        """Учесть текущие значения игрока после коммита"""
+        self.names[user.tg_id] = user.username or user.first_name
+        for metric, (attr, _) in METRICS.items():
+            self.indexes[metric].update(user.tg_id, getattr(user, attr) or 0)
+
+    async def reconcile(self, session):
+        columns = [getattr(User, attr) for attr, _ in METRICS.values()]
+        rows = (await session.execute(
+            select(User.tg_id, User.username, User.first_name, *columns)
+        )).all()
+
+        self.names = {row[0]: row[1] or row[2] for row in rows}
+        for position, metric in enumerate(METRICS, start=3):
+            self.indexes[metric].rebuild({row[0]: row[position] or 0 for row in rows})
+
+    async def run_reconciler(self, interval: float):
+        """Фоновая задача: сверка с базой каждые interval секунд"""
+        while True:
+            try:
+                async with AsyncSessionLocal() as session:
+                    await self.reconcile(session)
+            except Exception:
+                logger.exception("Leaderboard reconcile failed")
+            await asyncio.sleep(interval)
+
+    def _entry(self, metric: str, tg_id: int, rank: int, score):
+        scale = METRICS[metric][1]
+        return {
+            "rank": rank,
+            "tg_id": tg_id,
+            "name": self.names.get(tg_id),
+            "score": score / scale if scale != 1 else score
+        }
+
+    def top(self, metric: str, limit: int = 10):
+        return [
+            self._entry(metric, tg_id, rank, score)
+            for rank, (tg_id, score) in enumerate(self.indexes[metric].top(limit), start=1)
+        ]
+
+    def rank(self, metric: str, tg_id: int):
+        index = self.indexes[metric]
+        rank = index.rank(tg_id)
+        if rank is None:
+            return None
+        return self._entry(metric, tg_id, rank, index.score(tg_id))
+
+
+leaderboard = Leaderboard()
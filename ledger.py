@@ -0,0 +1,106 @@
+from sqlalchemy import update, event
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import User, LedgerEntry, MINOR_UNITS
+
+CASH = "cash"
+TOKEN = "token"
+
+_BALANCE_COLUMNS = {
+    CASH: User.balance_cash_minor,
+    TOKEN: User.balance_token_minor,
+}
+
+
+class InsufficientFunds(Exception):
+    """Списание не прошло: на балансе меньше, чем нужно"""
+
+
+def to_minor(amount) -> int:
+    return int(round(amount * MINOR_UNITS))
+
+
+def from_minor(value: int) -> float:
+    return value / MINOR_UNITS
+
+
+# ---------- ИЗМЕНЕНИЕ БАЛАНСОВ ----------
+async def apply(session, user_id: int, *, cash=0, tokens=0, reason: str, ref: str = None,
+                allow_negative: bool = False):
+    """Атомарно меняет балансы игрока и записывает проводки.
+
+    Суммы в основных единицах (доллары, GTR), со знаком. Всё делается одним
+    UPDATE ... SET balance = balance + :delta WHERE balance >= :debit, так что
+    параллельные запросы с разных воркеров не теряют изменения и не уводят
+    баланс в минус. Если денег не хватает - InsufficientFunds, ничего не
+    изменено. Положительное начисление токенов увеличивает total_earned_tokens.
+
+    Возвращает новые (balance_cash_minor, balance_token_minor). Изменения
+    фиксируются вместе с остальной транзакцией вызывающего кода.
+    """
+    deltas = {CASH: to_minor(cash), TOKEN: to_minor(tokens)}
+
+    query = update(User).where(User.id == user_id)
+    values = {}
+    for currency, delta in deltas.items():
+        if not delta:
+            continue
+        column = _BALANCE_COLUMNS[currency]
+        values[column.key] = column + delta
+        if delta < 0 and not allow_negative:
+            query = query.where(column >= -delta)
+
+    if deltas[TOKEN] > 0:
+        values["total_earned_tokens_minor"] = User.total_earned_tokens_minor + deltas[TOKEN]
+
+    if not values:
+        raise ValueError("Nothing to apply")
+
+    result = await session.execute(
+        query.values(**values)
+        .returning(User.balance_cash_minor, User.balance_token_minor, User.total_earned_tokens_minor)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.first()
+    if row is None:
+        raise InsufficientFunds(f"user {user_id}: cash {cash}, tokens {tokens}")
+
+    cash_after, token_after, earned_after = row
+    _sync_loaded_user(session, user_id, cash_after, token_after, earned_after)
+
+    balances_after = {CASH: cash_after, TOKEN: token_after}
+    session.add_all([
+        LedgerEntry(
+            user_id=user_id,
+            currency=currency,
+            amount=delta,
+            balance_after=balances_after[currency],
+            reason=reason,
+            ref=ref
+        )
+        for currency, delta in deltas.items() if delta
+    ])
+
+    return cash_after, token_after
+
+
+async def transfer(session, from_user_id: int, to_user_id: int, *, cash, reason: str, ref: str = None):
+    """Перевод налички между игроками: списание с проверкой и зачисление"""
+    await apply(session, from_user_id, cash=-cash, reason=reason, ref=ref)
+    await apply(session, to_user_id, cash=cash, reason=reason, ref=ref)
+
+
+def _sync_loaded_user(session, user_id, cash_minor, token_minor, earned_minor):
+    """Обновляет уже загруженный в сессию объект User значениями из RETURNING"""
+    user = session.identity_map.get(session.identity_key(User, user_id))
+    if user is None:
+        return
+    set_committed_value(user, "balance_cash_minor", cash_minor)
+    set_committed_value(user, "balance_token_minor", token_minor)
+    set_committed_value(user, "total_earned_tokens_minor", earned_minor)
+
+
+# Журнал неизменяемый: проводки можно только добавлять
+@event.listens_for(LedgerEntry, "before_update")
+def _forbid_ledger_update(mapper, connection, target):
+    raise RuntimeError("Ledger entries are immutable")
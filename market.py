@@ -0,0 +1,342 @@
+import asyncio
+import base64
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, insert, update, delete, and_, or_
+
+import events
+import ledger
+import search
+from database import AsyncSessionLocal
+from models import User, AvitoListing, AvitoArchive
+
+logger = logging.getLogger(__name__)
+
+# Размер страницы ленты Авито по умолчанию и максимум, который можно запросить
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+class InvalidCursor(ValueError):
+    """Курсор пагинации не удалось разобрать"""
+
+
+class ListingUnavailable(Exception):
+    """Объявление нельзя купить или забронировать (текст - для игрока)"""
+
+
+# ---------- КУРСОРЫ ----------
+def encode_cursor(created_at: datetime, listing_id: int) -> str:
+    """Непрозрачный курсор из ключа сортировки (created_at, id)"""
+    raw = json.dumps([created_at.isoformat(), listing_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, listing_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(listing_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor(str(e)) from e
+
+
+# ---------- ЛЕНТА ОБЪЯВЛЕНИЙ ----------
+def serialize_listing(listing: AvitoListing, seller: User) -> dict:
+    return {
+        "id": listing.id,
+        "seller_username": seller.username,
+        "seller_tg_id": seller.tg_id,
+        "item_type": listing.item_type,
+        "item_data": listing.item_data,
+        "price": listing.price,
+        "description": listing.description,
+        "created_at": listing.created_at.isoformat() if listing.created_at else None,
+        "reserved": bool(listing.reserved_until and listing.reserved_until > datetime.utcnow())
+    }
+
+
+async def fetch_listings_page(
+    session,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    item_type: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    conditions=(),
+):
+    """Одна страница непроданных объявлений вместе с продавцами.
+
+    Объявления и продавцы достаются одним JOIN-запросом, страницы идут
+    от новых к старым по ключу (created_at, id), поэтому стоимость страницы
+    не зависит от того, насколько глубоко пролистан рынок.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+
+    query = (
+        select(AvitoListing, User)
+        .join(User, User.id == AvitoListing.seller_id)
+        .where(AvitoListing.is_sold == False, *conditions)
+    )
+
+    if item_type:
+        query = query.where(AvitoListing.item_type == item_type)
+    if min_price is not None:
+        query = query.where(AvitoListing.price >= min_price)
+    if max_price is not None:
+        query = query.where(AvitoListing.price <= max_price)
+
+    if cursor:
+        created_at, listing_id = decode_cursor(cursor)
+        query = query.where(or_(
+            AvitoListing.created_at < created_at,
+            and_(AvitoListing.created_at == created_at, AvitoListing.id < listing_id)
+        ))
+
+    # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+    query = query.order_by(AvitoListing.created_at.desc(), AvitoListing.id.desc()).limit(limit + 1)
+
+    rows = (await session.execute(query)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    next_cursor = None
+    if has_more:
+        last = rows[-1][0]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return {
+        "items": [serialize_listing(listing, seller) for listing, seller in rows],
+        "next_cursor": next_cursor
+    }
+
+
+async def search_listings(
+    session,
+    query: Optional[str] = None,
+    item_type: Optional[str] = None,
+    price_bucket: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+):
+    """Поиск по рынку: страница ленты по запросу и фильтрам плюс фасеты.
+
+    Фасеты считаются только для первой страницы - при подгрузке они не меняются.
+    Неверная ценовая корзина - ValueError.
+    """
+    conditions, filters = [], {}
+    terms = search.search_terms(query)
+    if terms:
+        conditions.append(search.match_condition(session.get_bind().dialect.name, terms))
+    if item_type:
+        filters["item_type"] = AvitoListing.item_type == item_type
+    if price_bucket:
+        filters["price"] = search.price_condition(price_bucket)
+
+    page = await fetch_listings_page(
+        session, cursor=cursor, limit=limit, conditions=[*conditions, *filters.values()]
+    )
+    if cursor is None:
+        page["facets"] = await search.facet_counts(session, conditions, filters)
+    return page
+
+
+# ---------- ДВИЖОК РЫНКА ----------
+# Колонки объявления, которые переезжают в архив
+_ARCHIVED_COLUMNS = (
+    AvitoListing.id, AvitoListing.seller_id, AvitoListing.item_type, AvitoListing.item_data,
+    AvitoListing.price, AvitoListing.description, AvitoListing.created_at
+)
+
+
+def _available_to(buyer_id: int, now: datetime):
+    """Условие: объявление не продано, не свое и не забронировано другим"""
+    return and_(
+        AvitoListing.is_sold == False,
+        AvitoListing.seller_id != buyer_id,
+        or_(
+            AvitoListing.reserved_by.is_(None),
+            AvitoListing.reserved_by == buyer_id,
+            AvitoListing.reserved_until < now
+        )
+    )
+
+
+async def _why_unavailable(session, listing_id: int, buyer_id: int):
+    """Объясняет, почему не сработал compare-and-set. Только на пути ошибки"""
+    listing = (await session.execute(
+        select(AvitoListing.seller_id, AvitoListing.is_sold).where(AvitoListing.id == listing_id)
+    )).first()
+    if listing is None or listing.is_sold:
+        return ListingUnavailable("Товар уже продан")
+    if listing.seller_id == buyer_id:
+        return ListingUnavailable("Нельзя купить свой товар")
+    return ListingUnavailable("Товар забронирован другим покупателем")
+
+
+async def _archive(session, rows, status: str, buyer_id: Optional[int], closed_at: datetime):
+    """Переносит закрытые объявления в архив, удаляет из горячей таблицы и из фасетов"""
+    if not rows:
+        return
+    await search.delisted(session, rows)
+    await session.execute(insert(AvitoArchive), [
+        {
+            "listing_id": row.id,
+            "seller_id": row.seller_id,
+            "buyer_id": buyer_id,
+            "item_type": row.item_type,
+            "item_data": row.item_data,
+            "price": row.price,
+            "description": row.description,
+            "status": status,
+            "created_at": row.created_at,
+            "closed_at": closed_at,
+        }
+        for row in rows
+    ])
+    await session.execute(
+        delete(AvitoListing)
+        .where(AvitoListing.id.in_([row.id for row in rows]))
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def create_listing(session, seller_id: int, item_type: str, item_data, price: float, description: str = ""):
+    listing = AvitoListing(
+        seller_id=seller_id,
+        item_type=item_type,
+        item_data=item_data,
+        price=price,
+        description=description
+    )
+    session.add(listing)
+    await session.flush()
+    await search.listed(session, [listing])
+    return listing
+
+
+async def reserve(session, listing_id: int, buyer_id: int, seconds: float) -> datetime:
+    """Бронирует объявление за покупателем на seconds секунд. Повторная бронь продлевает"""
+    now = datetime.utcnow()
+    until = now + timedelta(seconds=seconds)
+    reserved = (await session.execute(
+        update(AvitoListing)
+        .where(AvitoListing.id == listing_id, _available_to(buyer_id, now))
+        .values(reserved_by=buyer_id, reserved_until=until)
+        .returning(AvitoListing.id)
+        .execution_options(synchronize_session=False)
+    )).first()
+    if reserved is None:
+        raise await _why_unavailable(session, listing_id, buyer_id)
+    return until
+
+
+async def release(session, listing_id: int, buyer_id: int) -> bool:
+    """Снимает бронь покупателя (передумал покупать). False - его брони уже нет"""
+    released = (await session.execute(
+        update(AvitoListing)
+        .where(
+            AvitoListing.id == listing_id,
+            AvitoListing.is_sold == False,
+            AvitoListing.reserved_by == buyer_id
+        )
+        .values(reserved_by=None, reserved_until=None)
+        .returning(AvitoListing.id)
+        .execution_options(synchronize_session=False)
+    )).first()
+    return released is not None
+
+
+async def purchase(session, listing_id: int, buyer_id: int):
+    """Покупка объявления без блокировок на чтение.
+
+    Один условный UPDATE ... WHERE is_sold = false (compare-and-set)
+    забирает объявление: из двух одновременных покупателей строку получит
+    только один, второй увидит 0 строк. Дальше в той же транзакции деньги
+    переводятся продавцу, а объявление уходит в архив. Если денег не
+    хватило (ledger.InsufficientFunds), откат транзакции возвращает
+    объявление на рынок. Коммит - на вызывающем.
+
+    Возвращает строку объявления (id, seller_id, item_type, item_data, price, ...).
+    """
+    now = datetime.utcnow()
+    listing = (await session.execute(
+        update(AvitoListing)
+        .where(AvitoListing.id == listing_id, _available_to(buyer_id, now))
+        .values(is_sold=True)
+        .returning(*_ARCHIVED_COLUMNS)
+        .execution_options(synchronize_session=False)
+    )).first()
+    if listing is None:
+        raise await _why_unavailable(session, listing_id, buyer_id)
+
+    await ledger.transfer(session, buyer_id, listing.seller_id, cash=listing.price,
+                          reason="avito_purchase", ref=f"listing:{listing.id}")
+    await _archive(session, [listing], "sold", buyer_id, now)
+    return listing
+
+
+async def expire_stale_listings(session, max_age: timedelta, batch: int) -> int:
+    """Снимает с рынка объявления старше max_age (кроме забронированных), пачками.
+
+    Каждая пачка - отдельная короткая транзакция, чтобы не держать
+    блокировку записи на все время чистки. Возвращает число снятых.
+    """
+    expired = 0
+    while True:
+        now = datetime.utcnow()
+        stale_ids = select(AvitoListing.id).where(
+            AvitoListing.is_sold == False,
+            AvitoListing.created_at < now - max_age,
+            or_(AvitoListing.reserved_until.is_(None), AvitoListing.reserved_until < now)
+        ).limit(batch)
+        # Тот же compare-and-set, что и у покупки: покупатель и чистка не снимут одно объявление дважды
+        rows = (await session.execute(
+            update(AvitoListing)
+            .where(AvitoListing.id.in_(stale_ids.scalar_subquery()), AvitoListing.is_sold == False)
+            .values(is_sold=True)
+            .returning(*_ARCHIVED_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )).all()
+        await _archive(session, rows, "expired", None, now)
+        await session.commit()
+        announce_closed([row.id for row in rows], "expired")
+
+        expired += len(rows)
+        if len(rows) < batch:
+            return expired
+
+
+async def run_expirer(interval: float, max_age: timedelta, batch: int):
+    """Фоновая задача: снятие просроченных объявлений каждые interval секунд"""
+    while True:
+        try:
+            async with AsyncSessionLocal() as session:
+                expired = await expire_stale_listings(session, max_age, batch)
+            if expired:
+                logger.info("Expired %s stale listings", expired)
+        except Exception:
+            logger.exception("Listing expiry failed")
+        await asyncio.sleep(interval)
+
+
+# ---------- СОБЫТИЯ РЫНКА ----------
+# Вызываются после коммита: открытые ленты обновляются без перезапроса
+def announce_listed(listing: AvitoListing, seller: User):
+    events.bus.publish(events.MARKET, "listing_created", serialize_listing(listing, seller))
+
+
+def announce_closed(listing_ids, status: str):
+    if listing_ids:
+        events.bus.publish(events.MARKET, "listing_closed", {"ids": list(listing_ids), "status": status})
+
+
+def announce_reserved(listing_id: int, reserved_until: datetime):
+    events.bus.publish(events.MARKET, "listing_reserved", {"id": listing_id, "reserved_until": reserved_until})
+
+
+def announce_released(listing_id: int):
+    events.bus.publish(events.MARKET, "listing_released", {"id": listing_id})
@@ -0,0 +1,246 @@
+import asyncio
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+
+# Границы корзин гистограмм задержек (сек)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Границы корзин для числа запросов к БД на один запрос/апдейт
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+# ---------- МЕТРИКИ ----------
+class Metric:
+    """Метрика в текстовом формате Prometheus.
+
+    collect - функция, которая отдает значение в момент запроса /metrics:
+    число или словарь {кортеж меток: число}. Так в метрики попадают счетчики,
+    которые и так ведут очереди и кэши, без лишней работы на горячем пути.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels=(), collect=None):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.values = {}
+
+    def _label_str(self, values, extra=None) -> str:
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in pairs)
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def _samples(self):
+        values = self.values
+        if self.collect is not None:
+            collected = self.collect()
+            values = collected if isinstance(collected, dict) else {(): collected}
+        for labels, value in values.items():
+            yield f"{self.name}{self._label_str(labels)} {value}"
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self._samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # Счетчики корзин (последняя - +Inf), сумма, количество
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def _samples(self):
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{self._label_str(labels, ('le', bound))} {cumulative}"
+            yield f"{self.name}_sum{self._label_str(labels)} {total}"
+            yield f"{self.name}_count{self._label_str(labels)} {count}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, labels=(), collect=None) -> Counter:
+    return registry.register(Counter(name, help, labels, collect))
+
+
+def gauge(name: str, help: str, labels=(), collect=None) -> Gauge:
+    return registry.register(Gauge(name, help, labels, collect))
+
+
+def histogram(name: str, help: str, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+# ---------- ЗАПРОСЫ К БД ----------
+db_query_seconds = histogram("db_query_duration_seconds", "SQL statement duration")
+db_queries_per_request = histogram(
+    "db_queries_per_request", "SQL statements per HTTP request or bot update",
+    labels=("kind",), buckets=QUERY_COUNT_BUCKETS
+)
+
+# [число запросов, суммарное время] текущего HTTP-запроса или апдейта
+_query_stats: ContextVar = ContextVar("query_stats", default=None)
+
+
+def track_queries(async_engine):
+    """Время каждого SQL-запроса и счетчик запросов текущего HTTP-запроса/апдейта"""
+    sync_engine = async_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _started(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _finished(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+        db_query_seconds.observe(elapsed)
+        stats = _query_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+
+def start_query_scope():
+    """Начать подсчет запросов к БД для текущей задачи. Возвращает счетчик"""
+    stats = [0, 0.0]
+    _query_stats.set(stats)
+    return stats
+
+
+# ---------- FASTAPI ----------
+http_request_seconds = histogram(
+    "http_request_duration_seconds", "HTTP request latency", labels=("method", "route", "status")
+)
+http_request_db_seconds = histogram(
+    "http_request_db_seconds", "Time spent in SQL per HTTP request", labels=("route",)
+)
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка и число SQL-запросов на каждый маршрут.
+
+    Маршрут берется шаблоном (/api/user/{tg_id}), а не реальным путем,
+    чтобы число серий не росло с числом игроков.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        stats = start_query_scope()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = route.path if route is not None else "<unmatched>"
+            http_request_seconds.observe(time.perf_counter() - started, scope["method"], path, status[0])
+            db_queries_per_request.observe(stats[0], "http")
+            http_request_db_seconds.observe(stats[1], path)
+
+
+# ---------- AIOGRAM ----------
+handler_seconds = histogram(
+    "bot_handler_duration_seconds", "aiogram handler latency", labels=("handler", "status")
+)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Задержка каждого хендлера бота. Регистрировать как внутреннюю middleware"""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "<unknown>"
+
+        stats = start_query_scope()
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            handler_seconds.observe(time.perf_counter() - started, name, status)
+            db_queries_per_request.observe(stats[0], "bot")
+
+
+# ---------- ЗАДЕРЖКА EVENT LOOP ----------
+loop_lag_seconds = histogram("event_loop_lag_seconds", "How late a periodic timer fires")
+
+
+async def watch_loop_lag(interval: float = 0.5):
+    """Фоновая задача: насколько позже заказанного просыпается sleep()"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        loop_lag_seconds.observe(max(0.0, loop.time() - expected))
@@ -0,0 +1,239 @@
+import logging
+from datetime import datetime
+
+from sqlalchemy import text, select, inspect
+
+logger = logging.getLogger(__name__)
+
+# Зарегистрированные миграции: (версия, описание, функция)
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    """Регистрирует миграцию схемы.
+
+    Функция получает синхронное соединение внутри общей транзакции.
+    Миграции должны быть идемпотентными: на свежей базе они выполняются
+    после create_all, когда таблицы уже в актуальном виде.
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version INTEGER PRIMARY KEY, "
+        "description VARCHAR, "
+        "applied_at TIMESTAMP)"
+    ))
+
+
+def run_migrations(conn):
+    """Применяет все ещё не применённые миграции по порядку версий"""
+    _ensure_version_table(conn)
+    applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied:
+            continue
+
+        logger.info("Applying migration %s: %s", version, description)
+        func(conn)
+        conn.execute(
+            text("INSERT INTO schema_migrations (version, description, applied_at) VALUES (:v, :d, :t)"),
+            {"v": version, "d": description, "t": datetime.utcnow()}
+        )
+
+
+def _columns(conn, table: str):
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+# ---------- МИГРАЦИИ ----------
+@migration(1, "indexes for hot lookup columns")
+def add_lookup_indexes(conn):
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_cars_owner_id ON cars (owner_id)",
+        "CREATE INDEX IF NOT EXISTS ix_avito_listings_is_sold_created_at ON avito_listings (is_sold, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_avito_listings_seller_id ON avito_listings (seller_id)",
+        "CREATE INDEX IF NOT EXISTS ix_race_history_player1_id ON race_history (player1_id)",
+        "CREATE INDEX IF NOT EXISTS ix_race_history_player2_id ON race_history (player2_id)",
+        "CREATE INDEX IF NOT EXISTS ix_fight_history_attacker_id ON fight_history (attacker_id)",
+        "CREATE INDEX IF NOT EXISTS ix_fight_history_defender_id ON fight_history (defender_id)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+@migration(2, "integer minor-unit balances")
+def balances_to_minor_units(conn):
+    # Float-балансы переезжают в новые целочисленные колонки (в центах),
+    # старые колонки удаляются. На свежей базе старых колонок уже нет.
+    renames = [
+        ("balance_cash", "balance_cash_minor"),
+        ("balance_token", "balance_token_minor"),
+        ("total_earned_tokens", "total_earned_tokens_minor"),
+    ]
+    columns = _columns(conn, "users")
+    for old, new in renames:
+        if old not in columns:
+            continue
+        if new not in columns:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {new} BIGINT DEFAULT 0"))
+        conn.execute(text(f"UPDATE users SET {new} = CAST(ROUND(COALESCE({old}, 0) * 100) AS BIGINT)"))
+        conn.execute(text(f"ALTER TABLE users DROP COLUMN {old}"))
+
+
+@migration(3, "persisted car performance")
+def persist_car_performance(conn):
+    from types import SimpleNamespace
+    from models import Car
+
+    if "power" not in _columns(conn, "cars"):
+        conn.execute(text("ALTER TABLE cars ADD COLUMN power FLOAT DEFAULT 100.0"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_cars_power ON cars (power)"))
+
+    # Старые top_speed/acceleration/handling никогда не обновлялись - пересчитываем все.
+    # Только нужные колонки, без ORM: модель могла уйти вперед от этой версии схемы
+    rows = conn.execute(text(
+        "SELECT id, engine_power_multiplier, turbo_level, suspension_level, handling_bonus, "
+        "valves_tuned, valves_tune_quality, engine_tuned, engine_tune_power FROM cars"
+    )).mappings().all()
+
+    updates = []
+    for row in rows:
+        perf = Car.calculate_performance(SimpleNamespace(**row))
+        updates.append({"car_id": row["id"], **perf})
+
+    if updates:
+        conn.execute(text(
+            "UPDATE cars SET power = :power, turbo_boost = :turbo_boost, handling = :handling, "
+            "acceleration = :acceleration, top_speed = :top_speed WHERE id = :car_id"
+        ), updates)
+
+
+@migration(4, "normalized inventory items")
+def inventory_to_table(conn):
+    import json
+
+    # Таблицу уже создал create_all. Переносим JSON из users.inventory и удаляем колонку
+    if "inventory" not in _columns(conn, "users"):
+        return
+
+    # Ключи JSON во множественном числе -> item_type как в объявлениях.
+    # buy_listing складывал покупки под item_type объявления - такие ключи как есть
+    item_types = {
+        "engines": "engine",
+        "turbos": "turbo",
+        "suspensions": "suspension",
+        "subwoofers": "subwoofer",
+        "body_kits": "body_kit",
+    }
+
+    rows = []
+    now = datetime.utcnow()
+    for user_id, raw in conn.execute(text("SELECT id, inventory FROM users WHERE inventory IS NOT NULL")):
+        inventory = json.loads(raw) if isinstance(raw, str) else raw
+        if not isinstance(inventory, dict):
+            continue
+        for key, items in inventory.items():
+            for item in items or []:
+                if isinstance(item, dict):
+                    data, level = item, item.get("level")
+                else:
+                    # Старый формат: [id запчасти, уровень]
+                    data = {"value": item}
+                    level = item[1] if isinstance(item, list) and len(item) > 1 and isinstance(item[1], int) else None
+                rows.append({
+                    "user_id": user_id,
+                    "item_type": item_types.get(key, key),
+                    "level": level,
+                    "data": json.dumps(data, ensure_ascii=False),
+                    "created_at": now,
+                })
+
+    if rows:
+        conn.execute(text(
+            "INSERT INTO inventory_items (user_id, item_type, level, data, source, created_at) "
+            "VALUES (:user_id, :item_type, :level, :data, 'migration', :created_at)"
+        ), rows)
+    conn.execute(text("ALTER TABLE users DROP COLUMN inventory"))
+
+
+@migration(5, "avito reservations and sold-listing archive")
+def avito_archive(conn):
+    # Архив уже создал create_all. Добавляем колонки брони и уносим проданное из горячей таблицы.
+    # AUTOINCREMENT у старой таблицы не появится: id может переиспользоваться,
+    # только если удалена самая новая строка - архив хранит listing_id как есть
+    columns = _columns(conn, "avito_listings")
+    if "reserved_by" not in columns:
+        conn.execute(text("ALTER TABLE avito_listings ADD COLUMN reserved_by INTEGER REFERENCES users (id)"))
+    if "reserved_until" not in columns:
+        conn.execute(text("ALTER TABLE avito_listings ADD COLUMN reserved_until TIMESTAMP"))
+
+    conn.execute(text(
+        "INSERT INTO avito_listings_archive "
+        "(listing_id, seller_id, buyer_id, item_type, item_data, price, description, status, created_at, closed_at) "
+        "SELECT id, seller_id, NULL, item_type, item_data, price, description, 'sold', created_at, :now "
+        "FROM avito_listings WHERE is_sold = :sold"
+    ), {"now": datetime.utcnow(), "sold": True})
+    conn.execute(text("DELETE FROM avito_listings WHERE is_sold = :sold"), {"sold": True})
+
+
+@migration(6, "avito full-text index and search facets")
+def avito_search(conn):
+    import search
+
+    # Таблицу счетчиков создал create_all, заполняем по текущему рынку.
+    # FTS5 есть только в SQLite - на других базах поиск идет через LIKE
+    if conn.dialect.name == "sqlite":
+        search.create_fts_index(conn)
+    search.rebuild_facets(conn)
+
+
+# ---------- ПРОВЕРКА ПЛАНОВ ЗАПРОСОВ ----------
+def hot_queries():
+    """Запросы, которые выполняются на каждое действие игрока"""
+    from models import User, Car, AvitoListing, AvitoArchive, RaceHistory, FightHistory, InventoryItem
+
+    return {
+        "user by tg_id": select(User).where(User.tg_id == 1),
+        "car by owner": select(Car).where(Car.owner_id == 1),
+        "listings feed": (
+            select(AvitoListing, User)
+            .join(User, User.id == AvitoListing.seller_id)
+            .where(AvitoListing.is_sold == False)
+            .order_by(AvitoListing.created_at.desc(), AvitoListing.id.desc())
+            .limit(20)
+        ),
+        "listings by seller": select(AvitoListing).where(AvitoListing.seller_id == 1),
+        "sales by seller": select(AvitoArchive).where(AvitoArchive.seller_id == 1),
+        "races by player": select(RaceHistory).where(RaceHistory.player1_id == 1),
+        "fights by attacker": select(FightHistory).where(FightHistory.attacker_id == 1),
+        "inventory by type": select(InventoryItem).where(
+            InventoryItem.user_id == 1, InventoryItem.item_type == "turbo"
+        ),
+    }
+
+
+def check_query_plans(conn):
+    """Ищет горячие запросы, которые читают таблицу целиком.
+
+    Работает только для SQLite (EXPLAIN QUERY PLAN). Возвращает список
+    (имя запроса, строка плана) для запросов без индекса.
+    """
+    if conn.dialect.name != "sqlite":
+        return []
+
+    problems = []
+    for name, query in hot_queries().items():
+        compiled = query.compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        for row in conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")):
+            detail = row[-1]
+            if detail.startswith("SCAN") and "INDEX" not in detail:
+                problems.append((name, detail))
+                logger.warning("Unindexed query %r: %s", name, detail)
+    return problems
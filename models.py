@@ -1,8 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, BigInteger, JSON, ForeignKey, DateTime
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, Float, Boolean, BigInteger, JSON, ForeignKey, DateTime, Index
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import relationship, Session
 from database import Base
 from datetime import datetime
 
+# Сколько минимальных единиц (центов) в одной единице валюты
+MINOR_UNITS = 100
+
 class User(Base):
     __tablename__ = 'users'
     
@@ -11,10 +15,11 @@ class User(Base):
     username = Column(String)
     first_name = Column(String)
     
-    # Экономика
-    balance_cash = Column(Float, default=5000.0)  # Наличка (игровая валюта)
-    balance_token = Column(Float, default=0.0)    # Токены GUNTER (для аирдропа)
-    total_earned_tokens = Column(Float, default=0.0)  # Всего заработано
+    # Экономика. Балансы хранятся в копейках/центах (целые, 1/100 единицы)
+    # и меняются только через ledger.py атомарными UPDATE
+    balance_cash_minor = Column(BigInteger, default=500000)  # Наличка (игровая валюта)
+    balance_token_minor = Column(BigInteger, default=0)      # Токены GUNTER (для аирдропа)
+    total_earned_tokens_minor = Column(BigInteger, default=0)  # Всего заработано
     
     # Гараж
     garage_level = Column(Integer, default=1)
@@ -27,26 +32,63 @@ class User(Base):
     fights_lost = Column(Integer, default=0)
     reputation = Column(Integer, default=0)  # Репутация среди пацанов
     
-    # Доступные запчасти в инвентаре (храним JSON)
-    inventory = Column(JSON, default={
-        'engines': [],  # [id двигателя, уровень]
-        'turbos': [],
-        'suspensions': [],
-        'subwoofers': [],
-        'body_kits': []
-    })
+    # Запчасти в инвентаре - отдельная таблица inventory_items (см. InventoryItem)
     
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Связи
     cars = relationship("Car", back_populates="owner")
-    listings = relationship("AvitoListing", back_populates="seller")
+    listings = relationship("AvitoListing", back_populates="seller", foreign_keys="AvitoListing.seller_id")
+    
+    # Балансы в основных единицах для отображения (только чтение)
+    @property
+    def balance_cash(self):
+        return (self.balance_cash_minor or 0) / MINOR_UNITS
+    
+    @property
+    def balance_token(self):
+        return (self.balance_token_minor or 0) / MINOR_UNITS
+    
+    @property
+    def total_earned_tokens(self):
+        return (self.total_earned_tokens_minor or 0) / MINOR_UNITS
+
+# ---------- УРОВНИ ЗАПЧАСТЕЙ ----------
+# Турбина: цена установки и прибавка к базовой мощности
+TURBO_TIERS = {
+    0: {"price": 0, "boost": 0.0},
+    1: {"price": 2000, "boost": 0.15},
+    2: {"price": 5000, "boost": 0.30},
+    3: {"price": 10000, "boost": 0.50},
+}
+
+# Подвеска: цена, прибавка к управляемости и множитель управляемости
+SUSPENSION_TIERS = {
+    0: {"price": 0, "handling": 0.0, "handling_bonus": 1.0},
+    1: {"price": 1500, "handling": 1.5, "handling_bonus": 1.2},
+    2: {"price": 3500, "handling": 3.0, "handling_bonus": 1.4},
+    3: {"price": 7000, "handling": 5.0, "handling_bonus": 1.7},
+}
+
+# Сабвуфер: цена установки и мощность (Вт). На характеристики машины не влияет
+SUBWOOFER_TIERS = {
+    0: {"price": 0, "power": 0},
+    1: {"price": 1000, "power": 500},
+    2: {"price": 3000, "power": 1000},
+    3: {"price": 6000, "power": 1500},
+}
+
+# Поля, от которых зависят расчетные характеристики машины
+PERFORMANCE_FIELDS = (
+    'engine_power_multiplier', 'turbo_level', 'suspension_level', 'handling_bonus',
+    'valves_tuned', 'valves_tune_quality', 'engine_tuned', 'engine_tune_power',
+)
 
 class Car(Base):
     __tablename__ = 'cars'
     
     id = Column(Integer, primary_key=True)
-    owner_id = Column(Integer, ForeignKey('users.id'))
+    owner_id = Column(Integer, ForeignKey('users.id'), index=True)
     name = Column(String, default="Тачка пацана")
     
     # ----- ОСНОВНЫЕ ХАРАКТЕРИСТИКИ (двигатель и тд) -----
@@ -90,7 +132,8 @@ class Car(Base):
     condition = Column(Float, default=100.0)  # 0-100%
     mileage = Column(Integer, default=0)  # Пробег
     
-    # Гоночные параметры (расчетные)
+    # Гоночные параметры (расчетные, пересчитываются при сохранении тюнинга)
+    power = Column(Float, default=100.0, index=True)
     top_speed = Column(Float, default=180.0)
     acceleration = Column(Float, default=8.5)  # 0-100 км/ч
     handling = Column(Float, default=5.0)
@@ -98,42 +141,32 @@ class Car(Base):
     owner = relationship("User", back_populates="cars")
 
     def calculate_performance(self):
-        """Пересчет характеристик машины на основе всех настроек"""
+        """Пересчет характеристик машины на основе всех настроек.
+        
+        У новой, еще не сохраненной машины часть полей None - для них
+        берутся значения по умолчанию из колонок.
+        """
         
         # БАЗОВАЯ МОЩНОСТЬ ОТ ДВИГАТЕЛЯ
-        base_power = 100 * self.engine_power_multiplier
+        base_power = 100 * (self.engine_power_multiplier or 1.0)
         
         # ТУРБИНА
-        turbo_power = 0
-        if self.turbo_level == 1:
-            turbo_power = base_power * 0.15  # +15%
-        elif self.turbo_level == 2:
-            turbo_power = base_power * 0.30  # +30%
-        elif self.turbo_level == 3:
-            turbo_power = base_power * 0.50  # +50%
-        self.turbo_boost = turbo_power
+        turbo_power = base_power * TURBO_TIERS.get(self.turbo_level or 0, TURBO_TIERS[0])["boost"]
         
         # НАСТРОЙКА КЛАПАНОВ (дает +10-30% мощности в зависимости от качества)
         valves_power = 0
         if self.valves_tuned:
-            valves_power = base_power * (0.1 + self.valves_tune_quality * 0.2)
+            valves_power = base_power * (0.1 + (self.valves_tune_quality or 0.0) * 0.2)
         
         # НАСТРОЙКА ДВИГАТЕЛЯ (индивидуальная калибровка)
-        tune_power = base_power * self.engine_tune_power if self.engine_tuned else 0
+        tune_power = base_power * (self.engine_tune_power or 0.0) if self.engine_tuned else 0
         
         # ИТОГОВАЯ МОЩНОСТЬ
         total_power = base_power + turbo_power + valves_power + tune_power
         
         # УПРАВЛЯЕМОСТЬ (зависит от подвески + настройки)
-        handling_base = 5.0
-        if self.suspension_level == 1:
-            handling_base += 1.5
-        elif self.suspension_level == 2:
-            handling_base += 3.0
-        elif self.suspension_level == 3:
-            handling_base += 5.0
-        
-        handling_base *= self.handling_bonus
+        handling_base = 5.0 + SUSPENSION_TIERS.get(self.suspension_level or 0, SUSPENSION_TIERS[0])["handling"]
+        handling_base *= self.handling_bonus or 1.0
         
         # РАЗГОН (зависит от мощности и веса)
         acceleration = 10.0 - (total_power / 200)
@@ -143,16 +176,57 @@ class Car(Base):
         
         return {
             'power': total_power,
+            'turbo_boost': turbo_power,
             'handling': handling_base,
             'acceleration': max(3.0, acceleration),
             'top_speed': top_speed
         }
+    
+    def recompute_performance(self):
+        """Сохраняет расчетные характеристики в колонки машины"""
+        perf = self.calculate_performance()
+        self.power = perf['power']
+        self.turbo_boost = perf['turbo_boost']
+        self.handling = perf['handling']
+        self.acceleration = perf['acceleration']
+        self.top_speed = perf['top_speed']
+    
+    @property
+    def performance(self):
+        """Сохраненные характеристики, без пересчета"""
+        return {
+            'power': self.power,
+            'handling': self.handling,
+            'acceleration': self.acceleration,
+            'top_speed': self.top_speed
+        }
+
+# Характеристики пересчитываются только при вставке машины или изменении
+# полей тюнинга - перед записью в базу, для всех сессий сразу
+@event.listens_for(Session, "before_flush")
+def _recompute_dirty_cars(session, flush_context, instances):
+    for obj in session.new:
+        if isinstance(obj, Car):
+            obj.recompute_performance()
+    
+    for obj in session.dirty:
+        if not isinstance(obj, Car):
+            continue
+        attrs = inspect(obj).attrs
+        if any(attrs[field].history.has_changes() for field in PERFORMANCE_FIELDS):
+            obj.recompute_performance()
 
 class AvitoListing(Base):
     __tablename__ = 'avito_listings'
+    __table_args__ = (
+        # Лента рынка: непроданные объявления от новых к старым
+        Index('ix_avito_listings_is_sold_created_at', 'is_sold', 'created_at'),
+        # Проданные строки удаляются - id не должны переиспользоваться (ссылки 'listing:42')
+        {'sqlite_autoincrement': True},
+    )
     
     id = Column(Integer, primary_key=True)
-    seller_id = Column(Integer, ForeignKey('users.id'))
+    seller_id = Column(Integer, ForeignKey('users.id'), index=True)
     
     # Тип товара: 'car', 'engine', 'turbo', 'suspension', 'subwoofer', 'body_kit'
     item_type = Column(String)
@@ -160,17 +234,48 @@ class AvitoListing(Base):
     price = Column(Float)
     description = Column(String)
     
+    # Флаг ставится атомарным UPDATE при покупке/снятии (см. market.py), в той же
+    # транзакции объявление переезжает в архив и удаляется из этой таблицы
     is_sold = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    seller = relationship("User", back_populates="listings")
+    # Бронь, пока покупатель подтверждает покупку
+    reserved_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    reserved_until = Column(DateTime, nullable=True)
+    
+    seller = relationship("User", back_populates="listings", foreign_keys=[seller_id])
+
+class AvitoArchive(Base):
+    """Закрытые объявления: проданные и снятые по сроку"""
+    __tablename__ = 'avito_listings_archive'
+    
+    id = Column(Integer, primary_key=True)
+    listing_id = Column(Integer, nullable=False, index=True)  # id из avito_listings
+    seller_id = Column(Integer, ForeignKey('users.id'), index=True)
+    buyer_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    item_type = Column(String)
+    item_data = Column(JSON)
+    price = Column(Float)
+    description = Column(String)
+    status = Column(String, nullable=False)  # 'sold' или 'expired'
+    created_at = Column(DateTime)
+    closed_at = Column(DateTime, default=datetime.utcnow)
+
+class AvitoFacet(Base):
+    """Счетчики активных объявлений по фасетам поиска (item_type, ценовая корзина).
+    Меняются в транзакциях создания и закрытия объявлений (см. search.py)"""
+    __tablename__ = 'avito_facets'
+    
+    facet = Column(String, primary_key=True)  # 'item_type' или 'price'
+    value = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
 
 class RaceHistory(Base):
     __tablename__ = 'race_history'
     
     id = Column(Integer, primary_key=True)
-    player1_id = Column(Integer, ForeignKey('users.id'))
-    player2_id = Column(Integer, ForeignKey('users.id'), nullable=True)  # NULL = гонка с ботом
+    player1_id = Column(Integer, ForeignKey('users.id'), index=True)
+    player2_id = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)  # NULL = гонка с ботом
     winner_id = Column(Integer, ForeignKey('users.id'))
     bet_amount = Column(Float, default=0)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -179,8 +284,49 @@ class FightHistory(Base):
     __tablename__ = 'fight_history'
     
     id = Column(Integer, primary_key=True)
-    attacker_id = Column(Integer, ForeignKey('users.id'))
-    defender_id = Column(Integer, ForeignKey('users.id'))
+    attacker_id = Column(Integer, ForeignKey('users.id'), index=True)
+    defender_id = Column(Integer, ForeignKey('users.id'), index=True)
     winner_id = Column(Integer, ForeignKey('users.id'))
     location = Column(String)  # 'лес', 'гараж', 'вечеринка'
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class LedgerEntry(Base):
+    """Проводка по балансу игрока. Только добавляется, никогда не меняется"""
+    __tablename__ = 'ledger_entries'
+    __table_args__ = (
+        Index('ix_ledger_entries_user_id_id', 'user_id', 'id'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    currency = Column(String, nullable=False)  # 'cash' или 'token'
+    amount = Column(BigInteger, nullable=False)  # В центах, со знаком
+    balance_after = Column(BigInteger, nullable=False)
+    reason = Column(String, nullable=False)  # 'race_win', 'tune_valves', 'donate'...
+    ref = Column(String, nullable=True)  # Ссылка на объект: 'listing:42' и тп
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class FsmRecord(Base):
+    """Состояние диалога aiogram (FSM) для одного чата/пользователя"""
+    __tablename__ = 'fsm_states'
+    
+    key = Column(String, primary_key=True)  # Ключ StorageKey, см. fsm_storage.py
+    state = Column(String, nullable=True)
+    data = Column(JSON, default=dict)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class InventoryItem(Base):
+    """Запчасть в инвентаре игрока"""
+    __tablename__ = 'inventory_items'
+    __table_args__ = (
+        Index('ix_inventory_items_user_id_item_type', 'user_id', 'item_type'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    item_type = Column(String, nullable=False)  # 'engine', 'turbo', 'suspension', 'subwoofer', 'body_kit'
+    level = Column(Integer, nullable=True)
+    data = Column(JSON, default=dict)  # Остальные свойства запчасти как в объявлении
+    source = Column(String, nullable=True)  # Откуда взялась: 'listing:42', 'migration'
     created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
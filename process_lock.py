@@ -0,0 +1,50 @@
+import asyncio
+import fcntl
+import os
+from contextlib import asynccontextmanager
+
+from config import LOCK_DIR
+
+
+class FileLock:
+    """Межпроцессная блокировка на файле (flock) для воркеров на одной машине.
+
+    Блокировку держит открытый файл: если процесс упал, ОС снимает ее сама.
+    """
+
+    def __init__(self, name: str):
+        self.path = os.path.join(LOCK_DIR, f"gunter-{name}.lock")
+        self._fd = None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+
+@asynccontextmanager
+async def exclusive(name: str):
+    """Критическая секция для всех воркеров. Ждет в потоке, не блокируя event loop"""
+    lock = FileLock(name)
+    await asyncio.to_thread(lock.acquire)
+    try:
+        yield
+    finally:
+        lock.release()
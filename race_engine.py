@@ -0,0 +1,199 @@
+import numpy as np
+from sqlalchemy import select, insert, update, bindparam
+
+from models import User, Car, RaceHistory
+
+# ---------- КОНСТАНТЫ ГОНКИ ----------
+# Очки = мощность * 0.5 + управляемость * 0.3 + разгон * 20
+SCORE_WEIGHTS = np.array([0.5, 0.3, 20.0])
+
+# Удача: итоговые очки умножаются на случайное число из [0.9, 1.1]
+LUCK_SPREAD = 0.1
+
+# Бот-соперник: мощность растет с уровнем гаража игрока
+BOT_BASE_POWER = 120
+BOT_POWER_PER_GARAGE_LEVEL = 20
+BOT_HANDLING = 5
+BOT_ACCELERATION = 12
+
+# Маркер пустого места в сетке турнира
+BYE = -1
+
+# Драка: шанс победы - логистическая функция от разницы репутации,
+# +FIGHT_REPUTATION_SCALE репутации дают примерно 73% шанса
+FIGHT_REPUTATION_SCALE = 20
+FIGHT_LOCATIONS = ("лес", "гараж", "вечеринка")
+
+# Генератор для живых гонок; турниры получают свой, с сидом
+_rng = np.random.default_rng()
+
+
+def make_rng(seed=None):
+    return np.random.default_rng(seed)
+
+
+# ---------- ХАРАКТЕРИСТИКИ ----------
+def stats_from_performance(perfs) -> np.ndarray:
+    """Массив (n, 3): мощность, управляемость, разгон из Car.performance"""
+    return np.array(
+        [[perf['power'], perf['handling'], perf['acceleration']] for perf in perfs],
+        dtype=float
+    ).reshape(-1, 3)
+
+
+def bot_stats(garage_levels) -> np.ndarray:
+    levels = np.asarray(garage_levels, dtype=float)
+    stats = np.empty((levels.size, 3))
+    stats[:, 0] = BOT_BASE_POWER + levels * BOT_POWER_PER_GARAGE_LEVEL
+    stats[:, 1] = BOT_HANDLING
+    stats[:, 2] = BOT_ACCELERATION
+    return stats
+
+
+def roll_scores(stats: np.ndarray, rng) -> np.ndarray:
+    """Очки каждой машины с учетом удачи"""
+    luck = rng.uniform(1 - LUCK_SPREAD, 1 + LUCK_SPREAD, size=len(stats))
+    return (stats @ SCORE_WEIGHTS) * luck
+
+
+# ---------- ЗАЕЗДЫ ----------
+def race(stats_a: np.ndarray, stats_b: np.ndarray, rng=None) -> np.ndarray:
+    """Пачка заездов a[i] против b[i]. True - победил a[i]"""
+    rng = rng or _rng
+    return roll_scores(stats_a, rng) > roll_scores(stats_b, rng)
+
+
+def race_bots(stats: np.ndarray, garage_levels, rng=None) -> np.ndarray:
+    """Пачка заездов игроков против ботов их уровня"""
+    return race(stats, bot_stats(garage_levels), rng)
+
+
+# ---------- ДРАКИ ----------
+def fight_win_chance(reputation_a: int, reputation_b: int) -> float:
+    """Шанс, что a победит b. При равной репутации - 50%"""
+    return float(1 / (1 + np.exp(-((reputation_a or 0) - (reputation_b or 0)) / FIGHT_REPUTATION_SCALE)))
+
+
+def fight(reputation_a: int, reputation_b: int, rng=None) -> bool:
+    """Драка a против b. True - победил a"""
+    rng = rng or _rng
+    return bool(rng.random() < fight_win_chance(reputation_a, reputation_b))
+
+
+def run_tournament(player_ids, stats: np.ndarray, rng=None):
+    """Турнир на выбывание для всей сетки сразу.
+
+    Игроки рассаживаются случайно, сетка добивается пустыми местами до
+    степени двойки (пустое место - автоматический проход дальше). Каждый
+    раунд считается одним векторным заездом.
+
+    Возвращает (id победителя, список заездов (player1_id, player2_id, winner_id)).
+    """
+    rng = rng or _rng
+    ids = np.asarray(player_ids, dtype=np.int64)
+    if ids.size == 0:
+        return None, []
+
+    order = rng.permutation(ids.size)
+    size = 1 << int(np.ceil(np.log2(ids.size))) if ids.size > 1 else 1
+    bracket = np.full(size, BYE, dtype=np.int64)
+    bracket[:ids.size] = order
+    # Пустые места через одно, чтобы два пустых не встретились в первом раунде
+    bracket = bracket.reshape(2, -1).T.ravel() if size > 1 else bracket
+
+    races = []
+    while bracket.size > 1:
+        pairs = bracket.reshape(-1, 2)
+        left, right = pairs[:, 0], pairs[:, 1]
+        real = (left != BYE) & (right != BYE)
+
+        winners = np.where(left == BYE, right, left)
+        if real.any():
+            left_wins = race(stats[left[real]], stats[right[real]], rng)
+            winners[real] = np.where(left_wins, left[real], right[real])
+            for a, b, w in zip(ids[left[real]], ids[right[real]], ids[winners[real]]):
+                races.append((int(a), int(b), int(w)))
+
+        bracket = winners
+
+    return int(ids[bracket[0]]), races
+
+
+# ---------- ЗАПИСЬ РЕЗУЛЬТАТОВ ----------
+async def count_races(session, races):
+    """Прибавляет победы/поражения участникам заездов одним executemany.
+
+    races - последовательность (player1_id, player2_id, winner_id);
+    player2_id = None для гонки с ботом, winner_id = None если бот победил.
+    Возвращает id игроков, у которых поменялись счетчики.
+    """
+    won, lost = {}, {}
+    for p1, p2, winner in races:
+        for player in (p1, p2):
+            if player is None:
+                continue
+            target = won if player == winner else lost
+            target[player] = target.get(player, 0) + 1
+
+    players = set(won) | set(lost)
+    if not players:
+        return players
+
+    # Инкременты одним executemany по таблице (ORM bulk update умеет только
+    # присваивать значения по первичному ключу, а нам нужно прибавлять)
+    users = User.__table__
+    await session.execute(
+        update(users)
+        .where(users.c.id == bindparam("uid"))
+        .values(
+            races_won=users.c.races_won + bindparam("won"),
+            races_lost=users.c.races_lost + bindparam("lost")
+        ),
+        [{"uid": uid, "won": won.get(uid, 0), "lost": lost.get(uid, 0)} for uid in players]
+    )
+    return players
+
+
+async def record_races(session, races, bet_amount: float = 0):
+    """Пишет заезды в race_history и счетчики побед/поражений пачкой (турниры).
+
+    Одиночные гонки из API пишут историю через history.recorder, а здесь
+    только счетчики (count_races). Возвращает id игроков, у которых
+    поменялись счетчики.
+    """
+    if not races:
+        return set()
+
+    await session.execute(insert(RaceHistory), [
+        {"player1_id": p1, "player2_id": p2, "winner_id": winner, "bet_amount": bet_amount}
+        for p1, p2, winner in races
+    ])
+    return await count_races(session, races)
+
+
+async def run_scheduled_tournament(session, seed=None):
+    """Турнир среди всех игроков с машиной: сетка, заезды, запись истории.
+
+    Возвращает (winner_user_id, количество заездов, tg_id участников) -
+    по tg_id вызывающий сбрасывает кэш и оповещает игроков после коммита.
+    """
+    # Характеристики хранятся в колонках машины - читаем их прямо из SQL
+    rows = (await session.execute(
+        select(Car.owner_id, User.tg_id, Car.power, Car.handling, Car.acceleration)
+        .join(User, User.id == Car.owner_id)
+        .order_by(Car.owner_id, Car.id)
+    )).all()
+
+    # Одна (первая) машина на игрока
+    cars, tg_ids = {}, {}
+    for owner_id, tg_id, power, handling, acceleration in rows:
+        cars.setdefault(owner_id, (power, handling, acceleration))
+        tg_ids[owner_id] = tg_id
+
+    player_ids = list(cars)
+    stats = np.array(list(cars.values()), dtype=float).reshape(-1, 3)
+
+    winner, races = run_tournament(player_ids, stats, make_rng(seed))
+    players = await record_races(session, races)
+    await session.commit()
+    return winner, len(races), [tg_ids[player] for player in players]
@@ -0,0 +1,153 @@
+import math
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import TelegramObject
+
+from config import (
+    RATE_LIMIT_STORE_SIZE,
+    RATE_LIMIT_TUNE_SECONDS, RATE_LIMIT_TUNE_BURST,
+    RATE_LIMIT_RACE_SECONDS, RATE_LIMIT_RACE_BURST,
+    RATE_LIMIT_MARKET_SECONDS, RATE_LIMIT_MARKET_BURST,
+    RATE_LIMIT_DONATE_SECONDS, RATE_LIMIT_DONATE_BURST,
+    RATE_LIMIT_FIGHT_SECONDS, RATE_LIMIT_FIGHT_BURST
+)
+
+# Класс действия -> (секунд на один жетон, размер ведра).
+# Ведро из burst жетонов позволяет сделать несколько действий подряд,
+# дальше - не чаще одного раза в seconds секунд
+LIMITS = {
+    "tune": (RATE_LIMIT_TUNE_SECONDS, RATE_LIMIT_TUNE_BURST),
+    "race": (RATE_LIMIT_RACE_SECONDS, RATE_LIMIT_RACE_BURST),
+    "market": (RATE_LIMIT_MARKET_SECONDS, RATE_LIMIT_MARKET_BURST),
+    "donate": (RATE_LIMIT_DONATE_SECONDS, RATE_LIMIT_DONATE_BURST),
+    "fight": (RATE_LIMIT_FIGHT_SECONDS, RATE_LIMIT_FIGHT_BURST),
+}
+
+
+class RateLimited(Exception):
+    def __init__(self, action: str, retry_after: float):
+        super().__init__(f"Rate limit for {action!r}, retry after {retry_after:.1f}s")
+        self.action = action
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_seconds(self) -> int:
+        """Для заголовка Retry-After: целые секунды, не меньше одной"""
+        return max(1, math.ceil(self.retry_after))
+
+
+# ---------- ХРАНИЛИЩА ----------
+class BucketStore(ABC):
+    """Интерфейс хранилища ведер.
+
+    take() должен атомарно пополнить ведро по прошедшему времени и списать
+    жетон. Асинхронный, чтобы общий для всех воркеров бэкенд (Redis со
+    скриптом на Lua и т.п.) можно было подключить без изменения вызывающего кода.
+    """
+
+    @abstractmethod
+    async def take(self, key, seconds_per_token: float, burst: int) -> float:
+        """0 - жетон списан, иначе через сколько секунд появится следующий"""
+
+
+class MemoryBucketStore(BucketStore):
+    """Ведра в памяти процесса. Давно не трогавшие ведра вытесняются (LRU):
+    вытесненное ведро было бы уже полным, так что ничего не теряется"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()  # key -> (жетоны, время обновления)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    async def take(self, key, seconds_per_token: float, burst: int) -> float:
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (burst, now))
+        if seconds_per_token > 0:
+            tokens = min(burst, tokens + (now - updated_at) / seconds_per_token)
+        else:
+            tokens = burst
+
+        if tokens >= 1:
+            retry_after = 0.0
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) * seconds_per_token
+
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+
+# ---------- ОГРАНИЧИТЕЛЬ ----------
+class RateLimiter:
+    """Token bucket на пару (tg_id, класс действия) со счетчиками по действиям"""
+
+    def __init__(self, store: BucketStore, limits: dict):
+        self.store = store
+        self.limits = limits
+        self.allowed = {action: 0 for action in limits}
+        self.limited = {action: 0 for action in limits}
+
+    async def hit(self, tg_id: int, action: str):
+        """Списать жетон или бросить RateLimited"""
+        seconds, burst = self.limits[action]
+        retry_after = await self.store.take((tg_id, action), seconds, burst)
+        if retry_after > 0:
+            self.limited[action] += 1
+            raise RateLimited(action, retry_after)
+        self.allowed[action] += 1
+
+    def stats(self):
+        return {
+            action: {"allowed": self.allowed[action], "limited": self.limited[action]}
+            for action in self.limits
+        }
+
+
+limiter = RateLimiter(MemoryBucketStore(maxsize=RATE_LIMIT_STORE_SIZE), LIMITS)
+
+
+# ---------- FASTAPI ----------
+def rate_limited(action: str):
+    """Зависимость для эндпоинта с {tg_id} в пути: dependencies=[Depends(rate_limited("race"))]"""
+    async def dependency(tg_id: int):
+        await limiter.hit(tg_id, action)
+    return dependency
+
+
+# ---------- AIOGRAM ----------
+class RateLimitMiddleware(BaseMiddleware):
+    """Ограничивает хендлеры с флагом rate_limit: flags={"rate_limit": "donate"}.
+
+    Флаги хендлера видны только во внутренних middleware, поэтому
+    регистрировать через dp.callback_query.middleware(), а не outer_middleware.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        action = get_flag(data, "rate_limit")
+        user = getattr(event, "from_user", None)
+        if action is None or user is None:
+            return await handler(event, data)
+
+        try:
+            await limiter.hit(user.id, action)
+        except RateLimited as error:
+            # И у Message, и у CallbackQuery есть answer()
+            await event.answer(f"⏳ Слишком часто! Подожди {error.retry_after_seconds} сек.")
+            return None
+
+        return await handler(event, data)
@@ -0,0 +1,57 @@
+from sqlalchemy import select
+
+import events
+from cache import user_cache
+from database import mark_written, begin_write
+from models import User, Car
+
+
+# ---------- ЗАГРУЗКА ИГРОКА ----------
+def user_with_car_query(tg_id: int, for_update: bool = False):
+    """Игрок и его активная (первая) машина одним запросом.
+
+    for_update блокирует строку игрока до конца транзакции. Все изменения
+    машины идут через игрока, поэтому этой блокировки достаточно.
+    SQLite не поддерживает FOR UPDATE и просто опускает его - там
+    load_user_with_car(for_update=True) начинает транзакцию с блокировки
+    записи (database.begin_write).
+    """
+    query = (
+        select(User, Car)
+        .outerjoin(Car, Car.owner_id == User.id)
+        .where(User.tg_id == tg_id)
+        .order_by(Car.id)
+        .limit(1)
+    )
+    if for_update:
+        query = query.with_for_update(of=User)
+    return query
+
+
+async def load_user_with_car(session, tg_id: int, for_update: bool = False):
+    """Возвращает (user, car); (None, None) если игрока нет, car=None если нет машины"""
+    if for_update:
+        await begin_write(session)
+    row = (await session.execute(user_with_car_query(tg_id, for_update))).first()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+async def load_user(session, tg_id: int, for_update: bool = False):
+    query = select(User).where(User.tg_id == tg_id)
+    if for_update:
+        await begin_write(session)
+        query = query.with_for_update()
+    return (await session.execute(query)).scalar_one_or_none()
+
+
+# ---------- ПОСЛЕ ЗАПИСИ ----------
+async def user_changed(*tg_ids: int):
+    """Вызывается после коммита: сбрасывает кэш состояния игроков,
+    на короткое время направляет их чтения в основную базу и сообщает
+    открытым мини-приложениям, что состояние пора перечитать"""
+    for tg_id in tg_ids:
+        mark_written(tg_id)
+        await user_cache.invalidate(tg_id)
+        events.bus.publish(events.user_topic(tg_id), "user", {})
@@ -0,0 +1,198 @@
+import re
+from collections import Counter
+from typing import Optional
+
+from sqlalchemy import select, func, and_, or_, case, cast, String, text, table, column
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import AvitoListing, AvitoFacet
+
+# Границы ценовых корзин фасета price: <100, 100-500, ..., 10000+
+PRICE_BUCKETS = (100, 500, 1000, 5000, 10000)
+# Таблица полнотекстового индекса (только SQLite, создается миграцией)
+FTS_TABLE = "avito_listings_fts"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_fts = table(FTS_TABLE, column("rowid"))
+
+
+# ---------- ФАСЕТЫ ----------
+def price_bucket(price) -> str:
+    """Корзина цены: '<100', '100-500', ..., '10000+'"""
+    lower = None
+    for bound in PRICE_BUCKETS:
+        if price is not None and price < bound:
+            return f"<{bound}" if lower is None else f"{lower}-{bound}"
+        lower = bound
+    return f"{lower}+"
+
+
+def price_bucket_range(bucket: str):
+    """(min_price, max_price) корзины для фильтра ленты. Верхняя граница не включается"""
+    if bucket.startswith("<"):
+        return None, float(bucket[1:])
+    if bucket.endswith("+"):
+        return float(bucket[:-1]), None
+    low, high = bucket.split("-")
+    return float(low), float(high)
+
+
+def _facet_deltas(rows, sign: int) -> Counter:
+    deltas = Counter()
+    for row in rows:
+        deltas[("item_type", row.item_type or "")] += sign
+        deltas[("price", price_bucket(row.price))] += sign
+    return deltas
+
+
+def _upsert(dialect_name: str):
+    module = postgresql if dialect_name == "postgresql" else sqlite
+    stmt = module.insert(AvitoFacet)
+    return stmt.on_conflict_do_update(
+        index_elements=[AvitoFacet.facet, AvitoFacet.value],
+        set_={"count": AvitoFacet.count + stmt.excluded.count}
+    )
+
+
+async def _apply_deltas(session, deltas: Counter):
+    rows = [
+        {"facet": facet, "value": value, "count": delta}
+        for (facet, value), delta in deltas.items() if delta
+    ]
+    if rows:
+        await session.execute(_upsert(session.get_bind().dialect.name), rows)
+
+
+async def listed(session, rows):
+    """Счетчики фасетов для новых объявлений. В транзакции создания"""
+    await _apply_deltas(session, _facet_deltas(rows, +1))
+
+
+async def delisted(session, rows):
+    """Счетчики фасетов для проданных/снятых объявлений. В транзакции закрытия"""
+    await _apply_deltas(session, _facet_deltas(rows, -1))
+
+
+def rebuild_facets(conn):
+    """Пересчитывает счетчики фасетов с нуля (синхронное соединение: миграции, бенчмарк)"""
+    rows = conn.execute(
+        select(AvitoListing.item_type, AvitoListing.price).where(AvitoListing.is_sold == False)
+    ).all()
+    conn.execute(AvitoFacet.__table__.delete())
+    deltas = _facet_deltas(rows, +1)
+    if deltas:
+        conn.execute(AvitoFacet.__table__.insert(), [
+            {"facet": facet, "value": value, "count": count}
+            for (facet, value), count in deltas.items()
+        ])
+
+
+# ---------- ПОЛНОТЕКСТОВЫЙ ПОИСК ----------
+def create_fts_index(conn):
+    """FTS5-индекс по описанию, типу и item_data поверх avito_listings.
+
+    Индекс с внешним содержимым (content=avito_listings) хранит только
+    токены, а в актуальном состоянии его держат триггеры: любая вставка
+    и удаление объявления (в том числе переезд в архив) обновляют индекс
+    в той же транзакции.
+    """
+    statements = [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "description, item_type, item_data, content='avito_listings', content_rowid='id')",
+        f"CREATE TRIGGER IF NOT EXISTS avito_listings_fts_ai AFTER INSERT ON avito_listings BEGIN "
+        f"INSERT INTO {FTS_TABLE} (rowid, description, item_type, item_data) "
+        "VALUES (new.id, new.description, new.item_type, new.item_data); END",
+        f"CREATE TRIGGER IF NOT EXISTS avito_listings_fts_ad AFTER DELETE ON avito_listings BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, description, item_type, item_data) "
+        "VALUES ('delete', old.id, old.description, old.item_type, old.item_data); END",
+        # Только по индексируемым колонкам: бронь и is_sold индекс не трогают
+        f"CREATE TRIGGER IF NOT EXISTS avito_listings_fts_au "
+        "AFTER UPDATE OF description, item_type, item_data ON avito_listings BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, description, item_type, item_data) "
+        "VALUES ('delete', old.id, old.description, old.item_type, old.item_data); "
+        f"INSERT INTO {FTS_TABLE} (rowid, description, item_type, item_data) "
+        "VALUES (new.id, new.description, new.item_type, new.item_data); END",
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def search_terms(query: Optional[str]):
+    """Слова запроса без синтаксиса FTS (кавычки, NEAR, * и т.п. от игрока не пройдут)"""
+    return _WORD.findall(query or "")[:10]
+
+
+def match_condition(dialect_name: str, terms):
+    """Условие отбора объявлений по словам запроса.
+
+    SQLite - FTS5 по префиксам ("турб" найдет "турбина"), остальные базы -
+    LIKE по тем же полям: медленнее, но результат тот же.
+    """
+    if dialect_name == "sqlite":
+        expression = " ".join('"{}"*'.format(term) for term in terms)
+        matched = select(_fts.c.rowid).where(
+            text(f"{FTS_TABLE} MATCH :fts_query").bindparams(fts_query=expression)
+        )
+        return AvitoListing.id.in_(matched)
+
+    return and_(*(
+        or_(
+            AvitoListing.description.ilike(f"%{term}%"),
+            AvitoListing.item_type.ilike(f"%{term}%"),
+            cast(AvitoListing.item_data, String).ilike(f"%{term}%")
+        )
+        for term in terms
+    ))
+
+
+def price_condition(bucket: str):
+    """Условие цены для корзины фасета. Верхняя граница не включается - как в price_bucket()"""
+    low, high = price_bucket_range(bucket)
+    conditions = []
+    if low is not None:
+        conditions.append(AvitoListing.price >= low)
+    if high is not None:
+        conditions.append(AvitoListing.price < high)
+    return and_(*conditions)
+
+
+async def facet_counts(session, conditions, filters: dict) -> dict:
+    """Фасеты item_type и price.
+
+    conditions - общие условия (поисковый запрос), filters - условия по
+    фасетам {"item_type": ..., "price": ...}. Фасет считается без своего
+    собственного фильтра: при выбранном типе остальные типы показывают,
+    сколько найдется, если переключиться на них. Фасет без условий берется
+    из готовых счетчиков avito_facets, иначе - GROUP BY по объявлениям.
+    Объявление без типа везде считается под ключом "".
+    """
+    bucket = case(
+        *((AvitoListing.price < bound, price_bucket(bound - 1)) for bound in PRICE_BUCKETS),
+        else_=price_bucket(PRICE_BUCKETS[-1])
+    )
+    columns = {"item_type": func.coalesce(AvitoListing.item_type, ""), "price": bucket}
+
+    facets = {}
+    for facet, column in columns.items():
+        where = [*conditions, *(condition for name, condition in filters.items() if name != facet)]
+        if where:
+            counts = await session.execute(
+                select(column, func.count())
+                .where(AvitoListing.is_sold == False, *where)
+                .group_by(column)
+            )
+        else:
+            counts = await session.execute(
+                select(AvitoFacet.value, AvitoFacet.count)
+                .where(AvitoFacet.facet == facet, AvitoFacet.count > 0)
+            )
+        facets[facet] = dict(counts.all())
+
+    # Корзины цен - по порядку границ
+    labels = [price_bucket(bound - 1) for bound in PRICE_BUCKETS] + [price_bucket(PRICE_BUCKETS[-1])]
+    facets["price"] = [
+        {"bucket": label, "count": facets["price"][label]}
+        for label in labels if facets["price"].get(label)
+    ]
+    return facets
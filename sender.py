@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, SendDocument, EditMessageText, TelegramMethod
+from aiogram.types import Message
+from sqlalchemy import select
+
+from database import read_session_for
+from models import User
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: меньше - раньше
+HIGH = 0     # Ответы на действия игрока
+NORMAL = 1   # Уведомления
+LOW = 2      # Рассылки
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "method", "future", "attempts", "edit_key")
+
+    def __init__(self, priority, seq, chat_id, method, future, edit_key):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.future = future
+        self.attempts = 0
+        self.edit_key = edit_key
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SendScheduler:
+    """Очередь исходящих сообщений с учетом лимитов Telegram.
+
+    Общий темп - не больше global_rate запросов в секунду на бота, в один
+    чат - не чаще раза в chat_interval секунд. Внутри чата порядок
+    сохраняется: следующее сообщение уходит только после ответа на
+    предыдущее. Из готовых чатов первым обслуживается тот, у кого самое
+    приоритетное сообщение, поэтому ответы игрокам обгоняют рассылку.
+    На TelegramRetryAfter вся отправка замирает на указанное время, а
+    сообщение возвращается в очередь. Если правка того же сообщения еще
+    не ушла, новая правка просто заменяет ее (оба вызова получат один результат).
+    """
+
+    def __init__(self, bot, global_rate: float, chat_interval: float, max_in_flight: int, max_retries: int):
+        self.bot = bot
+        self._interval = 1 / global_rate
+        self._chat_interval = chat_interval
+        self._max_retries = max_retries
+        self._slots = asyncio.Semaphore(max_in_flight)
+        self._seq = itertools.count()
+
+        self._chats = {}      # chat_id -> куча _Job
+        self._ready = []      # куча (приоритет, seq, chat_id) - чаты, которым можно слать
+        self._waiting = []    # куча (когда можно, chat_id) - чаты на паузе
+        self._scheduled = set()  # чаты в _ready, в _waiting или с запросом в полете
+        self._edits = {}      # (chat_id, message_id) -> еще не отправленная правка
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        self._tasks = set()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+
+    # ---------- ПОСТАНОВКА В ОЧЕРЕДЬ ----------
+    def submit(self, method: TelegramMethod, priority: int = NORMAL) -> asyncio.Future:
+        """Поставить запрос в очередь. Результат - future с ответом Telegram"""
+        self.start()
+        chat_id = method.chat_id
+
+        edit_key = None
+        if isinstance(method, EditMessageText) and method.message_id is not None:
+            edit_key = (chat_id, method.message_id)
+            pending = self._edits.get(edit_key)
+            if pending is not None:
+                pending.method = method
+                self.coalesced += 1
+                return pending.future
+
+        job = _Job(priority, next(self._seq), chat_id, method, asyncio.get_running_loop().create_future(), edit_key)
+        if edit_key is not None:
+            self._edits[edit_key] = job
+        self._push(job)
+        return job.future
+
+    def _push(self, job: _Job):
+        heapq.heappush(self._chats.setdefault(job.chat_id, []), job)
+        if job.chat_id not in self._scheduled:
+            self._scheduled.add(job.chat_id)
+            self._make_ready(job.chat_id)
+
+    def _make_ready(self, chat_id):
+        jobs = self._chats.get(chat_id)
+        if not jobs:
+            self._chats.pop(chat_id, None)
+            self._scheduled.discard(chat_id)
+            return
+        heapq.heappush(self._ready, (jobs[0].priority, jobs[0].seq, chat_id))
+        self._wakeup.set()
+
+    async def answer(self, message: Message, text: str, priority: int = HIGH, **kwargs):
+        """Аналог message.answer() через очередь"""
+        return await self.submit(SendMessage(chat_id=message.chat.id, text=text, **kwargs), priority)
+
+    async def edit(self, message: Message, text: str, priority: int = HIGH, **kwargs):
+        """Аналог message.edit_text() через очередь"""
+        return await self.submit(EditMessageText(
+            chat_id=message.chat.id, message_id=message.message_id, text=text, **kwargs
+        ), priority)
+
+    async def answer_document(self, message: Message, document, priority: int = HIGH, **kwargs):
+        """Аналог message.answer_document() через очередь"""
+        return await self.submit(SendDocument(chat_id=message.chat.id, document=document, **kwargs), priority)
+
+    # ---------- ОТПРАВКА ----------
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, chat_id = heapq.heappop(self._waiting)
+                self._make_ready(chat_id)
+
+            if not self._ready:
+                timeout = self._waiting[0][0] - now if self._waiting else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Ждем общий слот, потом заново выбираем чат: за это время мог прийти более важный
+            start_at = max(self._next_slot, self._paused_until)
+            if start_at > now:
+                await asyncio.sleep(start_at - now)
+                continue
+
+            await self._slots.acquire()
+            _, _, chat_id = heapq.heappop(self._ready)
+            job = heapq.heappop(self._chats[chat_id])
+            if job.edit_key is not None:
+                self._edits.pop(job.edit_key, None)
+
+            self._next_slot = max(now, self._next_slot) + self._interval
+            task = asyncio.create_task(self._deliver(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, job: _Job):
+        started = time.monotonic()
+        try:
+            result = await self.bot(job.method)
+        except TelegramRetryAfter as error:
+            self.retried += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + error.retry_after)
+            logger.warning("Flood control, pausing sends for %s s", error.retry_after)
+            if job.attempts < self._max_retries:
+                job.attempts += 1
+                heapq.heappush(self._chats.setdefault(job.chat_id, []), job)
+            else:
+                self.failed += 1
+                job.future.set_exception(error)
+        except Exception as error:
+            self.failed += 1
+            if not job.future.done():
+                job.future.set_exception(error)
+        else:
+            self.sent += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._slots.release()
+            ready_at = max(started + self._chat_interval, self._paused_until)
+            heapq.heappush(self._waiting, (ready_at, job.chat_id))
+            self._wakeup.set()
+
+    def start(self):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10):
+        """Дождаться уже поставленных сообщений и остановить отправку"""
+        deadline = time.monotonic() + timeout
+        while (self._chats or self._tasks) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._chats:
+            logger.warning("Send queue not drained, %s messages dropped", self.depth())
+        if self._runner is not None:
+            self._runner.cancel()
+            self._runner = None
+
+    def depth(self) -> int:
+        return sum(len(jobs) for jobs in self._chats.values())
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "in_flight": len(self._tasks),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "coalesced": self.coalesced
+        }
+
+    # ---------- РАССЫЛКА ----------
+    async def broadcast(self, text: str, chunk_size: int, **kwargs) -> dict:
+        """Сообщение всем игрокам с низким приоритетом.
+
+        Получатели читаются пачками по id (каждая пачка - короткая сессия),
+        следующая пачка читается, когда предыдущая отправлена: очередь и
+        память не растут с числом игроков.
+        """
+        summary = {"recipients": 0, "sent": 0, "failed": 0}
+        last_id = 0
+        while True:
+            async with read_session_for() as session:
+                rows = (await session.execute(
+                    select(User.id, User.tg_id)
+                    .where(User.id > last_id)
+                    .order_by(User.id)
+                    .limit(chunk_size)
+                )).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            futures = [
+                self.submit(SendMessage(chat_id=row.tg_id, text=text, **kwargs), LOW)
+                for row in rows
+            ]
+            for result in await asyncio.gather(*futures, return_exceptions=True):
+                summary["failed" if isinstance(result, Exception) else "sent"] += 1
+            summary["recipients"] += len(rows)
+        return summary
@@ -0,0 +1,55 @@
+import asyncio
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Окружение задаем до импорта модулей бота: config читается при импорте
+_db_dir = tempfile.mkdtemp(prefix="gunter-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_db_dir}/test.db"
+os.environ["DATABASE_READ_URL"] = ""
+os.environ["WEBHOOK_REGISTER"] = "0"
+os.environ["SLOW_QUERY_MS"] = "0"
+os.environ["AIRDROP_EXPORT_DIR"] = os.path.join(_db_dir, "airdrop")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Base, engine, init_db  # noqa: E402
+import models  # noqa: E402,F401  (регистрирует таблицы в Base.metadata)
+
+
+@pytest.fixture(scope="session")
+def loop():
+    """Один цикл событий на все тесты: синглтоны модулей (Lock, Event) привязываются к нему"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.run_until_complete(engine.dispose())
+    loop.close()
+
+
+@pytest.fixture
+def run(loop):
+    """run(coro) - выполнить корутину в общем цикле"""
+    return loop.run_until_complete
+
+
+@pytest.fixture(scope="session")
+def _schema(loop):
+    loop.run_until_complete(init_db())
+
+
+@pytest.fixture
+def db(run, _schema):
+    """Пустая база с актуальной схемой; после теста таблицы очищаются"""
+    yield
+    from cache import user_cache
+
+    async def truncate():
+        async with engine.begin() as conn:
+            for table in reversed(Base.metadata.sorted_tables):
+                await conn.execute(table.delete())
+        await user_cache.backend.clear()
+
+    run(truncate())
@@ -0,0 +1,145 @@
+import hashlib
+import hmac
+import json
+import time
+from urllib.parse import urlencode
+
+import httpx
+import pytest
+
+import auth
+from auth import AuthError, SessionCache, issue_token, verify_init_data
+from config import BOT_TOKEN
+from database import AsyncSessionLocal
+from models import User
+
+
+def sign(fields: dict, bot_token: str = BOT_TOKEN) -> str:
+    """initData так, как ее подписывает Telegram"""
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    signature = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode({**fields, "hash": signature})
+
+
+def init_data(tg_id: int = 100, auth_date: float = None, **extra) -> str:
+    fields = {
+        "auth_date": str(int(auth_date if auth_date is not None else time.time())),
+        "user": json.dumps({"id": tg_id, "username": "racer"}),
+        **extra
+    }
+    return sign(fields)
+
+
+# ---------- initData ----------
+def test_valid_init_data_returns_user():
+    user = verify_init_data(init_data(tg_id=100, query_id="AAE"))
+    assert user["id"] == 100
+    assert user["username"] == "racer"
+
+
+def test_tampered_init_data_is_rejected():
+    tampered = init_data(tg_id=100).replace("100", "101", 1)
+    with pytest.raises(AuthError) as error:
+        verify_init_data(tampered)
+    assert error.value.status_code == 401
+
+
+def test_init_data_signed_by_other_bot_is_rejected():
+    fields = {"auth_date": str(int(time.time())), "user": json.dumps({"id": 100})}
+    with pytest.raises(AuthError):
+        verify_init_data(sign(fields, bot_token="1:OTHER"))
+
+
+def test_expired_init_data_is_rejected():
+    with pytest.raises(AuthError):
+        verify_init_data(init_data(auth_date=time.time() - 7200), max_age=3600)
+
+
+@pytest.mark.parametrize("malformed", [
+    "",
+    "hash=",
+    "user=%7B%7D&hash=%D0%BF%D1%80%D0%B8%D0%B2%D0%B5%D1%82",  # не-ASCII подпись
+    sign({"auth_date": "вчера", "user": json.dumps({"id": 100})}),
+    sign({"auth_date": str(int(time.time()))}),
+    sign({"auth_date": str(int(time.time())), "user": "not json"}),
+    sign({"auth_date": str(int(time.time())), "user": json.dumps({"id": "abc"})}),
+    sign({"auth_date": str(int(time.time())), "user": json.dumps([100])}),
+    None,
+])
+def test_malformed_init_data_is_401(malformed):
+    with pytest.raises(AuthError) as error:
+        verify_init_data(malformed)
+    assert error.value.status_code == 401
+
+
+# ---------- ТОКЕНЫ ----------
+def test_token_resolves_to_owner():
+    cache = SessionCache(maxsize=10)
+    token = issue_token(100)
+    assert cache.resolve(token) == 100
+    assert cache.resolve(token) == 100
+    assert cache.stats()["hits"] == 1
+
+
+def test_expired_token_is_rejected():
+    cache = SessionCache(maxsize=10)
+    assert cache.resolve(issue_token(100, ttl=-1)) is None
+
+
+@pytest.mark.parametrize("token", ["", "garbage", "100.99999999999.AAAA", "100.1.ъъъ", "a.b.c"])
+def test_forged_token_is_rejected(token):
+    assert SessionCache(maxsize=10).resolve(token) is None
+
+
+def test_token_for_other_player_is_forbidden():
+    with pytest.raises(AuthError) as error:
+        auth.check_owner(200, issue_token(100))
+    assert error.value.status_code == 403
+
+
+# ---------- HTTP ----------
+@pytest.fixture
+def client(run, db):
+    from api import app
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    yield client
+    run(client.aclose())
+
+
+def test_auth_endpoint_flow(run, client):
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            session.add_all([User(tg_id=100, username="racer"), User(tg_id=200, username="other")])
+            await session.commit()
+
+        response = await client.post("/api/auth", json={"init_data": init_data(tg_id=100)})
+        assert response.status_code == 200
+        token = response.json()["token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        assert (await client.get("/api/user/100", headers=headers)).status_code == 200
+        assert (await client.get("/api/user/200", headers=headers)).status_code == 403
+        assert (await client.get("/api/user/100")).status_code == 401
+
+        expired = {"Authorization": f"Bearer {issue_token(100, ttl=-1)}"}
+        assert (await client.get("/api/user/100", headers=expired)).status_code == 401
+
+    run(scenario())
+
+
+@pytest.mark.parametrize("body", [
+    {"init_data": "user=%7B%7D&hash=%D0%BF%D1%80%D0%B8%D0%B2%D0%B5%D1%82"},
+    {"init_data": sign({"auth_date": "x", "user": json.dumps({"id": 100})})},
+    {"init_data": 42},
+    ["init_data"],
+])
+def test_auth_endpoint_rejects_malformed_body(run, client, body):
+    response = run(client.post("/api/auth", json=body))
+    assert response.status_code == 401
+    assert "error" in response.json()
+
+
+def test_auth_endpoint_rejects_invalid_json(run, client):
+    response = run(client.post("/api/auth", content=b"{not json", headers={"Content-Type": "application/json"}))
+    assert response.status_code == 401
@@ -0,0 +1,60 @@
+import pytest
+
+from cache import Cache, CacheBackend, MemoryBackend
+
+
+def test_incomplete_backend_fails_on_creation():
+    class GetOnly(CacheBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnly()
+
+
+def test_memory_backend_evicts_least_recently_read(run):
+    async def scenario():
+        cache = Cache(MemoryBackend(maxsize=2, ttl=60), namespace="t")
+        await cache.set(1, "a")
+        await cache.set(2, "b")
+        assert await cache.get(1) == "a"
+        await cache.set(3, "c")
+
+        assert await cache.get(2) is None
+        assert await cache.get(1) == "a" and await cache.get(3) == "c"
+        assert cache.backend.evictions == 1
+        assert cache.stats()["misses"] == 1
+
+    run(scenario())
+
+
+def test_zero_ttl_disables_cache(run):
+    async def scenario():
+        cache = Cache(MemoryBackend(maxsize=10, ttl=0), namespace="t")
+        await cache.set(1, "a")
+        assert await cache.get(1) is None
+
+    run(scenario())
+
+
+def test_fill_skipped_after_concurrent_write(run):
+    async def scenario():
+        cache = Cache(MemoryBackend(maxsize=10, ttl=60), namespace="t")
+
+        # Чтение из базы началось, запись успела раньше
+        token = cache.begin_fill(1)
+        await cache.set(1, "fresh")
+        assert not await cache.fill(1, "stale", token)
+        assert await cache.get(1) == "fresh"
+
+        token = cache.begin_fill(2)
+        await cache.invalidate(2)
+        assert not await cache.fill(2, "stale", token)
+        assert await cache.get(2) is None
+
+        token = cache.begin_fill(3)
+        assert await cache.fill(3, "loaded", token)
+        assert await cache.get(3) == "loaded"
+        assert cache._filling == {}
+
+    run(scenario())
@@ -0,0 +1,48 @@
+import pytest
+
+import database
+
+
+class _Created(Exception):
+    """Движок 'создан' - дальше make_engine в тесте не идет"""
+
+
+@pytest.fixture
+def engine_kwargs(monkeypatch):
+    """make_engine без настоящего драйвера: запоминаем аргументы create_async_engine"""
+    captured = {}
+
+    def fake_create_async_engine(url, **kwargs):
+        captured.update(kwargs)
+        raise _Created()
+
+    monkeypatch.setattr(database, "create_async_engine", fake_create_async_engine)
+
+    def make(url):
+        captured.clear()
+        with pytest.raises(_Created):
+            database.make_engine(url)
+        return captured
+
+    return make
+
+
+def test_asyncpg_gets_statement_cache_args(engine_kwargs):
+    kwargs = engine_kwargs("postgresql+asyncpg://user:pass@db/gunter")
+    assert kwargs["connect_args"]["statement_cache_size"] == database.DB_STATEMENT_CACHE_SIZE
+    assert kwargs["pool_pre_ping"]
+
+
+@pytest.mark.parametrize("url", [
+    "postgresql+psycopg://user:pass@db/gunter",
+    "postgresql+psycopg_async://user:pass@db/gunter",
+])
+def test_other_postgres_drivers_get_no_asyncpg_args(engine_kwargs, url):
+    kwargs = engine_kwargs(url)
+    assert "connect_args" not in kwargs
+    assert kwargs["pool_pre_ping"]
+
+
+def test_sqlite_gets_busy_timeout(engine_kwargs):
+    kwargs = engine_kwargs("sqlite+aiosqlite:///game.db")
+    assert kwargs["connect_args"] == {"timeout": database.SQLITE_BUSY_TIMEOUT_MS / 1000}
@@ -0,0 +1,66 @@
+import events
+from events import EventBus, RESYNC, HEARTBEAT, encode
+
+
+def test_connection_caps_per_owner_and_total():
+    bus = EventBus(buffer_size=10, max_connections=3, max_per_user=2)
+    first = bus.subscribe(1, ["market"])
+    assert bus.subscribe(1, ["market"]) is not None
+    assert bus.subscribe(1, ["market"]) is None
+
+    assert bus.subscribe(2, ["market"]) is not None
+    assert bus.subscribe(3, ["market"]) is None
+    assert bus.connections() == 3
+
+    # Закрытая подписка освобождает место и у владельца, и в общем лимите
+    bus.unsubscribe(first)
+    bus.unsubscribe(first)
+    assert bus.connections() == 2
+    assert bus.subscribe(3, ["market"]) is not None
+
+
+def test_events_reach_only_topic_subscribers(run):
+    bus = EventBus(buffer_size=10, max_connections=10, max_per_user=10)
+    market = bus.subscribe(1, ["market"])
+    personal = bus.subscribe(1, [events.user_topic(1)])
+
+    async def scenario():
+        bus.publish("market", "listing_created", {"id": 5, "description": "<b>турбина</b>"})
+        assert await market.get(0.01) == encode("listing_created", {"id": 5, "description": "<b>турбина</b>"})
+        assert await personal.get(0.01) is None
+
+    run(scenario())
+    assert bus.stats()["published"] == 1 and bus.stats()["delivered"] == 1
+
+
+def test_overflow_replaces_backlog_with_resync(run):
+    bus = EventBus(buffer_size=3, max_connections=10, max_per_user=10)
+    slow = bus.subscribe(1, ["market"])
+
+    async def scenario():
+        for n in range(5):
+            bus.publish("market", "listing_created", {"id": n})
+        return [await slow.get(0.01) for _ in range(3)]
+
+    # Переполнение на 4-м событии: накопленное выброшено, вместо него resync
+    assert run(scenario()) == [RESYNC, encode("listing_created", {"id": 4}), None]
+
+
+def test_stream_sends_heartbeat_and_unsubscribes_on_close(run, monkeypatch):
+    bus = EventBus(buffer_size=10, max_connections=10, max_per_user=10)
+    monkeypatch.setattr(events, "bus", bus)
+    subscription = bus.subscribe(1, ["market"])
+
+    async def scenario():
+        body = events.stream(subscription, heartbeat=0.01)
+        assert await body.__anext__() == "retry: 3000\n\n"
+        assert await body.__anext__() == HEARTBEAT
+
+        bus.publish("market", "listing_closed", {"ids": [1]})
+        assert await body.__anext__() == encode("listing_closed", {"ids": [1]})
+
+        bus.close()
+        assert [frame async for frame in body] == []
+
+    run(scenario())
+    assert bus.connections() == 0
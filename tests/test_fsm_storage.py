@@ -0,0 +1,82 @@
+import asyncio
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import DatabaseStorage
+
+
+def _storage(**overrides):
+    options = dict(cache_size=100, cache_seconds=0, flush_seconds=0.01, flush_batch=100, ttl=3600)
+    options.update(overrides)
+    return DatabaseStorage(**options)
+
+
+def _key(chat_id):
+    return StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id)
+
+
+def test_close_waits_for_flush_in_progress(run, db):
+    async def scenario():
+        storage = _storage()
+        storage.start()
+        for chat_id in range(1, 21):
+            await storage.set_state(_key(chat_id), "Tune:waiting")
+            await storage.set_data(_key(chat_id), {"car": chat_id})
+
+        # Остановка приходится на середину фоновой записи: пачка уже вынута из _pending
+        while not storage._flush_lock.locked():
+            await asyncio.sleep(0)
+        await storage.close()
+
+        reader = _storage()
+        for chat_id in range(1, 21):
+            assert await reader.get_state(_key(chat_id)) == "Tune:waiting"
+            assert await reader.get_data(_key(chat_id)) == {"car": chat_id}
+
+    run(scenario())
+
+
+def test_cleared_state_is_deleted(run, db):
+    async def scenario():
+        storage = _storage()
+        await storage.set_state(_key(1), "Tune:waiting")
+        await storage.flush()
+        await storage.set_state(_key(1), None)
+        await storage.close()
+
+        assert await _storage().get_state(_key(1)) is None
+        assert storage.stats()["pending"] == 0
+
+    run(scenario())
+
+
+def test_zero_flush_interval_writes_through(run, db):
+    async def scenario():
+        storage = _storage(flush_seconds=0)
+        await storage.set_state(_key(1), "Tune:waiting")
+        assert storage.stats()["pending"] == 0
+        # Другой воркер видит изменение сразу
+        assert await _storage().get_state(_key(1)) == "Tune:waiting"
+
+    run(scenario())
+
+
+def test_failed_early_flush_is_logged_and_kept(run, db, caplog):
+    def broken_session():
+        raise RuntimeError("database is down")
+
+    async def scenario():
+        storage = _storage(cache_seconds=60, flush_batch=2)
+        for chat_id in (1, 2):
+            await storage.get_state(_key(chat_id))
+        # База отвалилась уже после чтения
+        storage._session_factory = broken_session
+        await storage.set_state(_key(1), "Tune:waiting")
+        await storage.set_state(_key(2), "Tune:waiting")
+        await asyncio.gather(storage._early_flush, return_exceptions=True)
+        await asyncio.sleep(0)
+        return storage
+
+    storage = run(scenario())
+    assert storage.stats()["pending"] == 2
+    assert "FSM storage early flush failed" in caplog.text
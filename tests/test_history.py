@@ -0,0 +1,136 @@
+import asyncio
+
+import httpx
+from sqlalchemy import select, func
+
+import api
+import history
+import race_engine
+from auth import issue_token
+from database import AsyncSessionLocal
+from history import HistoryRecorder, fetch_history_page
+from models import User, Car, RaceHistory, FightHistory
+
+
+async def _users(*tg_ids):
+    async with AsyncSessionLocal() as session:
+        users = [User(tg_id=tg_id, username=f"u{tg_id}") for tg_id in tg_ids]
+        session.add_all(users)
+        await session.commit()
+        return [user.id for user in users]
+
+
+async def _stored():
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(func.count()).select_from(RaceHistory))
+
+
+def test_close_waits_for_flush_in_progress(run, db):
+    async def scenario():
+        first, second = await _users(1, 2)
+        recorder = HistoryRecorder(flush_size=1, flush_seconds=60, max_buffer=100)
+        recorder.start()
+        for _ in range(5):
+            recorder.record_race(first, second, first)
+
+        # Остановка приходится на середину фоновой записи
+        while not recorder._flushing[RaceHistory]:
+            await asyncio.sleep(0)
+        await recorder.close()
+
+        assert recorder.depth() == 0
+        assert recorder.flushed == 5
+        assert await _stored() == 5
+
+    run(scenario())
+
+
+def test_page_merges_buffer_with_stored_rows(run, db, monkeypatch):
+    recorder = HistoryRecorder(flush_size=100, flush_seconds=60, max_buffer=100)
+    monkeypatch.setattr(history, "recorder", recorder)
+
+    async def scenario():
+        first, second = await _users(1, 2)
+        recorder.record_race(first, second, first)
+        await recorder.flush()
+        recorder.record_race(first, None, None)
+
+        async with AsyncSessionLocal() as session:
+            page = await fetch_history_page(session, RaceHistory, 1, limit=1)
+            assert [item["pending"] for item in page["items"]] == [True]
+            assert page["items"][0]["vs_bot"] and not page["items"][0]["won"]
+
+            rest = await fetch_history_page(session, RaceHistory, 1, cursor=page["next_cursor"])
+            assert [item["opponent"] for item in rest["items"]] == ["u2"]
+            assert rest["next_cursor"] is None
+
+    run(scenario())
+
+
+def test_pvp_race_goes_through_buffer(run, db, monkeypatch):
+    recorder = HistoryRecorder(flush_size=100, flush_seconds=60, max_buffer=100)
+    monkeypatch.setattr(history, "recorder", recorder)
+    monkeypatch.setattr(api, "recorder", recorder)
+
+    async def scenario():
+        first, second = await _users(1, 2)
+        async with AsyncSessionLocal() as session:
+            session.add_all([Car(owner_id=first), Car(owner_id=second)])
+            await session.commit()
+
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            response = await client.post("/api/race/pvp/1/2", headers={"Authorization": f"Bearer {issue_token(1)}"})
+            assert response.status_code == 200
+            won = response.json()["is_winner"]
+
+            # В транзакции гонки history не пишется - строка ждет в буфере
+            assert await _stored() == 0
+            page = (await client.get("/api/history/races/2", headers={"Authorization": f"Bearer {issue_token(2)}"})).json()
+            assert [(item["opponent"], item["won"], item["pending"]) for item in page["items"]] == [("u1", not won, True)]
+
+        await recorder.flush()
+        assert await _stored() == 1
+        async with AsyncSessionLocal() as session:
+            users = {user.tg_id: user for user in (await session.execute(select(User))).scalars()}
+        assert (users[1].races_won, users[1].races_lost) == ((1, 0) if won else (0, 1))
+        assert (users[2].races_won, users[2].races_lost) == ((0, 1) if won else (1, 0))
+
+    run(scenario())
+
+
+def test_fight_chance_depends_on_reputation_gap():
+    assert race_engine.fight_win_chance(10, 10) == 0.5
+    assert race_engine.fight_win_chance(30, 0) + race_engine.fight_win_chance(0, 30) == 1.0
+    assert race_engine.fight_win_chance(30, 0) > 0.5
+
+
+def test_fight_goes_through_buffer(run, db, monkeypatch):
+    recorder = HistoryRecorder(flush_size=100, flush_seconds=60, max_buffer=100)
+    monkeypatch.setattr(history, "recorder", recorder)
+    monkeypatch.setattr(api, "recorder", recorder)
+
+    async def scenario():
+        await _users(1, 2)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            headers = {"Authorization": f"Bearer {issue_token(1)}"}
+            assert (await client.post("/api/fight/1/2?location=луна", headers=headers)).status_code == 400
+            response = await client.post("/api/fight/1/2?location=гараж", headers=headers)
+            assert response.status_code == 200
+            won = response.json()["is_winner"]
+
+            page = (await client.get("/api/history/fights/2", headers={"Authorization": f"Bearer {issue_token(2)}"})).json()
+            assert [
+                (item["opponent"], item["won"], item["role"], item["location"], item["pending"])
+                for item in page["items"]
+            ] == [("u1", not won, "defender", "гараж", True)]
+
+        await recorder.flush()
+        async with AsyncSessionLocal() as session:
+            assert await session.scalar(select(func.count()).select_from(FightHistory)) == 1
+            users = {user.tg_id: user for user in (await session.execute(select(User))).scalars()}
+        winner, loser = (users[1], users[2]) if won else (users[2], users[1])
+        assert (winner.fights_won, winner.fights_lost, winner.reputation) == (1, 0, 1)
+        assert (loser.fights_won, loser.fights_lost, loser.reputation) == (0, 1, -1)
+        assert (winner.balance_token_minor, loser.balance_token_minor) == (300, 0)
+
+    run(scenario())
@@ -0,0 +1,68 @@
+import pytest
+
+from database import AsyncSessionLocal
+from inventory import add_item, fetch_inventory_page
+from market import InvalidCursor
+from models import User
+
+
+async def _user_with_items(item_types):
+    async with AsyncSessionLocal() as session:
+        user = User(tg_id=1, username="u1")
+        session.add(user)
+        await session.flush()
+        for level, item_type in enumerate(item_types, start=1):
+            add_item(session, user.id, item_type, {"level": level}, source="shop")
+        await session.commit()
+        return user.id
+
+
+async def _page(**kwargs):
+    async with AsyncSessionLocal() as session:
+        return await fetch_inventory_page(session, 1, **kwargs)
+
+
+def test_non_dict_item_is_wrapped_like_migrated_inventory(run, db):
+    async def scenario():
+        user_id = await _user_with_items([])
+        async with AsyncSessionLocal() as session:
+            wrapped = add_item(session, user_id, "engine", ["v8", 3])
+            empty = add_item(session, user_id, "turbo", None)
+            await session.commit()
+        assert (wrapped.data, wrapped.level) == ({"value": ["v8", 3]}, 3)
+        assert (empty.data, empty.level) == ({}, None)
+
+    run(scenario())
+
+
+def test_cursor_walks_newest_first_without_gaps(run, db):
+    async def scenario():
+        await _user_with_items(["turbo", "engine", "turbo", "suspension", "turbo"])
+
+        levels, cursor = [], None
+        while True:
+            page = await _page(cursor=cursor, limit=2)
+            levels.extend(item["level"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        assert levels == [5, 4, 3, 2, 1]
+
+        turbos = await _page(limit=2, item_type="turbo")
+        assert [item["level"] for item in turbos["items"]] == [5, 3]
+        rest = await _page(limit=2, item_type="turbo", cursor=turbos["next_cursor"])
+        assert [item["level"] for item in rest["items"]] == [1]
+        assert rest["next_cursor"] is None
+
+    run(scenario())
+
+
+def test_invalid_cursor_and_unknown_player(run, db):
+    async def scenario():
+        await _user_with_items(["turbo"])
+        with pytest.raises(InvalidCursor):
+            await _page(cursor="abc")
+        async with AsyncSessionLocal() as session:
+            assert await fetch_inventory_page(session, 999) == {"items": [], "next_cursor": None}
+
+    run(scenario())
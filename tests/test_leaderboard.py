@@ -0,0 +1,63 @@
+import random
+
+from database import AsyncSessionLocal
+from leaderboard import Leaderboard, RankingIndex
+from models import User
+
+
+def _expected_ranks(scores):
+    ordered = sorted(scores, key=lambda tg_id: (-scores[tg_id], tg_id))
+    return {tg_id: position for position, tg_id in enumerate(ordered, start=1)}
+
+
+def test_rank_orders_by_score_then_tg_id():
+    index = RankingIndex()
+    for tg_id, score in [(3, 10), (1, 10), (2, 30), (4, 0)]:
+        index.update(tg_id, score)
+
+    assert [index.rank(tg_id) for tg_id in (2, 1, 3, 4)] == [1, 2, 3, 4]
+    assert index.top(2) == [(2, 30), (1, 10)]
+    assert index.rank(99) is None
+
+
+def test_updates_and_removals_match_full_sort():
+    rng = random.Random(1)
+    index, scores = RankingIndex(), {}
+    for _ in range(2000):
+        tg_id = rng.randrange(50)
+        if rng.random() < 0.1:
+            index.remove(tg_id)
+            scores.pop(tg_id, None)
+        else:
+            scores[tg_id] = rng.randrange(20)
+            index.update(tg_id, scores[tg_id])
+
+    assert len(index) == len(scores)
+    assert {tg_id: index.rank(tg_id) for tg_id in scores} == _expected_ranks(scores)
+
+
+def test_reconcile_rebuilds_from_database(run, db):
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            session.add_all([
+                User(tg_id=1, username="slow", races_won=1, balance_token_minor=250),
+                User(tg_id=2, first_name="Гена", races_won=5),
+                User(tg_id=3, username="mid", races_won=3),
+            ])
+            await session.commit()
+
+        board = Leaderboard()
+        # Устаревшие данные из другого воркера и удаленный игрок
+        board.indexes["races_won"].update(1, 100)
+        board.indexes["races_won"].update(9, 50)
+
+        async with AsyncSessionLocal() as session:
+            await board.reconcile(session)
+
+        assert [(entry["tg_id"], entry["score"]) for entry in board.top("races_won")] == [(2, 5), (3, 3), (1, 1)]
+        assert board.rank("races_won", 2)["name"] == "Гена"
+        assert board.rank("races_won", 9) is None
+        # Токены хранятся в центах, в рейтинге - в целых единицах
+        assert board.rank("balance_token", 1) == {"rank": 1, "tg_id": 1, "name": "slow", "score": 2.5}
+
+    run(scenario())
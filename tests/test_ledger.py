@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+import ledger
+from database import AsyncSessionLocal
+from ledger import InsufficientFunds, to_minor, from_minor
+from models import User, LedgerEntry
+
+
+async def _user(cash_minor=0, token_minor=0):
+    async with AsyncSessionLocal() as session:
+        user = User(tg_id=1, balance_cash_minor=cash_minor, balance_token_minor=token_minor)
+        session.add(user)
+        await session.commit()
+        return user.id
+
+
+async def _balances(user_id):
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(
+            select(User.balance_cash_minor, User.balance_token_minor, User.total_earned_tokens_minor)
+            .where(User.id == user_id)
+        )).one()
+
+
+async def _entries():
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(
+            select(LedgerEntry.currency, LedgerEntry.amount, LedgerEntry.balance_after, LedgerEntry.reason)
+            .order_by(LedgerEntry.id)
+        )).all()
+
+
+def test_minor_unit_conversion_is_exact():
+    assert to_minor(19.99) == 1999
+    assert to_minor(0.1) + to_minor(0.2) == to_minor(0.3)
+    assert to_minor(-12.34) == -1234
+    assert from_minor(1999) == 19.99
+
+
+def test_many_small_credits_sum_exactly(run, db):
+    async def scenario():
+        user_id = await _user()
+        async with AsyncSessionLocal() as session:
+            for _ in range(10):
+                await ledger.apply(session, user_id, cash=0.1, reason="race_win")
+            await session.commit()
+
+        cash, _, _ = await _balances(user_id)
+        assert cash == 100
+        entries = await _entries()
+        assert [amount for _, amount, _, _ in entries] == [10] * 10
+        assert [after for _, _, after, _ in entries] == list(range(10, 101, 10))
+
+    run(scenario())
+
+
+def test_insufficient_funds_changes_nothing(run, db):
+    async def scenario():
+        user_id = await _user(cash_minor=999, token_minor=500)
+        async with AsyncSessionLocal() as session:
+            with pytest.raises(InsufficientFunds):
+                await ledger.apply(session, user_id, cash=-10, tokens=1, reason="tune_valves")
+            await session.commit()
+
+        assert await _balances(user_id) == (999, 500, 0)
+        assert await _entries() == []
+
+    run(scenario())
+
+
+def test_debit_to_exact_zero_and_allow_negative(run, db):
+    async def scenario():
+        user_id = await _user(cash_minor=1000)
+        async with AsyncSessionLocal() as session:
+            assert await ledger.apply(session, user_id, cash=-10, reason="tune_engine") == (0, 0)
+            assert await ledger.apply(session, user_id, cash=-5, reason="penalty", allow_negative=True) == (-500, 0)
+            await session.commit()
+
+    run(scenario())
+
+
+def test_token_credit_counts_as_earned(run, db):
+    async def scenario():
+        user_id = await _user()
+        async with AsyncSessionLocal() as session:
+            await ledger.apply(session, user_id, tokens=2.5, reason="race_win")
+            await ledger.apply(session, user_id, tokens=-1, reason="donate")
+            await session.commit()
+
+        assert await _balances(user_id) == (0, 150, 250)
+
+    run(scenario())
+
+
+def test_loaded_user_sees_new_balance(run, db):
+    async def scenario():
+        user_id = await _user(cash_minor=1000)
+        async with AsyncSessionLocal() as session:
+            user = await session.get(User, user_id)
+            await ledger.apply(session, user_id, cash=2.5, reason="race_win")
+            assert user.balance_cash_minor == 1250
+            assert user.balance_cash == 12.5
+            await session.commit()
+
+    run(scenario())
+
+
+def test_concurrent_debits_never_overdraw(run, db):
+    async def scenario():
+        user_id = await _user(cash_minor=1000)
+
+        async def spend():
+            async with AsyncSessionLocal() as session:
+                try:
+                    await ledger.apply(session, user_id, cash=-3, reason="tune_valves")
+                except InsufficientFunds:
+                    return False
+                await session.commit()
+                return True
+
+        results = await asyncio.gather(*(spend() for _ in range(5)))
+        assert results.count(True) == 3
+        cash, _, _ = await _balances(user_id)
+        assert cash == 100
+
+    run(scenario())
+
+
+def test_ledger_entries_are_immutable(run, db):
+    async def scenario():
+        user_id = await _user(cash_minor=1000)
+        async with AsyncSessionLocal() as session:
+            await ledger.apply(session, user_id, cash=-1, reason="tune_valves")
+            await session.commit()
+
+            entry = (await session.execute(select(LedgerEntry))).scalar_one()
+            entry.amount = 0
+            with pytest.raises(RuntimeError, match="immutable"):
+                await session.flush()
+            await session.rollback()
+
+        assert [amount for _, amount, _, _ in await _entries()] == [-100]
+
+    run(scenario())
+
+
+def test_nothing_to_apply_is_an_error(run, db):
+    async def scenario():
+        user_id = await _user()
+        async with AsyncSessionLocal() as session:
+            with pytest.raises(ValueError):
+                await ledger.apply(session, user_id, cash=0.001, reason="noop")
+
+    run(scenario())
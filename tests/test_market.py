@@ -0,0 +1,232 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select
+
+import market
+from database import AsyncSessionLocal
+from ledger import InsufficientFunds
+from market import ListingUnavailable
+from models import User, AvitoListing, AvitoArchive, AvitoFacet, LedgerEntry
+
+
+async def _users(*tg_ids, cash_minor=500000):
+    async with AsyncSessionLocal() as session:
+        users = [User(tg_id=tg_id, username=f"u{tg_id}", balance_cash_minor=cash_minor) for tg_id in tg_ids]
+        session.add_all(users)
+        await session.commit()
+        return [user.id for user in users]
+
+
+async def _listing(seller_id, price=1000.0, item_type="turbo", age=timedelta(0)):
+    async with AsyncSessionLocal() as session:
+        listing = await market.create_listing(session, seller_id, item_type, {"tier": 1}, price, "турбина")
+        listing.created_at = datetime.utcnow() - age
+        await session.commit()
+        return listing.id
+
+
+async def _balance(user_id):
+    async with AsyncSessionLocal() as session:
+        return await session.scalar(select(User.balance_cash_minor).where(User.id == user_id))
+
+
+async def _archived(listing_id):
+    async with AsyncSessionLocal() as session:
+        return (await session.execute(
+            select(AvitoArchive).where(AvitoArchive.listing_id == listing_id)
+        )).scalars().all()
+
+
+async def _facets():
+    async with AsyncSessionLocal() as session:
+        return dict(((facet, value), count) for facet, value, count in (await session.execute(
+            select(AvitoFacet.facet, AvitoFacet.value, AvitoFacet.count)
+        )).all())
+
+
+async def _buy(listing_id, buyer_id):
+    async with AsyncSessionLocal() as session:
+        try:
+            listing = await market.purchase(session, listing_id, buyer_id)
+        except (ListingUnavailable, InsufficientFunds) as error:
+            await session.rollback()
+            return error
+        await session.commit()
+        return listing
+
+
+def test_purchase_moves_money_and_archives(run, db):
+    async def scenario():
+        seller, buyer = await _users(1, 2)
+        listing_id = await _listing(seller, price=1234.56)
+
+        sold = await _buy(listing_id, buyer)
+        assert sold.id == listing_id
+
+        assert await _balance(buyer) == 500000 - 123456
+        assert await _balance(seller) == 500000 + 123456
+
+        [archived] = await _archived(listing_id)
+        assert (archived.status, archived.buyer_id, archived.seller_id) == ("sold", buyer, seller)
+
+        async with AsyncSessionLocal() as session:
+            assert await session.get(AvitoListing, listing_id) is None
+            entries = (await session.execute(
+                select(LedgerEntry.user_id, LedgerEntry.amount, LedgerEntry.ref).order_by(LedgerEntry.id)
+            )).all()
+        ref = f"listing:{listing_id}"
+        assert entries == [(buyer, -123456, ref), (seller, 123456, ref)]
+        assert not any((await _facets()).values())
+
+    run(scenario())
+
+
+def test_concurrent_double_buy_has_one_winner(run, db):
+    async def scenario():
+        seller, first, second = await _users(1, 2, 3)
+        listing_id = await _listing(seller, price=100)
+
+        results = await asyncio.gather(_buy(listing_id, first), _buy(listing_id, second))
+        winners = [result for result in results if not isinstance(result, Exception)]
+        losers = [result for result in results if isinstance(result, ListingUnavailable)]
+        assert len(winners) == 1 and len(losers) == 1
+
+        assert len(await _archived(listing_id)) == 1
+        assert await _balance(seller) == 500000 + 10000
+        assert sorted([await _balance(first), await _balance(second)]) == [500000 - 10000, 500000]
+
+    run(scenario())
+
+
+def test_cannot_buy_own_listing(run, db):
+    async def scenario():
+        seller, = await _users(1)
+        listing_id = await _listing(seller)
+
+        error = await _buy(listing_id, seller)
+        assert isinstance(error, ListingUnavailable)
+        assert str(error) == "Нельзя купить свой товар"
+        assert await _archived(listing_id) == []
+        assert await _balance(seller) == 500000
+
+    run(scenario())
+
+
+def test_insufficient_funds_returns_listing_to_market(run, db):
+    async def scenario():
+        seller, = await _users(1)
+        buyer, = await _users(2, cash_minor=5000)
+        listing_id = await _listing(seller, price=100)
+
+        assert isinstance(await _buy(listing_id, buyer), InsufficientFunds)
+        async with AsyncSessionLocal() as session:
+            listing = await session.get(AvitoListing, listing_id)
+            assert listing is not None and not listing.is_sold
+        assert await _balance(buyer) == 5000
+        assert await _balance(seller) == 500000
+
+    run(scenario())
+
+
+def test_reservation_blocks_other_buyers_until_it_expires(run, db):
+    async def scenario():
+        seller, holder, other = await _users(1, 2, 3)
+        listing_id = await _listing(seller)
+
+        async with AsyncSessionLocal() as session:
+            await market.reserve(session, listing_id, holder, seconds=60)
+            await session.commit()
+
+        error = await _buy(listing_id, other)
+        assert str(error) == "Товар забронирован другим покупателем"
+
+        # Бронь истекла - объявление снова доступно всем
+        async with AsyncSessionLocal() as session:
+            listing = await session.get(AvitoListing, listing_id)
+            listing.reserved_until = datetime.utcnow() - timedelta(seconds=1)
+            await session.commit()
+
+        assert not isinstance(await _buy(listing_id, other), Exception)
+
+    run(scenario())
+
+
+def test_released_reservation_frees_listing(run, db):
+    async def scenario():
+        seller, holder, other = await _users(1, 2, 3)
+        listing_id = await _listing(seller)
+
+        async with AsyncSessionLocal() as session:
+            await market.reserve(session, listing_id, holder, seconds=60)
+            # Чужую бронь снять нельзя
+            assert not await market.release(session, listing_id, other)
+            assert await market.release(session, listing_id, holder)
+            assert not await market.release(session, listing_id, holder)
+            await session.commit()
+
+        assert not isinstance(await _buy(listing_id, other), Exception)
+
+    run(scenario())
+
+
+def test_expirer_skips_live_reservations_and_releases_expired(run, db):
+    async def scenario():
+        seller, holder = await _users(1, 2)
+        reserved_id = await _listing(seller, age=timedelta(days=40))
+        lapsed_id = await _listing(seller, age=timedelta(days=40))
+        fresh_id = await _listing(seller)
+
+        async with AsyncSessionLocal() as session:
+            await market.reserve(session, reserved_id, holder, seconds=60)
+            await market.reserve(session, lapsed_id, holder, seconds=60)
+            lapsed = await session.get(AvitoListing, lapsed_id)
+            lapsed.reserved_until = datetime.utcnow() - timedelta(seconds=1)
+            await session.commit()
+
+        async with AsyncSessionLocal() as session:
+            expired = await market.expire_stale_listings(session, timedelta(days=30), batch=1)
+        assert expired == 1
+
+        [archived] = await _archived(lapsed_id)
+        assert (archived.status, archived.buyer_id) == ("expired", None)
+        assert await _archived(reserved_id) == []
+        assert await _archived(fresh_id) == []
+        assert (await _facets())[("item_type", "turbo")] == 2
+
+    run(scenario())
+
+
+def test_expirer_commits_each_batch(run, db, monkeypatch):
+    async def scenario():
+        seller, = await _users(1)
+        for _ in range(5):
+            await _listing(seller, age=timedelta(days=40))
+
+        # После каждого коммита смотрим из другой сессии, сколько уже в архиве
+        archived_at_commit = []
+        async with AsyncSessionLocal() as session:
+            commit = session.commit
+
+            async def counting_commit():
+                await commit()
+                async with AsyncSessionLocal() as other:
+                    archived_at_commit.append(len((await other.execute(select(AvitoArchive))).all()))
+
+            monkeypatch.setattr(session, "commit", counting_commit)
+            assert await market.expire_stale_listings(session, timedelta(days=30), batch=2) == 5
+
+        assert archived_at_commit == [2, 4, 5]
+
+    run(scenario())
+
+
+def test_reserve_unknown_listing(run, db):
+    async def scenario():
+        buyer, = await _users(1)
+        async with AsyncSessionLocal() as session:
+            with pytest.raises(ListingUnavailable):
+                await market.reserve(session, 999, buyer, seconds=60)
+
+    run(scenario())
@@ -0,0 +1,62 @@
+import re
+
+import httpx
+
+import api
+from auth import issue_token
+from metrics import Registry, Counter, Gauge, Histogram
+
+# Строка сэмпла в текстовом формате Prometheus: имя{метки} значение
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? [-+0-9.eE]+(Inf)?$')
+
+
+def _samples(text):
+    return [line for line in text.splitlines() if line and not line.startswith("#")]
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    requests = registry.register(Counter("requests_total", "Requests", labels=("path",)))
+    registry.register(Gauge("queue_depth", "Depth", collect=lambda: 7))
+    latency = registry.register(Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0)))
+
+    requests.inc('/a"b\\')
+    requests.inc('/a"b\\', amount=2)
+    for value in (0.05, 0.1, 0.5, 3.0):
+        latency.observe(value)
+
+    text = registry.render()
+    assert "# TYPE requests_total counter" in text
+    assert 'requests_total{path="/a\\"b\\\\"} 3' in text
+    assert "queue_depth 7" in text
+    # Корзины накопительные, граница входит в свою корзину
+    assert 'latency_seconds_bucket{le="0.1"} 2' in text
+    assert 'latency_seconds_bucket{le="1.0"} 3' in text
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in text
+    assert "latency_seconds_sum 3.65" in text
+    assert "latency_seconds_count 4" in text
+    assert all(SAMPLE.match(line) for line in _samples(text))
+
+
+def test_scrape_labels_requests_by_route_template(run, db):
+    async def scenario():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test") as client:
+            headers = {"Authorization": f"Bearer {issue_token(4242)}"}
+            assert (await client.get("/api/user/4242", headers=headers)).status_code == 404
+            assert (await client.get("/no/such/page")).status_code == 404
+            response = await client.get("/metrics")
+        return response
+
+    response = run(scenario())
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    samples = _samples(response.text)
+    assert all(SAMPLE.match(line) for line in samples)
+
+    # Метка route - шаблон маршрута, а не путь с id игрока
+    assert any(line.startswith(
+        'http_request_duration_seconds_count{method="GET",route="/api/user/{tg_id}",status="404"}'
+    ) for line in samples)
+    assert any('route="<unmatched>"' in line for line in samples)
+    assert not any("4242" in line for line in samples)
+    assert any(line.startswith('db_queries_per_request_count{kind="http"}') for line in samples)
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import models  # noqa: F401 - регистрирует таблицы в Base.metadata
+from database import Base
+from migrations import run_migrations, _columns
+
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    """Синхронная база с таблицами, которые create_all делает до миграций.
+    Тест добавляет в нее колонки и строки старой схемы"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        Base.metadata.create_all(conn)
+    yield engine
+    engine.dispose()
+
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        run_migrations(conn)
+
+
+def test_inventory_json_moves_to_items_table(legacy_db):
+    with legacy_db.begin() as conn:
+        conn.execute(text("ALTER TABLE users ADD COLUMN inventory JSON"))
+        conn.execute(text("INSERT INTO users (id, tg_id, inventory) VALUES (1, 100, :inventory), (2, 200, NULL)"), {
+            "inventory": json.dumps({
+                "turbos": [{"tier": 2, "level": 2}],
+                "engines": [["v8", 3]],
+                "turbo": ["bought"],
+            })
+        })
+
+    upgrade(legacy_db)
+
+    with legacy_db.connect() as conn:
+        assert "inventory" not in _columns(conn, "users")
+        rows = conn.execute(text(
+            "SELECT user_id, item_type, level, data, source FROM inventory_items ORDER BY id"
+        )).all()
+    assert [(user_id, item_type, level, json.loads(data), source) for user_id, item_type, level, data, source in rows] == [
+        (1, "turbo", 2, {"tier": 2, "level": 2}, "migration"),
+        (1, "engine", 3, {"value": ["v8", 3]}, "migration"),
+        (1, "turbo", None, {"value": "bought"}, "migration"),
+    ]
+
+
+def test_float_balances_become_minor_units(legacy_db):
+    with legacy_db.begin() as conn:
+        for column in ("balance_cash", "balance_token", "total_earned_tokens"):
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {column} FLOAT"))
+        conn.execute(text(
+            "INSERT INTO users (id, tg_id, balance_cash, balance_token, total_earned_tokens) VALUES "
+            "(1, 100, 19.99, 0.1, 1.239), "
+            "(2, 200, NULL, NULL, NULL), "
+            "(3, 300, -12.34, 1000000.005, 0)"
+        ))
+
+    upgrade(legacy_db)
+
+    with legacy_db.connect() as conn:
+        columns = _columns(conn, "users")
+        rows = conn.execute(text(
+            "SELECT balance_cash_minor, balance_token_minor, total_earned_tokens_minor FROM users ORDER BY id"
+        )).all()
+    assert not columns & {"balance_cash", "balance_token", "total_earned_tokens"}
+    # Округление, а не отбрасывание: 19.99 * 100 во float - это 1998.9999...
+    assert [tuple(row) for row in rows] == [
+        (1999, 10, 124),
+        (0, 0, 0),
+        (-1234, 100000001, 0),
+    ]
+
+
+def test_sold_listings_move_to_archive(legacy_db):
+    with legacy_db.begin() as conn:
+        # Старая таблица объявлений: без брони, проданное лежит рядом с активным
+        conn.execute(text("DROP TABLE avito_listings"))
+        conn.execute(text(
+            "CREATE TABLE avito_listings (id INTEGER PRIMARY KEY, seller_id INTEGER REFERENCES users (id), "
+            "item_type VARCHAR, item_data JSON, price FLOAT, description VARCHAR, is_sold BOOLEAN, created_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO users (id, tg_id) VALUES (1, 100)"))
+        conn.execute(text(
+            "INSERT INTO avito_listings (id, seller_id, item_type, item_data, price, description, is_sold, created_at) VALUES "
+            "(1, 1, 'turbo', '{\"tier\": 1}', 100.0, 'продано', 1, '2024-01-01 00:00:00'), "
+            "(2, 1, 'engine', '{}', 200.0, 'в продаже', 0, '2024-01-02 00:00:00')"
+        ))
+
+    upgrade(legacy_db)
+
+    with legacy_db.connect() as conn:
+        assert {"reserved_by", "reserved_until"} <= _columns(conn, "avito_listings")
+        assert conn.execute(text("SELECT id FROM avito_listings")).scalars().all() == [2]
+        archived = conn.execute(text(
+            "SELECT listing_id, seller_id, buyer_id, item_type, price, description, status FROM avito_listings_archive"
+        )).all()
+    assert [tuple(row) for row in archived] == [(1, 1, None, "turbo", 100.0, "продано", "sold")]
@@ -0,0 +1,70 @@
+import asyncio
+import subprocess
+import sys
+
+import pytest
+
+import process_lock
+from process_lock import FileLock, exclusive
+
+
+@pytest.fixture(autouse=True)
+def lock_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(process_lock, "LOCK_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_second_holder_is_blocked_until_release():
+    first, second = FileLock("job"), FileLock("job")
+    assert first.acquire()
+    assert not second.acquire(blocking=False)
+    assert not second.held
+
+    first.release()
+    assert second.acquire(blocking=False)
+    second.release()
+
+
+def test_exclusive_waits_without_blocking_the_loop(run):
+    holder = FileLock("job")
+    holder.acquire()
+    entered = asyncio.Event()
+
+    async def critical():
+        async with exclusive("job"):
+            entered.set()
+
+    async def scenario():
+        task = asyncio.create_task(critical())
+        # Пока блокировка занята, event loop продолжает работать
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+        assert not entered.is_set()
+
+        holder.release()
+        await asyncio.wait_for(task, 5)
+        assert entered.is_set()
+
+    run(scenario())
+
+
+def test_lock_of_crashed_process_is_released(lock_dir):
+    holder = subprocess.Popen(
+        [sys.executable, "-c",
+         "import fcntl, os, sys, time\n"
+         f"fd = os.open({str(lock_dir / 'gunter-job.lock')!r}, os.O_RDWR | os.O_CREAT)\n"
+         "fcntl.flock(fd, fcntl.LOCK_EX)\n"
+         "print('locked', flush=True)\n"
+         "time.sleep(60)\n"],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        assert holder.stdout.readline().strip() == "locked"
+        lock = FileLock("job")
+        assert not lock.acquire(blocking=False)
+    finally:
+        holder.kill()
+        holder.wait()
+
+    assert lock.acquire(blocking=False)
+    lock.release()
@@ -0,0 +1,83 @@
+import numpy as np
+import pytest
+from sqlalchemy import select, func
+
+import race_engine
+from database import AsyncSessionLocal
+from models import User, RaceHistory
+
+
+def _field(n):
+    ids = [100 + i for i in range(n)]
+    stats = np.array([[100 + 10 * i, 5, 10] for i in range(n)], dtype=float)
+    return ids, stats
+
+
+def test_seeded_tournament_is_deterministic():
+    ids, stats = _field(11)
+    first = race_engine.run_tournament(ids, stats, race_engine.make_rng(42))
+    second = race_engine.run_tournament(ids, stats, race_engine.make_rng(42))
+    assert first == second
+
+    a, b = stats[:5], stats[5:10]
+    assert (race_engine.race(a, b, race_engine.make_rng(7)) == race_engine.race(a, b, race_engine.make_rng(7))).all()
+
+
+@pytest.mark.parametrize("n", [1, 2, 3, 5, 6, 7, 12, 17])
+def test_bracket_of_any_size_plays_each_entrant_once_per_round(n):
+    ids, stats = _field(n)
+    winner, races = race_engine.run_tournament(ids, stats, race_engine.make_rng(n))
+    size = 1 << (n - 1).bit_length()
+
+    # Каждый заезд выбивает одного - всего n-1 заездов
+    assert len(races) == n - 1
+    survivors, position, first_round = set(ids), 0, True
+    while size > 1:
+        size //= 2
+        # Пустые места не встречаются друг с другом: после раунда остается ровно size участников
+        round_races = races[position:position + len(survivors) - size]
+        position += len(round_races)
+        players = [player for p1, p2, _ in round_races for player in (p1, p2)]
+        assert len(players) == len(set(players)) and set(players) <= survivors
+        if first_round:
+            # Без пары в первом раунде - ровно столько игроков, сколько пустых мест
+            assert len(survivors - set(players)) == 2 * size - n
+        else:
+            assert set(players) == survivors
+        for p1, p2, race_winner in round_races:
+            assert race_winner in (p1, p2)
+            survivors.discard(p2 if race_winner == p1 else p1)
+        assert len(survivors) == size
+        first_round = False
+
+    assert survivors == {winner}
+
+
+def test_empty_bracket():
+    assert race_engine.run_tournament([], np.empty((0, 3))) == (None, [])
+
+
+def test_record_races_writes_history_and_counters(run, db):
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            users = [User(tg_id=tg_id) for tg_id in (1, 2, 3)]
+            session.add_all(users)
+            await session.commit()
+            a, b, c = (user.id for user in users)
+
+            players = await race_engine.record_races(session, [
+                (a, b, a),
+                (a, None, None),   # бот победил
+                (c, b, b),
+            ], bet_amount=10)
+            await session.commit()
+            assert players == {a, b, c}
+            assert await race_engine.record_races(session, []) == set()
+
+            counters = dict(((uid, (won, lost)) for uid, won, lost in (await session.execute(
+                select(User.id, User.races_won, User.races_lost)
+            )).all()))
+            assert counters == {a: (1, 1), b: (1, 1), c: (0, 1)}
+            assert await session.scalar(select(func.count()).select_from(RaceHistory)) == 3
+
+    run(scenario())
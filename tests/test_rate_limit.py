@@ -0,0 +1,37 @@
+import pytest
+
+from rate_limit import BucketStore, MemoryBucketStore, RateLimiter, RateLimited
+
+
+def test_incomplete_store_fails_on_creation():
+    class NoTake(BucketStore):
+        pass
+
+    with pytest.raises(TypeError):
+        NoTake()
+
+
+def test_burst_then_limited(run):
+    async def scenario():
+        limiter = RateLimiter(MemoryBucketStore(maxsize=100), {"race": (10, 2)})
+        await limiter.hit(1, "race")
+        await limiter.hit(1, "race")
+        with pytest.raises(RateLimited) as error:
+            await limiter.hit(1, "race")
+        assert 9 < error.value.retry_after <= 10
+        assert error.value.retry_after_seconds == 10
+
+        # У другого игрока свое ведро
+        await limiter.hit(2, "race")
+        assert limiter.stats() == {"race": {"allowed": 3, "limited": 1}}
+
+    run(scenario())
+
+
+def test_zero_interval_never_limits(run):
+    async def scenario():
+        store = MemoryBucketStore(maxsize=100)
+        for _ in range(10):
+            assert await store.take("key", 0, 1) == 0
+
+    run(scenario())
@@ -0,0 +1,85 @@
+import market
+from database import AsyncSessionLocal
+from models import User
+
+
+async def _market(listings):
+    """Продавец и объявления [(item_type, price, description)]"""
+    async with AsyncSessionLocal() as session:
+        seller = User(tg_id=1, username="seller")
+        session.add(seller)
+        await session.flush()
+        for item_type, price, description in listings:
+            await market.create_listing(session, seller.id, item_type, {"level": 1}, price, description)
+        await session.commit()
+
+
+LISTINGS = [
+    ("turbo", 50, "Турбина гаррет"),
+    ("turbo", 700, "Турбина с пробегом"),
+    ("engine", 700, "Двигатель V8"),
+    (None, 20000, "Кузов без документов"),
+]
+
+
+async def _search(**params):
+    async with AsyncSessionLocal() as session:
+        return await market.search_listings(session, **params)
+
+
+def test_unfiltered_facets_come_from_counters(run, db):
+    async def scenario():
+        await _market(LISTINGS)
+        page = await _search()
+        assert len(page["items"]) == 4
+        assert page["facets"]["item_type"] == {"turbo": 2, "engine": 1, "": 1}
+        assert page["facets"]["price"] == [
+            {"bucket": "<100", "count": 1},
+            {"bucket": "500-1000", "count": 2},
+            {"bucket": "10000+", "count": 1},
+        ]
+
+    run(scenario())
+
+
+def test_facet_ignores_its_own_filter(run, db):
+    async def scenario():
+        await _market(LISTINGS)
+        page = await _search(item_type="turbo")
+        assert {item["item_type"] for item in page["items"]} == {"turbo"}
+        # Другие типы видны со счетчиками - на них можно переключиться
+        assert page["facets"]["item_type"] == {"turbo": 2, "engine": 1, "": 1}
+        # Цены - только среди турбин
+        assert page["facets"]["price"] == [
+            {"bucket": "<100", "count": 1},
+            {"bucket": "500-1000", "count": 1},
+        ]
+
+        page = await _search(item_type="turbo", price_bucket="500-1000")
+        assert len(page["items"]) == 1
+        assert page["facets"]["item_type"] == {"turbo": 1, "engine": 1}
+        assert [bucket["bucket"] for bucket in page["facets"]["price"]] == ["<100", "500-1000"]
+
+    run(scenario())
+
+
+def test_text_query_narrows_every_facet(run, db):
+    async def scenario():
+        await _market(LISTINGS)
+        page = await _search(query="турб")
+        assert len(page["items"]) == 2
+        assert page["facets"]["item_type"] == {"turbo": 2}
+
+        page = await _search(query="кузов")
+        assert page["facets"]["item_type"] == {"": 1}
+
+    run(scenario())
+
+
+def test_hostile_query_is_plain_words(run, db):
+    async def scenario():
+        await _market(LISTINGS)
+        page = await _search(query='"V8"*) (')
+        assert [item["description"] for item in page["items"]] == ["Двигатель V8"]
+
+    run(scenario())
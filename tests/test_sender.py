@@ -0,0 +1,199 @@
+import asyncio
+import time
+from datetime import datetime
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage, EditMessageText
+from aiogram.types import BufferedInputFile, Chat, Message
+from aiohttp import web
+
+from sender import SendScheduler, HIGH, LOW
+
+
+class FakeBotApi:
+    """Локальный сервер с ответами в формате Bot API. Запоминает каждый запрос"""
+
+    def __init__(self):
+        self.requests = []     # (метод, время, параметры)
+        self.flood_once = set()  # методы, на которые один раз ответить 429
+        self._runner = None
+        self.url = None
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.requests.append((method, time.monotonic(), params))
+
+        if method in self.flood_once:
+            self.flood_once.discard(method)
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests: retry after 1",
+                "parameters": {"retry_after": 1}
+            })
+
+        chat_id = int(params["chat_id"])
+        return web.json_response({"ok": True, "result": {
+            "message_id": int(params.get("message_id", len(self.requests))),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text")
+        }})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def calls(self, method):
+        return [(at, params) for name, at, params in self.requests if name == method]
+
+
+@pytest.fixture
+def api(run):
+    server = FakeBotApi()
+    run(server.start())
+    yield server
+    run(server.stop())
+
+
+@pytest.fixture
+def make_scheduler(run, api):
+    bots = []
+
+    def make(global_rate=100, chat_interval=0.0, max_in_flight=10, max_retries=3):
+        bot = Bot("42:TEST", session=AiohttpSession(api=TelegramAPIServer.from_base(api.url)))
+        bots.append(bot)
+        return SendScheduler(bot, global_rate, chat_interval, max_in_flight, max_retries)
+
+    yield make
+    for bot in bots:
+        run(bot.session.close())
+
+
+def test_global_rate_spaces_requests(run, api, make_scheduler):
+    outbox = make_scheduler(global_rate=20)
+
+    async def scenario():
+        futures = [outbox.submit(SendMessage(chat_id=chat_id, text="hi")) for chat_id in range(1, 7)]
+        await asyncio.gather(*futures)
+        await outbox.stop()
+
+    run(scenario())
+    times = [at for at, _ in api.calls("sendMessage")]
+    assert len(times) == 6
+    # 6 запросов при 20 в секунду - не быстрее 5 интервалов по 50 мс
+    assert times[-1] - times[0] >= 5 * 0.05 * 0.9
+
+
+def test_chat_interval_keeps_order_within_chat(run, api, make_scheduler):
+    outbox = make_scheduler(chat_interval=0.2)
+
+    async def scenario():
+        futures = [outbox.submit(SendMessage(chat_id=7, text=str(n))) for n in range(3)]
+        futures.append(outbox.submit(SendMessage(chat_id=8, text="other")))
+        await asyncio.gather(*futures)
+        await outbox.stop()
+
+    run(scenario())
+    chat_calls = [(at, params["text"]) for at, params in api.calls("sendMessage") if params["chat_id"] == "7"]
+    assert [text for _, text in chat_calls] == ["0", "1", "2"]
+    gaps = [b - a for (a, _), (b, _) in zip(chat_calls, chat_calls[1:])]
+    assert min(gaps) >= 0.2 * 0.9
+    # Другой чат не ждет паузы первого
+    other_at = api.calls("sendMessage")[1][0]
+    assert other_at - chat_calls[0][0] < 0.2
+
+
+def test_retry_after_requeues_and_pauses(run, api, make_scheduler):
+    outbox = make_scheduler()
+    api.flood_once.add("sendMessage")
+
+    async def scenario():
+        result = await outbox.submit(SendMessage(chat_id=5, text="hello"))
+        await outbox.stop()
+        return result
+
+    result = run(scenario())
+    calls = api.calls("sendMessage")
+    assert len(calls) == 2
+    assert calls[1][0] - calls[0][0] >= 0.9
+    assert result.text == "hello"
+    assert outbox.stats()["retried"] == 1
+    assert outbox.stats()["failed"] == 0
+
+
+def test_retry_after_gives_up_after_max_retries(run, api, make_scheduler):
+    outbox = make_scheduler(max_retries=0)
+    api.flood_once.add("sendMessage")
+
+    async def scenario():
+        with pytest.raises(TelegramRetryAfter):
+            await outbox.submit(SendMessage(chat_id=5, text="hello"))
+        await outbox.stop()
+
+    run(scenario())
+    assert len(api.calls("sendMessage")) == 1
+    assert outbox.stats()["failed"] == 1
+
+
+def test_pending_edits_of_one_message_are_coalesced(run, api, make_scheduler):
+    outbox = make_scheduler()
+
+    async def scenario():
+        first = outbox.submit(EditMessageText(chat_id=3, message_id=10, text="first"))
+        second = outbox.submit(EditMessageText(chat_id=3, message_id=10, text="second"))
+        assert first is second
+        await first
+        await outbox.stop()
+
+    run(scenario())
+    edits = api.calls("editMessageText")
+    assert [params["text"] for _, params in edits] == ["second"]
+    assert outbox.stats()["coalesced"] == 1
+
+
+def test_high_priority_overtakes_broadcast(run, api, make_scheduler):
+    outbox = make_scheduler(global_rate=20)
+
+    async def scenario():
+        futures = [outbox.submit(SendMessage(chat_id=chat_id, text="news"), LOW) for chat_id in range(100, 110)]
+        await asyncio.sleep(0.12)
+        futures.append(outbox.submit(SendMessage(chat_id=1, text="reply"), HIGH))
+        await asyncio.gather(*futures)
+        await outbox.stop()
+
+    run(scenario())
+    texts = [params["text"] for _, params in api.calls("sendMessage")]
+    assert texts.index("reply") < 6
+
+
+def test_documents_go_through_the_queue(run, api, make_scheduler):
+    outbox = make_scheduler(chat_interval=0.1)
+    message = Message(message_id=1, date=datetime.now(), chat=Chat(id=9, type="private"))
+
+    async def scenario():
+        await asyncio.gather(
+            outbox.answer(message, "snapshot"),
+            outbox.answer_document(message, BufferedInputFile(b"tg_id,tokens\n", "airdrop.csv"), caption="sha256: x")
+        )
+        await outbox.stop()
+
+    run(scenario())
+    assert [name for name, _, _ in api.requests] == ["sendMessage", "sendDocument"]
+    (first, _), (second, params) = api.calls("sendMessage")[0], api.calls("sendDocument")[0]
+    assert params["caption"] == "sha256: x"
+    assert second - first >= 0.1 * 0.9
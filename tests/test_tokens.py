@@ -0,0 +1,69 @@
+import hashlib
+import json
+import os
+
+from database import AsyncSessionLocal
+from cache import user_cache
+from models import User
+from tokens import add_tokens, export_airdrop_snapshot, format_minor
+
+
+async def _user(tg_id=1):
+    async with AsyncSessionLocal() as session:
+        user = User(tg_id=tg_id, username=f"u{tg_id}")
+        session.add(user)
+        await session.commit()
+        return user.id
+
+
+def test_add_tokens_drops_cached_state(run, db):
+    async def scenario():
+        user_id = await _user()
+        await user_cache.set(1, {"balance_token": 0.0})
+
+        async with AsyncSessionLocal() as session:
+            assert await add_tokens(user_id, 2.5, session) == 2.5
+        assert await user_cache.get(1) is None
+
+    run(scenario())
+
+
+def _sha256_sidecar_ok(path):
+    """Проверка так же, как sha256sum -c: хэш и имя файла из .sha256"""
+    with open(f"{path}.sha256") as f:
+        digest, name = f.read().split()
+    with open(os.path.join(os.path.dirname(path), name), "rb") as f:
+        return name == os.path.basename(path) and hashlib.sha256(f.read()).hexdigest() == digest
+
+
+def test_format_minor_is_exact():
+    assert [format_minor(value) for value in (0, 5, 12345, -1999)] == ["0.00", "0.05", "123.45", "-19.99"]
+
+
+def test_airdrop_snapshot_matches_sidecars(run, db, tmp_path):
+    async def scenario():
+        async with AsyncSessionLocal() as session:
+            session.add_all([
+                User(tg_id=tg_id, balance_token_minor=minor)
+                for tg_id, minor in [(10, 150), (11, 0), (12, 99), (13, 1000001), (14, 250)]
+            ])
+            await session.commit()
+            # Пачки меньше числа строк: файлы собираются из нескольких кусков
+            return await export_airdrop_snapshot(session, str(tmp_path), min_balance=1, chunk_size=2)
+
+    summary = run(scenario())
+    assert (summary["holders"], summary["total_tokens"]) == (3, "10004.01")
+
+    with open(summary["csv"]) as f:
+        assert f.read() == "tg_id,balance_token\n10,1.50\n13,10000.01\n14,2.50\n"
+    with open(summary["jsonl"]) as f:
+        assert [json.loads(line) for line in f] == [
+            {"tg_id": 10, "balance_token": "1.50"},
+            {"tg_id": 13, "balance_token": "10000.01"},
+            {"tg_id": 14, "balance_token": "2.50"},
+        ]
+
+    for path, key in ((summary["csv"], "csv_sha256"), (summary["jsonl"], "jsonl_sha256")):
+        assert _sha256_sidecar_ok(path)
+        with open(path, "rb") as f:
+            assert hashlib.sha256(f.read()).hexdigest() == summary[key]
@@ -0,0 +1,153 @@
+import asyncio
+
+import httpx
+import pytest
+from aiogram.types import Update
+
+import api
+from webhook_queue import UpdateQueue, chat_key
+
+
+def message_update(update_id: int, chat_id: int, text: str = "hi") -> Update:
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Racer"},
+            "text": text
+        }
+    })
+
+
+def test_chat_key_prefers_chat_and_survives_unknown_types():
+    assert chat_key(message_update(1, 42)) == 42
+    # Тип апдейта, которого aiogram не знает: event недоступен
+    assert chat_key(Update(update_id=5)) == 5
+
+
+def test_updates_of_one_chat_keep_order(run):
+    handled = []
+
+    async def process(update):
+        # Первый апдейт каждого чата обрабатывается дольше остальных
+        await asyncio.sleep(0.02 if update.message.text == "0" else 0)
+        handled.append((update.message.chat.id, update.message.text))
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=4, maxsize=100, dedup_window=100)
+        queue.start()
+        update_id = 0
+        for n in range(5):
+            for chat_id in (1, 2, 3):
+                update_id += 1
+                assert queue.submit(message_update(update_id, chat_id, str(n)))
+        await queue.stop()
+        return queue
+
+    queue = run(scenario())
+    for chat_id in (1, 2, 3):
+        assert [text for chat, text in handled if chat == chat_id] == ["0", "1", "2", "3", "4"]
+    assert queue.stats()["processed"] == 15
+
+
+def test_duplicates_dropped_within_window(run):
+    handled = []
+
+    async def process(update):
+        handled.append(update.update_id)
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=1, maxsize=100, dedup_window=2)
+        queue.start()
+        for update_id in (1, 2, 1, 2, 3, 1):
+            assert queue.submit(message_update(update_id, 7))
+        await queue.stop()
+        return queue
+
+    queue = run(scenario())
+    # 1 выпал из окна (2 последних id) после прихода 3 - его повторная доставка уже не дубль
+    assert handled == [1, 2, 3, 1]
+    assert queue.stats()["duplicates"] == 2
+
+
+def test_stop_drains_pending_updates(run):
+    handled = []
+
+    async def process(update):
+        await asyncio.sleep(0.01)
+        handled.append(update.update_id)
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=2, maxsize=100, dedup_window=100)
+        queue.start()
+        for update_id in range(1, 21):
+            queue.submit(message_update(update_id, update_id))
+        assert queue.depth() > 0
+        await queue.stop()
+        return queue
+
+    queue = run(scenario())
+    assert sorted(handled) == list(range(1, 21))
+    assert queue.depth() == 0
+
+
+def test_failed_update_does_not_stop_worker(run):
+    handled = []
+
+    async def process(update):
+        if update.update_id == 1:
+            raise RuntimeError("boom")
+        handled.append(update.update_id)
+
+    async def scenario():
+        queue = UpdateQueue(process, workers=1, maxsize=10, dedup_window=10)
+        queue.start()
+        queue.submit(message_update(1, 7))
+        queue.submit(message_update(2, 7))
+        await queue.stop()
+        return queue
+
+    queue = run(scenario())
+    assert handled == [2]
+    assert queue.stats()["failed"] == 1
+
+
+# ---------- ВЕБХУК ----------
+@pytest.fixture
+def webhook(run, monkeypatch):
+    """Вебхук с маленькой незапущенной очередью: апдейты копятся, не обрабатываясь"""
+    async def process(update):
+        pass
+
+    queue = UpdateQueue(process, workers=1, maxsize=1, dedup_window=100)
+    monkeypatch.setattr(api, "update_queue", queue)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://test")
+
+    def post(payload):
+        return run(client.post("/webhook", json=payload))
+
+    yield post, queue
+    run(client.aclose())
+
+
+def test_webhook_full_queue_is_503_and_redelivery_accepted(webhook):
+    post, queue = webhook
+    first = message_update(1, 7).model_dump(mode="json", exclude_none=True, by_alias=True)
+    second = message_update(2, 8).model_dump(mode="json", exclude_none=True, by_alias=True)
+
+    assert post(first).status_code == 200
+    assert post(second).status_code == 503
+    assert queue.stats()["rejected"] == 1
+
+    # Место освободилось - повторная доставка того же апдейта принимается
+    queue._queues[0].get_nowait()
+    assert post(second).status_code == 200
+
+
+def test_webhook_accepts_unknown_update_type(webhook):
+    post, queue = webhook
+    response = post({"update_id": 5, "some_future_update": {"id": 1}})
+    assert response.status_code == 200
+    assert queue.depth() == 1
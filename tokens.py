@@ -1,12 +1,108 @@
-async def add_tokens(user_id: int, amount: float, session):
-    user = await session.get(User, user_id)
-    user.balance_token += amount
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime
+
+import aiofiles
+from sqlalchemy import select
+
+from config import AIRDROP_EXPORT_DIR
+from models import User, MINOR_UNITS
+import ledger
+from leaderboard import leaderboard
+from repository import user_changed
+
+async def add_tokens(user_id: int, amount: float, session, reason: str = "add_tokens"):
+    _, token_minor = await ledger.apply(session, user_id, tokens=amount, reason=reason)
     await session.commit()
-    return user.balance_token
+    user = await session.get(User, user_id)
+    await user_changed(user.tg_id)
+    leaderboard.observe(user)
+    return ledger.from_minor(token_minor)
+
+def format_minor(value: int) -> str:
+    """Точная десятичная запись суммы в центах, без float: 12345 -> '123.45'"""
+    sign = "-" if value < 0 else ""
+    units, cents = divmod(abs(value), MINOR_UNITS)
+    return f"{sign}{units}.{cents:02d}"
+
+# ---------- СНАПШОТ ДЛЯ AIRDROP ----------
+async def export_airdrop_snapshot(session, out_dir: str = AIRDROP_EXPORT_DIR, min_balance: float = 0,
+                                  chunk_size: int = 1000):
+    """Потоково выгружает балансы токенов в CSV и JSONL.
+
+    Читаются только tg_id и баланс, пачками по chunk_size строк, и каждая
+    пачка сразу дописывается в файлы - память не зависит от числа игроков.
+    Рядом с каждым файлом кладется .sha256 в формате sha256sum.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    taken_at = datetime.utcnow()
+    base = os.path.join(out_dir, f"airdrop_{taken_at:%Y%m%d_%H%M%S}")
+    csv_path, jsonl_path = f"{base}.csv", f"{base}.jsonl"
+
+    query = (
+        select(User.tg_id, User.balance_token_minor)
+        .where(User.balance_token_minor > ledger.to_minor(min_balance))
+        .order_by(User.id)
+        .execution_options(yield_per=chunk_size)
+    )
+
+    csv_hash, jsonl_hash = hashlib.sha256(), hashlib.sha256()
+    holders, total_minor = 0, 0
+
+    async with aiofiles.open(csv_path, "w", newline="") as csv_file, \
+            aiofiles.open(jsonl_path, "w") as jsonl_file:
+        header = "tg_id,balance_token\n"
+        csv_hash.update(header.encode())
+        await csv_file.write(header)
+
+        result = await session.stream(query)
+        async for partition in result.partitions():
+            csv_chunk = "".join(f"{tg_id},{format_minor(minor)}\n" for tg_id, minor in partition)
+            jsonl_chunk = "".join(
+                json.dumps({"tg_id": tg_id, "balance_token": format_minor(minor)}) + "\n"
+                for tg_id, minor in partition
+            )
+            csv_hash.update(csv_chunk.encode())
+            jsonl_hash.update(jsonl_chunk.encode())
+            await csv_file.write(csv_chunk)
+            await jsonl_file.write(jsonl_chunk)
+
+            holders += len(partition)
+            total_minor += sum(minor for _, minor in partition)
+
+    for path, digest in ((csv_path, csv_hash), (jsonl_path, jsonl_hash)):
+        async with aiofiles.open(f"{path}.sha256", "w") as f:
+            await f.write(f"{digest.hexdigest()}  {os.path.basename(path)}\n")
+
+    return {
+        "taken_at": taken_at.isoformat(),
+        "holders": holders,
+        "total_tokens": format_minor(total_minor),
+        "csv": csv_path,
+        "jsonl": jsonl_path,
+        "csv_sha256": csv_hash.hexdigest(),
+        "jsonl_sha256": jsonl_hash.hexdigest()
+    }
 
 # Проверка перед Airdrop (холдирование)
-async def hold_for_airdrop(session):
-    all_users = await session.execute(select(User))
-    snapshot = {user.tg_id: user.balance_token for user in all_users.scalars()}
-    # Отправляем в CSV для будущего Airdrop
-    return snapshot
\ No newline at end of file
+async def hold_for_airdrop(session, out_dir: str = AIRDROP_EXPORT_DIR):
+    return await export_airdrop_snapshot(session, out_dir)
+
+# ---------- ЗАПУСК ИЗ КОНСОЛИ ----------
+# python tokens.py --out airdrop --min-balance 1
+async def _main(args):
+    from database import AsyncSessionLocal
+
+    async with AsyncSessionLocal() as session:
+        summary = await export_airdrop_snapshot(session, args.out, args.min_balance, args.chunk_size)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Снапшот балансов GTR для аирдропа")
+    parser.add_argument("--out", default=AIRDROP_EXPORT_DIR, help="папка для файлов")
+    parser.add_argument("--min-balance", type=float, default=0, help="выгружать только балансы больше этого")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="строк на одну пачку чтения")
+    asyncio.run(_main(parser.parse_args()))
@@ -7,11 +7,27 @@ tg.ready();
 let tg_id = tg.initDataUnsafe?.user?.id;
 let userData = null;
 let carData = null;
+let stateVersion = null;  // версия последнего полученного состояния (ETag)
+
+// ---------- ПРИМЕНЕНИЕ СОСТОЯНИЯ С СЕРВЕРА ----------
+function applyState(state) {
+    userData = state;
+    carData = state.car;
+    stateVersion = state.version;
+    
+    // Обновляем UI
+    updateUI();
+}
 
 // ---------- ЗАГРУЗКА ДАННЫХ ПРИ СТАРТЕ ----------
 async function loadUserData() {
     try {
-        const response = await fetch(`/api/user/${tg_id}`);
+        // Условный запрос: если состояние не менялось, сервер ответит 304 без тела
+        const headers = stateVersion ? {'If-None-Match': `"${stateVersion}"`} : {};
+        const response = await apiFetch(`/api/user/${tg_id}`, {headers});
+        
+        if (response.status === 304) return;
+        
         const data = await response.json();
         
         if (data.error) {
@@ -19,11 +35,7 @@ async function loadUserData() {
             return;
         }
         
-        userData = data;
-        carData = data.car;
-        
-        // Обновляем UI
-        updateUI();
+        applyState(data);
     } catch (error) {
         console.error('Error loading user data:', error);
         showNotification('Ошибка загрузки данных', 'error');
@@ -111,7 +123,7 @@ function updateUI() {
 // ---------- НАСТРОЙКА КЛАПАНОВ (БЕЗ МИНИ-ИГР) ----------
 async function tuneValves() {
     try {
-        const response = await fetch(`/api/tune/valves/${tg_id}`, {
+        const response = await apiFetch(`/api/tune/valves/${tg_id}`, {
             method: 'POST'
         });
         
@@ -122,8 +134,8 @@ async function tuneValves() {
         } else {
             showNotification(result.message, result.success ? 'success' : 'error');
             
-            // Обновляем данные
-            await loadUserData();
+            // Сервер вернул новое состояние - перезапрашивать не нужно
+            applyState(result.state);
         }
     } catch (error) {
         showNotification('Ошибка настройки', 'error');
@@ -133,7 +145,7 @@ async function tuneValves() {
 // ---------- НАСТРОЙКА ДВИГАТЕЛЯ ----------
 async function tuneEngine() {
     try {
-        const response = await fetch(`/api/tune/engine/${tg_id}`, {
+        const response = await apiFetch(`/api/tune/engine/${tg_id}`, {
             method: 'POST'
         });
         
@@ -143,7 +155,7 @@ async function tuneEngine() {
             showNotification(result.error, 'error');
         } else {
             showNotification(result.message, 'success');
-            await loadUserData();
+            applyState(result.state);
         }
     } catch (error) {
         showNotification('Ошибка настройки', 'error');
@@ -156,7 +168,7 @@ async function upgradeTurbo() {
     const level = parseInt(select.value);
     
     try {
-        const response = await fetch(`/api/upgrade/turbo/${tg_id}?level=${level}`, {
+        const response = await apiFetch(`/api/upgrade/turbo/${tg_id}?level=${level}`, {
             method: 'POST'
         });
         
@@ -166,7 +178,7 @@ async function upgradeTurbo() {
             showNotification(result.error, 'error');
         } else {
             showNotification(result.message, 'success');
-            await loadUserData();
+            applyState(result.state);
         }
     } catch (error) {
         showNotification('Ошибка покупки', 'error');
@@ -179,7 +191,7 @@ async function upgradeSuspension() {
     const level = parseInt(select.value);
     
     try {
-        const response = await fetch(`/api/upgrade/suspension/${tg_id}?level=${level}`, {
+        const response = await apiFetch(`/api/upgrade/suspension/${tg_id}?level=${level}`, {
             method: 'POST'
         });
         
@@ -189,7 +201,7 @@ async function upgradeSuspension() {
             showNotification(result.error, 'error');
         } else {
             showNotification(result.message, 'success');
-            await loadUserData();
+            applyState(result.state);
         }
     } catch (error) {
         showNotification('Ошибка покупки', 'error');
@@ -203,7 +215,7 @@ async function upgradeSubwoofer() {
     const genre = document.getElementById('musicGenre').value;
     
     try {
-        const response = await fetch(`/api/upgrade/subwoofer/${tg_id}?level=${level}&brand=${brand}&genre=${genre}`, {
+        const response = await apiFetch(`/api/upgrade/subwoofer/${tg_id}?level=${level}&brand=${brand}&genre=${genre}`, {
             method: 'POST'
         });
         
@@ -213,7 +225,7 @@ async function upgradeSubwoofer() {
             showNotification(result.error, 'error');
         } else {
             showNotification(result.message, 'success');
-            await loadUserData();
+            applyState(result.state);
         }
     } catch (error) {
         showNotification('Ошибка установки', 'error');
@@ -228,7 +240,7 @@ async function upgradeEngine() {
 // ---------- ГОНКА С БОТОМ ----------
 async function raceWithBot() {
     try {
-        const response = await fetch(`/api/race/bot/${tg_id}`, {
+        const response = await apiFetch(`/api/race/bot/${tg_id}`, {
             method: 'POST'
         });
         
@@ -238,7 +250,7 @@ async function raceWithBot() {
             showNotification(result.error, 'error');
         } else {
             showNotification(result.message, result.is_winner ? 'success' : 'error');
-            await loadUserData();
+            applyState(result.state);
         }
     } catch (error) {
         showNotification('Ошибка гонки', 'error');
@@ -278,9 +290,31 @@ document.querySelectorAll('.tab-btn').forEach(btn => {
     });
 });
 
+// ---------- ОБНОВЛЕНИЕ ПРИ ВОЗВРАТЕ В ПРИЛОЖЕНИЕ ----------
+// Дешево благодаря условному GET: без изменений сервер отвечает 304
+document.addEventListener('visibilitychange', () => {
+    if (!document.hidden && tg_id) loadUserData();
+});
+
+// ---------- PUSH-ОБНОВЛЕНИЯ ----------
+// Изменения из других окон и из бота (донат, гонка) приходят без перезапроса
+function subscribeToUpdates() {
+    openEvents(tg_id, [], {
+        user: (data) => {
+            if (data.state) {
+                if (data.state.version !== stateVersion) applyState(data.state);
+            } else {
+                loadUserData();
+            }
+        },
+        resync: () => loadUserData()
+    });
+}
+
 // ---------- ЗАГРУЗКА ПРИ СТАРТЕ ----------
 if (tg_id) {
     loadUserData();
+    subscribeToUpdates();
 } else {
     showNotification('Ошибка: не удалось получить ID пользователя', 'error');
 }
\ No newline at end of file
@@ -0,0 +1,31 @@
+// ---------- АВТОРИЗАЦИЯ ----------
+// Подпись initData сервер проверяет один раз, дальше запросы идут с коротким токеном
+let authToken = null;
+
+async function authorize() {
+    const response = await fetch('/api/auth', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({init_data: window.Telegram.WebApp.initData})
+    });
+    const result = await response.json();
+    authToken = result.token || null;
+    return authToken;
+}
+
+// fetch с токеном; если сессия истекла - авторизуемся заново и повторяем один раз
+async function apiFetch(url, options = {}) {
+    if (!authToken) await authorize();
+    
+    const send = () => fetch(url, {
+        ...options,
+        headers: {...(options.headers || {}), 'Authorization': `Bearer ${authToken}`}
+    });
+    
+    let response = await send();
+    if (response.status === 401) {
+        await authorize();
+        response = await send();
+    }
+    return response;
+}
@@ -0,0 +1,33 @@
+// ---------- PUSH-СОБЫТИЯ ----------
+// Поток событий с сервера (SSE): handlers = {имя события: функция(data)}.
+// Событие resync приходит, если клиент отстал и часть событий потеряна -
+// обработчик должен перечитать состояние целиком. Его же вызываем после
+// переподключения: пока соединения не было, события могли пройти мимо.
+async function openEvents(tg_id, topics, handlers) {
+    if (!authToken) await authorize();
+    
+    const params = new URLSearchParams({token: authToken, topics: topics.join(',')});
+    const source = new EventSource(`/api/events/${tg_id}?${params.toString()}`);
+    let connectedOnce = false;
+    
+    source.onopen = () => {
+        if (connectedOnce && handlers.resync) handlers.resync({});
+        connectedOnce = true;
+    };
+    
+    for (const [name, handler] of Object.entries(handlers)) {
+        source.addEventListener(name, (event) => handler(JSON.parse(event.data)));
+    }
+    
+    // Обрыв сети EventSource переживает сам; закрытый поток (истек токен,
+    // лимит соединений) открываем заново с новым токеном
+    source.onerror = () => {
+        if (source.readyState !== EventSource.CLOSED) return;
+        setTimeout(async () => {
+            await authorize();
+            openEvents(tg_id, topics, handlers);
+        }, 5000);
+    };
+    
+    return source;
+}
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+from aiogram.types import Update
+from aiogram.types.update import UpdateTypeLookupError
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: Update) -> int:
+    """Ключ, по которому сохраняется порядок: чат, иначе пользователь, иначе update_id"""
+    try:
+        event = update.event
+    except UpdateTypeLookupError:
+        # Тип апдейта, которого aiogram еще не знает
+        return update.update_id
+    chat = getattr(event, "chat", None)
+    if chat is None and getattr(event, "message", None) is not None:
+        chat = event.message.chat
+    if chat is not None:
+        return chat.id
+
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return update.update_id
+
+
+class UpdateQueue:
+    """Очередь входящих апдейтов Telegram с пулом обработчиков.
+
+    Вебхук только кладет апдейт в очередь и сразу отвечает 200, обработка
+    идет в фоне. Апдейты одного чата всегда попадают к одному и тому же
+    обработчику, поэтому внутри чата порядок сохраняется. Очереди
+    ограничены: если места нет, submit() возвращает False и вебхук
+    отвечает ошибкой - Telegram доставит апдейт повторно позже.
+    Повторно доставленные апдейты (тот же update_id) отбрасываются.
+    """
+
+    def __init__(self, process, workers: int, maxsize: int, dedup_window: int):
+        self._process = process
+        self._queues = [asyncio.Queue(maxsize=max(1, maxsize // workers)) for _ in range(workers)]
+        self._tasks = []
+        self._seen = OrderedDict()
+        self._dedup_window = dedup_window
+
+        self.enqueued = 0
+        self.processed = 0
+        self.failed = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    # ---------- ПРИЕМ ----------
+    def _is_duplicate(self, update_id: int) -> bool:
+        if update_id in self._seen:
+            return True
+        self._seen[update_id] = None
+        while len(self._seen) > self._dedup_window:
+            self._seen.popitem(last=False)
+        return False
+
+    def submit(self, update: Update) -> bool:
+        """Поставить апдейт в очередь. False - очередь переполнена"""
+        if self._is_duplicate(update.update_id):
+            self.duplicates += 1
+            return True
+
+        queue = self._queues[chat_key(update) % len(self._queues)]
+        try:
+            queue.put_nowait(update)
+        except asyncio.QueueFull:
+            # Забываем update_id, чтобы повторная доставка не считалась дублем
+            self._seen.pop(update.update_id, None)
+            self.rejected += 1
+            return False
+
+        self.enqueued += 1
+        return True
+
+    # ---------- ОБРАБОТКА ----------
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            try:
+                await self._process(update)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Failed to process update %s", update.update_id)
+            finally:
+                queue.task_done()
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(queue)) for queue in self._queues]
+
+    async def stop(self, timeout: float = 10):
+        """Дождаться обработки того, что уже в очереди, и остановить пул"""
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Webhook queue not drained, %s updates dropped", self.depth())
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def stats(self):
+        return {
+            "depth": self.depth(),
+            "capacity": sum(queue.maxsize for queue in self._queues),
+            "workers": len(self._queues),
+            "enqueued": self.enqueued,
+            "processed": self.processed,
+            "failed": self.failed,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected
+        }